@@ -1,14 +1,461 @@
 import pygaze
 from pygaze import libtime
 # from constants import *
-from threading import Thread, Event
+from threading import Thread, Event, Lock, current_thread
 from framework.stuff import colored_text, encapsulate_text, print_threads
+from framework.random_streams import session_rng
+from framework.pygaze_framework import CallbackEvent
 import os.path
-from numpy.random import normal as gauss
-from numpy.random import poisson, choice, uniform, lognormal
-from numpy import exp
-from scipy.stats import exponnorm
+from numpy.random import poisson
+from scipy.special import ndtr, ndtri
+import numpy
 import time
+import heapq
+import itertools
+import traceback
+import select
+import socket
+
+
+class TransitionSampler(object):
+    """A transition matrix among micro states compiled into alias tables (Walker's alias method).
+
+    Every row of the matrix is validated and turned into two arrays once, so drawing the next micro state costs the
+    same no matter how many micro states there are, and the next micro states are always ordered by name instead of
+    by dict iteration. For each micro state a batch of next micro states is drawn in advance with one vectorized
+    call, so an agent usually only takes the next one from a list. Batches running low are refilled by :func:`prepare`,
+    which agents call after a new micro state was drawn, i.e. while they wait anyway.
+
+    :param trans_matrix: Transition probabilities, current micro state: {next micro state: probability}
+    :type trans_matrix: dict
+    :param batch_size: Number of transitions drawn in advance for each micro state
+    :type batch_size: int
+    :param low: Batches with fewer transitions left are refilled by :func:`prepare`, a quarter of the batch size if
+                None
+    :type low: int
+    :param tolerance: Allowed deviation of the sum of a row from one
+    :type tolerance: float
+    :param random_state: Random number generator, numpy's global one if None
+    :type random_state: :class:`numpy.random.RandomState`
+    :raises ValueError: if a row contains negative probabilities or does not sum to one
+    """
+
+    def __init__(self, trans_matrix, batch_size=64, low=None, tolerance=1e-6, random_state=None):
+        self.batch_size = batch_size
+        self.low = low if low is not None else batch_size // 4
+        self.random_state = random_state if random_state is not None else numpy.random
+        self.states = {}  # current micro state: next micro states
+        self.probs = {}  # current micro state: transition probabilities
+        self.tables = {}  # current micro state: probability and alias table
+        self.drawn = {}  # current micro state: next micro states drawn in advance
+        for state, row in trans_matrix.items():
+            next_states = sorted(row)
+            probs = numpy.array([row[next_state] for next_state in next_states], dtype=float)
+            if not len(probs) or (probs < 0).any() or abs(probs.sum() - 1.) > tolerance:
+                raise ValueError('Transition probabilities from ' + str(state) + ' have to be non-negative and sum to '
+                                 'one: ' + str(row))
+            self.states[state] = next_states
+            self.probs[state] = probs / probs.sum()
+            self.tables[state] = self.alias_table(self.probs[state])
+            self.drawn[state] = []
+
+    @staticmethod
+    def alias_table(probs):
+        """Build the alias table of a discrete distribution (Vose's method)
+
+        :param probs: Probabilities, summing to one
+        :type probs: :class:`numpy.ndarray`
+        :returns: probability to keep a column and the alias of each column
+        :rtype: tuple of :class:`numpy.ndarray`
+        """
+        n = len(probs)
+        scaled = probs * n
+        keep = numpy.ones(n)
+        alias = numpy.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1.]
+        large = [i for i in range(n) if scaled[i] >= 1.]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            keep[less] = scaled[less]
+            alias[less] = more
+            scaled[more] -= 1. - scaled[less]
+            if scaled[more] < 1.:
+                small.append(more)
+            else:
+                large.append(more)
+        # columns left over are full up to rounding errors
+        return keep, alias
+
+    def draw_batch(self, state, size):
+        """Draw the given number of transitions from a micro state at once
+
+        :param state: Current micro state
+        :type state: str
+        :param size: Number of transitions
+        :type size: int
+        :returns: next micro states
+        :rtype: list
+        """
+        keep, alias = self.tables[state]
+        # one uniform number per draw: its integer part picks the column, its fractional part decides for the alias
+        columns, fractions = numpy.divmod(self.random_state.uniform(size=size) * len(keep), 1.)
+        columns = columns.astype(int)
+        indices = numpy.where(fractions < keep[columns], columns, alias[columns])
+        return [self.states[state][i] for i in indices]
+
+    def prepare(self):
+        """Draw a batch of transitions in advance for every micro state which has less than :attr:`low` left, they
+        are taken after the ones left
+        """
+        for state, drawn in sorted(self.drawn.items()):
+            if len(drawn) < self.low or not drawn:
+                drawn[:0] = self.draw_batch(state, self.batch_size)
+
+    def draw(self, state):
+        """Next micro state after the given one, the batch is only refilled here if :func:`prepare` was not called
+        in time
+
+        :param state: Current micro state
+        :type state: str
+        :raises KeyError: if there are no transitions from the micro state
+        """
+        drawn = self.drawn[state]
+        if not drawn:
+            drawn.extend(self.draw_batch(state, self.batch_size))
+        return drawn.pop()
+
+    def probability(self, state, next_state):
+        """Transition probability between two micro states
+        """
+        return self.probs[state][self.states[state].index(next_state)]
+
+
+class TimingDistribution(object):
+    """A distribution of micro state durations compiled from a parameter spec, with a pool of durations drawn in
+    advance.
+
+    A spec is ``[mu, sigma, lam, kind, bound]`` (``lam`` may be left out for kinds which do not use it):
+
+    - ``'gauss'``: normal distribution truncated to ``mu +- bound * sigma``
+    - ``'lognormal'``: log-normal distribution truncated to ``exp(mu +- bound * sigma)``
+    - ``'exgauss'``: ex-Gaussian distribution (see :data:`scipy.stats.exponnorm` with ``K = 1 / (sigma * lam)``)
+      truncated to its mean ``mu + lam`` plus/minus ``bound`` times its variance ``sigma**2 + 1 / lam**2``
+    - ``'nonrandom'``: always ``mu``
+
+    The pool is refilled with one vectorized call. Normal and log-normal durations are truncated by inverse transform
+    sampling within the bounds, so no values are rejected. Ex-Gaussian durations are drawn for the whole pool at once
+    and only the rejected ones are drawn again.
+
+    :param spec: Parameter spec
+    :type spec: list
+    :param pool_size: Number of durations drawn in advance
+    :type pool_size: int
+    :param random_state: Random number generator, numpy's global one if None
+    :type random_state: :class:`numpy.random.RandomState`
+    :raises NotImplementedError: if the kind of distribution is unknown
+    """
+
+    KINDS = ['gauss', 'lognormal', 'exgauss', 'nonrandom']
+    compiled = {}  # (spec, stream): distribution, shared by all agents drawing from the same stream
+
+    def __init__(self, spec, pool_size=64, random_state=None):
+        if len(spec) == 4:
+            # short spec without lam
+            spec = [spec[0], spec[1], None, spec[2], spec[3]]
+        self.mu, self.sigma, self.lam, self.kind, self.bound = spec
+        if self.kind not in self.KINDS:
+            print('Error in get_new_waiting_time() for distribution type:')
+            print(self.kind)
+            raise(NotImplementedError('Defined random distribution not implemented'))
+        self.pool_size = pool_size
+        self.random_state = random_state if random_state is not None else numpy.random
+        self.pool = []
+        self.lock = Lock()  # the pool is shared by all agents drawing from the same spec and stream
+        bound = self.bound if self.bound is not None else numpy.inf
+        if self.kind in ['gauss', 'lognormal']:
+            # probabilities of the bounds in the standard normal distribution
+            self.p_low, self.p_high = ndtr(-bound), ndtr(bound)
+        elif self.kind == 'exgauss':
+            mean_ex = self.mu + self.lam
+            var_ex = self.sigma ** 2 + (1 / self.lam ** 2)
+            self.low, self.high = mean_ex - bound * var_ex, mean_ex + bound * var_ex
+
+    @classmethod
+    def get(cls, spec, random_state=None):
+        """Compiled distribution of a spec, it is compiled on first use
+
+        :param spec: Parameter spec
+        :type spec: list
+        :param random_state: Random number stream the durations are drawn from, numpy's global one if None
+        :type random_state: :class:`numpy.random.RandomState`
+        :rtype: TimingDistribution
+        """
+        key = (tuple(spec), id(random_state))
+        distribution = cls.compiled.get(key)
+        if distribution is None:
+            distribution = cls.compiled[key] = cls(spec, random_state=random_state)
+        return distribution
+
+    @classmethod
+    def is_spec(cls, value):
+        """Whether a value looks like a parameter spec"""
+        return type(value) in [list, tuple] and len(value) in [4, 5] and value[-2] in cls.KINDS
+
+    def sample(self, size):
+        """Draw durations at once
+
+        :param size: Number of durations
+        :type size: int
+        :rtype: :class:`numpy.ndarray`
+        """
+        if self.kind == 'nonrandom':
+            return numpy.repeat(float(self.mu), size)
+        if self.kind in ['gauss', 'lognormal']:
+            # inverse transform sampling within the bounds
+            values = self.mu + self.sigma * ndtri(self.random_state.uniform(self.p_low, self.p_high, size))
+            return values if self.kind == 'gauss' else numpy.exp(values)
+        values = numpy.empty(0)
+        while len(values) < size:
+            drawn = self.random_state.normal(self.mu, self.sigma, size) + \
+                self.random_state.exponential(1. / self.lam, size)
+            values = numpy.append(values, drawn[(drawn > self.low) & (drawn < self.high)])
+        return values[:size]
+
+    def draw(self):
+        """Next duration from the pool, the pool is refilled if it is empty"""
+        with self.lock:
+            if not self.pool:
+                self.pool.extend(self.sample(self.pool_size).tolist())
+            return self.pool.pop()
+
+
+def socket_pair():
+    """A pair of connected sockets, :func:`socket.socketpair` is missing on Windows in python 2"""
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server = listener.accept()[0]
+    listener.close()
+    return server, client
+
+
+class AgentScheduler(Thread):
+    """A single thread running all scheduled agents (see :class:`ScheduledBehavior`) instead of one thread per agent.
+
+    Callbacks are kept in a heap ordered by their due time, callbacks due at the same time run in the order they were
+    scheduled. A callback can be bound to an interrupt event (:class:`pygaze_framework.CallbackEvent`), it is then run
+    as soon as the event is set, like :meth:`threading.Event.wait` returning early. In between, the thread sleeps until
+    the next callback is due or a new one is scheduled by another thread. It sleeps on a socket, as a timed wait of
+    python 2 polls with up to 50 ms delay.
+
+    :param name: Name of the scheduler thread
+    :type name: str
+    """
+
+    def __init__(self, name='AgentScheduler'):
+        Thread.__init__(self, name=name)
+        self.daemon = True
+        self.lock = Lock()
+        self.start_lock = Lock()
+        self.queue = []  # heap of callbacks [due, count, callback, args, interrupt, expedite]
+        self.counter = itertools.count()
+        self.wake_in, self.wake_out = None, None  # sockets to wake the sleeping thread, created on start
+
+    def ensure_started(self):
+        """Start the scheduler thread if it is not running yet"""
+        with self.start_lock:
+            if not self.is_alive():
+                self.wake_in, self.wake_out = socket_pair()
+                self.wake_out.setblocking(False)
+                self.start()
+
+    def call_later(self, delay, callback, args=(), interrupt=None):
+        """Schedule a callback
+
+        :param delay: Delay in [ms], the callback is only run by the interrupt if None
+        :type delay: float
+        :param callback: Function called by the scheduler thread
+        :type callback: callable
+        :param args: Arguments of the callback
+        :type args: tuple
+        :param interrupt: Event to run the callback early
+        :type interrupt: :class:`pygaze_framework.CallbackEvent`
+        :return: the scheduled callback, see :meth:`cancel`
+        """
+        due = libtime.get_time() + max(delay, 0) if delay is not None else None
+        timeout = [due, next(self.counter), callback, args, interrupt, None]
+        if interrupt is not None:
+            timeout[5] = lambda: self.expedite(timeout)
+            interrupt.when_set(timeout[5])
+        if due is not None:  # callbacks only run by the interrupt are not queued
+            with self.lock:
+                heapq.heappush(self.queue, timeout)
+                is_next = self.queue[0] is timeout
+            if is_next:
+                self.wake()
+        return timeout
+
+    def call_soon(self, callback, args=()):
+        """Schedule a callback to run as soon as possible, after the callbacks already due"""
+        return self.call_later(0, callback, args)
+
+    def cancel(self, timeout):
+        """Cancel a scheduled callback
+
+        :return: the callback and its arguments if it was still pending, otherwise None
+        """
+        with self.lock:
+            callback, timeout[2] = timeout[2], None
+        if timeout[4] is not None:
+            timeout[4].discard(timeout[5])
+        return (callback, timeout[3]) if callback is not None else None
+
+    def expedite(self, timeout):
+        """Run a scheduled callback as soon as possible, called when its interrupt event is set"""
+        pending = self.cancel(timeout)
+        if pending is not None:
+            self.call_soon(*pending)
+
+    def wake(self):
+        """Wake the sleeping scheduler thread to look at the scheduled callbacks again"""
+        if self.wake_out is None or current_thread() is self:
+            return
+        try:
+            self.wake_out.send(b'.')
+        except socket.error:
+            pass  # the socket is full of wake ups already
+
+    def sleep(self, timeout):
+        """Sleep until woken or the timeout in [ms] passed, forever if None"""
+        readable = select.select([self.wake_in], [], [], timeout / 1000. if timeout is not None else None)[0]
+        if readable:
+            self.wake_in.recv(4096)
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.queue and self.queue[0][2] is None:
+                    heapq.heappop(self.queue)  # drop cancelled callbacks
+                timeout, wait = None, None
+                if self.queue:
+                    wait = self.queue[0][0] - libtime.get_time()
+                    if wait <= 0:
+                        timeout = heapq.heappop(self.queue)
+                        callback, timeout[2] = timeout[2], None
+            if timeout is None:
+                self.sleep(wait)
+                continue
+            if timeout[4] is not None:
+                timeout[4].discard(timeout[5])
+            try:
+                callback(*timeout[3])
+            except Exception:
+                traceback.print_exc()
+
+
+agent_scheduler = AgentScheduler()  # runs all scheduled agents, started by the first one
+
+
+class ScheduledBehavior(object):
+    """
+    Parent class of behaviors run by the :data:`agent_scheduler` instead of their own thread.
+
+    The behavior is written in :meth:`run` as a generator. Instead of blocking it yields what it waits for, i.e.
+    :meth:`sleep`, :meth:`wait_until` or :meth:`acquire`, and is resumed by the scheduler once that happened. Scheduled
+    behaviors keep the thread interface (start, is_alive and join).
+    """
+
+    def __init__(self):
+        self.scheduler = agent_scheduler
+        self.started = False
+        self.done = Event()  # Set when the behavior finished
+        self.behavior = None
+
+    def start(self):
+        """
+        Start the behavior, it is run by the scheduler
+        """
+        self.started = True
+        self.scheduler.ensure_started()
+        self.behavior = self.run()
+        self.scheduler.call_soon(self.resume)
+
+    def run(self):
+        """
+        The behavior, a generator yielding what it waits for
+        """
+        raise NotImplementedError
+
+    def resume(self, value=None):
+        """
+        Run the behavior until it waits again, a behavior raising an error is finished like a thread ending with an
+        exception
+
+        :param value: Result of what the behavior waited for
+        """
+        try:
+            command = self.behavior.send(value)
+            command(lambda *result: self.scheduler.call_soon(self.resume, result[:1]))
+        except StopIteration:
+            self.finish()
+        except Exception:
+            print(colored_text('Exception in ' + str(getattr(self, 'name', self)) + ':', 'red'))
+            traceback.print_exc()
+            self.finish()
+
+    def sleep(self, delay, interrupt=None):
+        """
+        Wait for a time (use as ``yield self.sleep(delay)``)
+
+        :param delay: Time to wait in [ms], until the interrupt event is set if None
+        :type delay: float
+        :param interrupt: Event to stop waiting early, e.g. the break_event
+        :type interrupt: :class:`pygaze_framework.CallbackEvent`
+        """
+        return lambda resume: self.scheduler.call_later(delay, resume, interrupt=interrupt)
+
+    def wait_until(self, event, timeout=None):
+        """
+        Wait until an event is set (use as ``yield self.wait_until(event)``)
+
+        :param event: The event
+        :type event: :class:`pygaze_framework.CallbackEvent`, :class:`pygaze_framework.MyEvent`
+        :param timeout: Maximum time to wait in [ms], forever if None
+        :type timeout: float
+        """
+        return self.sleep(timeout, event)
+
+    def acquire(self, lock):
+        """
+        Wait until a lock is acquired (use as ``yield self.acquire(lock)``), it has to be released again
+
+        :param lock: The lock, e.g. draw_lock or blinking
+        :type lock: :class:`pygaze_framework.CallbackLock`
+        """
+        return lambda resume: lock.when_acquired(resume)
+
+    def finish(self):
+        """
+        Mark the behavior as finished
+        """
+        self.done.set()
+
+    def is_alive(self):
+        return self.started and not self.done.is_set()
+
+    isAlive = is_alive
+
+    def join(self, timeout=None):
+        """
+        Wait until the behavior finished
+
+        :param timeout: Maximum time in [s] to wait
+        :type timeout: float
+        """
+        self.done.wait(timeout)
 
 
 class AgentMacroBehavior(Thread):
@@ -38,8 +485,9 @@ class AgentMacroBehavior(Thread):
     :type age_group: string
     :param accept_key_input: Indicating whether a trial can be terminated via a button press
     :type accept_key_input: Boolean
-    :param save_trigger: ???
-    :type save_trigger: ??? tobii logger
+    :param save_trigger: Function recording a marker in the eyetracking data at the end of each macro state,
+                         e.g. :func:`LogManager.TobiiDumper.mark`
+    :type save_trigger: callable
     :param gamehub: Keeps track of scores gained via successful JA
     :type gamehub: :class:`jap_pygaze_framework`
     :param accumulative_agents: All macro states that are possible in the given study
@@ -66,6 +514,7 @@ class AgentMacroBehavior(Thread):
         # -- MACRO BEHAVIOR STUFF
         self.macrostates_always_on = list_behavior_always_on  # List of macro states that are always expressed (blinks)
         self.point_scr_dur = point_scr_dur  # Interval from which duration of point screen is drawn uniformly
+        self.random_state = session_rng.numpy('AgentMacroBehavior')  # Random numbers of the macro behavior
         self.behavioral_sequence = behavioral_sequence  # List containing sequence of macro behavioral states
 
         # -- HI stuff
@@ -85,7 +534,7 @@ class AgentMacroBehavior(Thread):
         self.trans_dict = trans_dict  # Dictionary translating between AOIs and agent's gaze directions
 
         # MISC
-        self.save_trigger = save_trigger  # function to save exe tracker data
+        self.save_trigger = save_trigger  # function to mark the end of a trial in the eyetracking data
         self.gamehub = gamehub  # Add game hub for keeping track of scores
         # -- AGENT STUFF
         self.accumulative_agents = accumulative_agents  # List of all accumulative agents (BJFRGN)
@@ -165,8 +614,7 @@ class AgentMacroBehavior(Thread):
             print_threads()  # Print running threads
 
             # Wait if something is being drawn right now
-            while self.draw.is_set():
-                pass
+            self.draw.join()
 
             # Create screens
             self.draw_lock.acquire()
@@ -255,13 +703,8 @@ class AgentMacroBehavior(Thread):
             print('Blinking agent finished')
 
             # Wait for all agents to finish
-            all_finished = False
-            while not all_finished:
-                all_finished = True
-                for a in agents_always_on:
-                    if a.is_alive():
-                        all_finished = False
-                        break
+            for a in agents_always_on:
+                a.join()
             print('All finished')
             self.trials_done += 1
             self.total_trials_done += 1
@@ -288,7 +731,7 @@ class AgentMacroBehavior(Thread):
                 self.draw_lock.acquire()
                 self.draw.set_micro_state(msg,  time=libtime.get_time())
                 if self.point_scr_dur:
-                    time.sleep(uniform(self.point_scr_dur[0], self.point_scr_dur[1]))
+                    time.sleep(self.random_state.uniform(self.point_scr_dur[0], self.point_scr_dur[1]))
                 self.draw.clear()
 
             # IF set AND enough points are reached, present reward video stimulus
@@ -327,14 +770,8 @@ class AgentMacroBehavior(Thread):
                 self.draw.set_micro_state('__wait_screen__', time=libtime.get_time())
                 self.draw.clear()
 
-            # SAVE EYETRACKING DATA
-            print(encapsulate_text("Don't panic! Just saving data.", color='red'))
-            save_start = libtime.get_time()
-            self.save_trigger.set()
-            self.save_trigger.clear()
-            self.save_trigger.wait()
-            print(encapsulate_text('Done saving. Took ' + str(round((libtime.get_time()-save_start)/1000, 2))+'s',
-                                   color='green'))
+            # MARK THE END OF THE TRIAL IN THE EYETRACKING DATA (written in the background)
+            self.save_trigger('end_' + macro_state['agent'])
             time.sleep(.1)  # (??) Warum solange? (used to be 2)
             self.agent_finished_event.clear()
 
@@ -343,6 +780,7 @@ class AgentMacroBehavior(Thread):
         self.draw.set_micro_state('__instruction_screen__', ' ')
         self.draw.clear()
         self.finished_event.set() # set event singaling that the entire behavioral sequence is completed
+        self.draw.set('__macro_finished__')  # wake up the drawing thread to finish
         print(encapsulate_text('Macro state sequence finished.'))
 
     def add_object(self, objct, name):
@@ -377,7 +815,7 @@ class Agent(Thread):
     """
 
     def __init__(self, cur_agt, draw, draw_lock, blinking, trans_matrix=None, questionnaire=None, finished_event=None,
-                 break_event=Event(), name='NullAgent'):
+                 break_event=CallbackEvent(), name='NullAgent'):
         Thread.__init__(self, name=name)
 
         self.time_start = libtime.get_time()  # Get agent start time
@@ -393,6 +831,12 @@ class Agent(Thread):
         print('Initializing Basic Agent class for ' + self.name)
         self.cur_agt = cur_agt  # Set current agent's appearance
         self.trans_matrix = trans_matrix  # Transition probability dictionary
+        self.random_state = session_rng.numpy(type(self).__name__)  # Random numbers of the agent's class
+        # Transition matrix compiled for drawing micro states, with transitions drawn in advance
+        self.transition_sampler = TransitionSampler(trans_matrix, random_state=self.random_state) if trans_matrix \
+            else None
+        if self.transition_sampler:
+            self.transition_sampler.prepare()
         self.getting_attention = False  # Will the agent try to get the HI's attention by rapid gaze shifts?
         self.does_know_correct = False
         self.gaze_down = False
@@ -402,7 +846,7 @@ class Agent(Thread):
         self.did_key_press = True
         self.daemon = True
         self.is_running = False
-        self.paused = Event()
+        self.paused = CallbackEvent()
 
         # Boolean indicating whether agent has some knowledge on what
         # object to gaze at
@@ -434,20 +878,26 @@ class Agent(Thread):
 
         """
 
-        rand_num = uniform()  # Sample a random number for a behavioral decision
         if self.does_know_correct:  # Behavior if agent has knowledge about correct object location
+            rand_num = self.random_state.uniform()  # Sample a random number for a behavioral decision
             if rand_num < self.p_correct_object:
                 return self.correct_aoi
             else:  # Get a wrong gaze direction
                 return self.get_wrong_gaze_direction()
         else:  # If not, change gaze direction according to transition probability matrix
-            cum_prob = 0.0
-            for gaze_direc, gaze_prob in self.trans_matrix[self.cur_agt].iteritems():
-                cum_prob += gaze_prob
-                if rand_num < cum_prob:
-                    print(colored_text(gaze_direc, 'red') + ' | ' + colored_text(str(gaze_prob), 'green'))
-                    print(colored_text('New gaze direction: ' + gaze_direc))
-                    return gaze_direc
+            gaze_direc = self.transition_sampler.draw(self.cur_agt)
+            gaze_prob = self.transition_sampler.probability(self.cur_agt, gaze_direc)
+            print(colored_text(gaze_direc, 'red') + ' | ' + colored_text(str(gaze_prob), 'green'))
+            print(colored_text('New gaze direction: ' + gaze_direc))
+            return gaze_direc
+
+    def prepare_transitions(self):
+        """
+        Refill the micro state transitions drawn in advance, called after a new micro state was drawn so it is not
+        done while the agent decides
+        """
+        if self.transition_sampler:
+            self.transition_sampler.prepare()
 
     def get_wrong_gaze_direction(self):
         """ Returns a gaze direction that is defined in self.possible_aois but not currently gazed at by the HI
@@ -455,50 +905,32 @@ class Agent(Thread):
         temp_aois = list(self.possible_aois)
         if self.cur_agt in temp_aois:
             temp_aois.remove(self.cur_agt)
-        return choice(temp_aois)
+        return temp_aois[self.random_state.randint(len(temp_aois))]
 
     def get_new_waiting_time(self, param):
         """
-        Method to sample a micro state duration
+        Method to sample a micro state duration, see :class:`TimingDistribution` for the parameter spec
 
         :raises: NotImplementedError
         """
+        return TimingDistribution.get(param, self.random_state).draw()
 
-        if param[3] == 'gauss':
-            l_bound = param[0] - param[4]*param[1]
-            u_bound = param[0] + param[4]*param[1]
-            while True:
-                value = gauss(loc=param[0], scale=param[1])
-                if (value > l_bound) and (value < u_bound):
-                    return value
-
-        elif param[3] == 'lognormal':
-            l_bound = exp(param[0]-param[4]*param[1])
-            u_bound = exp(param[0]+param[4]*param[1])
-            while True:
-                value = lognormal(param[0], param[1])
-                if value > l_bound and value < u_bound:
-                    return value
-
-        elif param[3] == 'exgauss':
-            mu, sigma, lam = param[0], param[1], param[2]
-            mean_ex = mu + lam
-            var_ex = sigma ** 2 + (1 / lam ** 2)
-            K = 1./(sigma*lam)
-            l_bound = mean_ex-param[4]*var_ex
-            u_bound = mean_ex+param[4]*var_ex
-            while True:
-                value = exponnorm.rvs(K, loc=mu, scale=sigma)
-                if value > l_bound and value < u_bound:
-                    return value
-
-        elif param[3] == 'nonrandom':
-            return param[0]
+    def compile_timing(self):
+        """
+        Compile the timing distributions of all parameter specs of the agent
+        """
+        for value in vars(self).values():
+            specs = value.values() if type(value) is dict else [value]
+            for spec in specs:
+                if TimingDistribution.is_spec(spec):
+                    TimingDistribution.get(spec, self.random_state)
 
-        else:
-            print('Error in get_new_waiting_time() for distribution type:')
-            print(param[3])
-            raise(NotImplementedError('Defined random distribution not implemented'))
+    def start(self):
+        """
+        Compile the timing distributions of the agent before its thread is started
+        """
+        self.compile_timing()
+        super(Agent, self).start()
 
     def change_parameter(self, name, value):
         """
@@ -509,6 +941,9 @@ class Agent(Thread):
         :type value: depends on name
         """
         setattr(self, name, value)
+        if name == 'trans_matrix':
+            self.transition_sampler = TransitionSampler(value, random_state=self.random_state) if value else None
+            self.prepare_transitions()
         print('Parameter ' + name + ' set to ' + str(value))
 
     def check_if_finished(self):
@@ -550,10 +985,33 @@ class Agent(Thread):
         self.break_event.wait(timeout=timeout)
 
 
-class RJA_Agent(Agent):
+class ScheduledAgent(ScheduledBehavior, Agent):
+    """
+    Parent class of agents run by the :data:`agent_scheduler` instead of their own thread, see
+    :class:`ScheduledBehavior`. Scheduled agents keep the thread interface (start, stop, is_alive and join) used by
+    :class:`AgentMacroBehavior`.
+
+    Child classes implement :meth:`run` as a generator, e.g. ``yield self.sleep(fix_time)`` instead of
+    ``time.sleep(fix_time / 1000.)``, ``yield self.acquire(self.draw_lock)`` instead of ``self.draw_lock.acquire()``
+    and ``yield self.wait_until(self.paused)`` instead of ``self.paused.wait()``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        Agent.__init__(self, *args, **kwargs)
+        ScheduledBehavior.__init__(self)
+
+    def start(self):
+        """
+        Compile the timing distributions of the agent and schedule it
+        """
+        self.compile_timing()
+        ScheduledBehavior.start(self)
+
+
+class RJA_Agent(ScheduledAgent):
     """A class to manage the agent's behavior in RJA macro state: It will follow the HI's fixation after a certain
     delay, and, if it starts to get bored, begin to explore the objects around it on its own (for details see methods
-    paper and run() method).
+    paper and run() method). It is run by the :data:`agent_scheduler`.
 
     :param fixation_detector: Fixation dector for registering relevant fixation events
     :type fixation_detector: :obj:'pygaze_framework.EventHandler'
@@ -668,7 +1126,7 @@ class RJA_Agent(Agent):
 
         # Loop handling gaze shifts
         while self.is_running:
-            self.paused.wait()  # wait, if the agent is paused
+            yield self.wait_until(self.paused)  # wait, if the agent is paused
 
             # Wait for the next activated AOI
             if reset_time_to_wait:
@@ -684,8 +1142,12 @@ class RJA_Agent(Agent):
             fixation_timeout = waiting_time - reset_time + libtime.get_time() - \
                 self.fixation_detector.tracker.fixtimetresh
 
-            # Get currently fixated AOI
-            active_aoi = self.fixation_detector.aoi_event.wait(timeout=fixation_timeout/1000.)
+            # Get currently fixated AOI and the latency trace of its fixation
+            yield self.wait_until(self.fixation_detector.aoi_event, fixation_timeout)
+            active_aoi = self.fixation_detector.aoi_event.wait(0)
+            trace = self.fixation_detector.aoi_event.trace if active_aoi else None
+            if trace is not None:
+                trace.mark('agent_woke')
             self.fixation_detector.aoi_event.clear()
 
             # If set, wait for eyecontact
@@ -694,8 +1156,10 @@ class RJA_Agent(Agent):
                 t_ja_waiting_start = libtime.get_time()
                 print('RJA agent is waiting for eye contact')
                 while active_aoi is not 'AOI_agent_eyes' and libtime.get_time() < t_ja_waiting + t_ja_waiting_start:
-                    active_aoi = self.fixation_detector.aoi_event.wait(timeout=fixation_timeout/1000)
-                    time.sleep(.1)
+                    yield self.wait_until(self.fixation_detector.aoi_event, fixation_timeout)
+                    active_aoi = self.fixation_detector.aoi_event.wait(0)
+                    trace = self.fixation_detector.aoi_event.trace if active_aoi else None
+                    yield self.sleep(100)
                     print('HI looking at ' + str(active_aoi))
                     self.fixation_detector.aoi_event.clear()
                 if active_aoi is 'AOI_agent_eyes':
@@ -712,21 +1176,28 @@ class RJA_Agent(Agent):
                         self.log_event.set([libtime.get_time(), 'JA_initiated', active_aoi])
 
                     # wait if the agent is currently blinking
-                    self.blinking.acquire()
+                    yield self.acquire(self.blinking)
                     self.blinking.release()
                     # Check whether agent is following,and if, whether to gaze at correct or wrong AOI
-                    rand_num = uniform()  # Sample number [0,1] to make behavioral decision whether to follow or not
+                    # Sample number [0,1] to make behavioral decision whether to follow or not
+                    rand_num = self.random_state.uniform()
                     if self.gazes_wrong or self.follow_prob > rand_num:
                         # Trigger drawing of the current agent
                         if active_aoi in self.trans_dict:
 
                             # print('active aoi: ' + active_aoi)  # Print currently fixated AOI
                             self.cur_agt = self.trans_dict[active_aoi]  # Get correspoding gaze direction
-                            # Wait time JAP_AGT_FOLLOW_LAG
-                            self.break_event.wait(self.get_new_waiting_time(self.follow_lag)/1000.)
+                            # Wait time JAP_AGT_FOLLOW_LAG, it is not part of the system's latency
+                            follow_lag = self.get_new_waiting_time(self.follow_lag)
+                            if trace is not None:
+                                trace.mark('decision')
+                                trace.agent_lag = follow_lag
+                            yield self.sleep(follow_lag, self.break_event)
+                            if trace is not None:  # the lag is cut short by a break
+                                trace.agent_lag = min(follow_lag, trace.mark('lag_elapsed') - trace.times['decision'])
 
                             # Change micro state
-                            self.draw_lock.acquire()  # Make sure only this agent tries to draw
+                            yield self.acquire(self.draw_lock)  # Make sure only this agent tries to draw
                             if not self.gaze_down:
                                 if self.follow_prob > rand_num or active_aoi is 'AOI_agent_eyes':  # Is following
                                     print(colored_text('FOLLOWS CORRECT', 'green'))
@@ -741,7 +1212,7 @@ class RJA_Agent(Agent):
                                     agt2draw = 'down'
 
                             # print('New agents gaze direction: ' + agt2draw)
-                            self.draw.set_micro_state(agt2draw, agt2draw, time=libtime.get_time())
+                            self.draw.set_micro_state(agt2draw, agt2draw, time=libtime.get_time(), trace=trace)
                             self.log_event.set([libtime.get_time(), 'Agent_followed', agt2draw])  # Log gaze following
                             self.draw.clear()  # Allow other agents to draw
                             # print(colored_text('followed', 'green'))
@@ -749,12 +1220,12 @@ class RJA_Agent(Agent):
                             # If set, set draw() message to highlight currently fixated object
                             if self.highlight_obj and active_aoi is not None and active_aoi is not 'AOI_agent_eyes':
                                 if active_aoi == self.trans_dict[self.correct_aoi]:
-                                    if uniform() <= self.p_correct_feedback:
+                                    if self.random_state.uniform() <= self.p_correct_feedback:
                                         correct_aoi_fixed = True
                                     else:
                                         correct_aoi_fixed = False
                                 else:
-                                    if uniform() <= self.p_correct_feedback:
+                                    if self.random_state.uniform() <= self.p_correct_feedback:
                                         correct_aoi_fixed = False
                                     else:
                                         correct_aoi_fixed = True
@@ -763,13 +1234,13 @@ class RJA_Agent(Agent):
                                         self.fixation_detector.aois[active_aoi].pos[1],
                                         self.fixation_detector.aois[active_aoi].size[0],
                                         self.fixation_detector.aois[active_aoi].size[1]]
-                                self.blinking.acquire()
+                                yield self.acquire(self.blinking)
                                 self.blinking.release()
-                                self.draw_lock.acquire()
-                                time.sleep(self.HL_time * 2.)
+                                yield self.acquire(self.draw_lock)
+                                yield self.sleep(self.HL_time * 2000.)
                                 self.draw.set_micro_state(agt2draw, agt2draw, msg3, correct_aoi_fixed,
                                                           libtime.get_time())
-                                time.sleep(self.HL_time)
+                                yield self.sleep(self.HL_time * 1000.)
                                 self.draw.clear()
                             else:
                                 msg3 = None
@@ -777,7 +1248,7 @@ class RJA_Agent(Agent):
 
                             # log a successful JA to the game log
                             self.game_event.set('success')
-                            self.break_event.wait(self.get_new_waiting_time(self.reset_lag)/1000.)
+                            yield self.sleep(self.get_new_waiting_time(self.reset_lag), self.break_event)
                             reset_time_to_wait = True
                     # Behavior if agent does not follow
                     elif active_aoi:
@@ -804,12 +1275,13 @@ class RJA_Agent(Agent):
                     print(encapsulate_text("I'm bored...", color='blue', background='white'))
                     is_bored = True
                     # Draw a new micro state for the agent, who is looking around bored.
-                    self.blinking.acquire()
+                    yield self.acquire(self.blinking)
                     self.blinking.release()
-                    self.draw_lock.acquire()  # Make sure only this agent tries to draw
+                    yield self.acquire(self.draw_lock)  # Make sure only this agent tries to draw
                     self.cur_agt = self.change_micro_state()
                     self.draw.set_micro_state(self.cur_agt, self.cur_agt, time=libtime.get_time())
                     self.draw.clear()  # Allow other agents to draw
+                    self.prepare_transitions()
                     reset_time_to_wait = True
 
                 # If there was no AOI activated, reset everything to straight agent
@@ -862,7 +1334,7 @@ class RJA_Agent_Dict(RJA_Agent):
         print(encapsulate_text(str(self.break_event), color='green'))
 
 
-class IJA_Agent(Agent):
+class IJA_Agent(ScheduledAgent):
     """A class to manage avatar's behavior: In this mode, the avatar will explore the items presented on the screen.
 
     :param fixation_detector: Fixation detector to fire AOI events
@@ -917,45 +1389,101 @@ class IJA_Agent(Agent):
     :type name: str
     """
 
-    class AOI_Checker(Thread):
-        """Class to check whether fixation_detector is in any given AOI
+    class AOI_Checker(ScheduledBehavior):
+        """Class to check whether fixation_detector is in any given AOI, it is run by the :data:`agent_scheduler`.
+        Agents wait for relevant fixations with :meth:`wait_for`, they are resumed as soon as one is fixated.
+
         :param fixation_detector: Objecct sending messages of a fixation events
         :type fixation_detector: :obj:'pygaze_framework.EventHandler'
-        :param name: Name of thread
+        :param name: Name of the checker
         :type name: str
         """
 
         def __init__(self, fixation_detector, name='AOI_Checker'):
-            super(IJA_Agent.AOI_Checker, self).__init__(name=name)
+            super(IJA_Agent.AOI_Checker, self).__init__()
             self.fixation_detector = fixation_detector
             self.name = name
             self.running = False
-            self.unpaused = Event()
+            self.unpaused = CallbackEvent()
             self.unpaused.set()
-            self.daemon = True
             self.cur_aoi = []
             self.aoi_fixed = []
+            self.waiters = []  # Agents waiting for fixated AOIs: [aois, resume, timeout]
             print('AOI Checker Agent initialized...')
 
         def run(self):
             """
-            The function running in once AOI_Checker.start() is executed.
-            Don't run this function by hand, but only by starting the thread!
+            The behavior run once AOI_Checker.start() is executed.
+            Don't run this function by hand, but only by starting the checker!
             """
             # set the bool to keep the while loop running
             print('Fixation detector running...')
             self.running = True
             while self.running:
                 # wait at this point if AOI_Checker is paused
-                self.unpaused.wait()
-                # wait for the aoi_event to trigger and get name of fixated AOI
-                next_aoi = self.fixation_detector.aoi_event.wait(timeout=1.)
+                yield self.wait_until(self.unpaused)
+                # wait for the aoi_event to trigger and get name of fixated AOI, stop() triggers it as well
+                yield self.wait_until(self.fixation_detector.aoi_event)
+                next_aoi = self.fixation_detector.aoi_event.wait(0)
                 if next_aoi and next_aoi not in self.aoi_fixed:
                     self.aoi_fixed.append(next_aoi)
+                    self.notify()
                     print(colored_text(self.aoi_fixed, 'red'))
                 # Make this run method wait again
                 self.fixation_detector.aoi_event.clear()
 
+        def reset(self):
+            """
+            Forget all fixated AOIs
+            """
+            self.aoi_fixed = []
+
+        def fixed(self, aois):
+            """
+            The given AOIs fixated so far
+
+            :rtype: list
+            """
+            return [aoi for aoi in self.aoi_fixed if aoi in aois]
+
+        def wait_for(self, aois, deadline, interrupt=None):
+            """
+            Wait until any of the given AOIs is fixated, the deadline passed or the interrupt event is set (use as
+            ``fixed = yield self.aoi_checker.wait_for(aois, deadline)``), the result is the given AOIs fixated so far.
+
+            :param aois: AOIs to wait for
+            :type aois: list, set
+            :param deadline: Time in [ms] (see :func:`libtime.get_time`) to stop waiting
+            :type deadline: float
+            :param interrupt: Event to stop waiting, e.g. the agent's break_event
+            :type interrupt: :class:`pygaze_framework.CallbackEvent`
+            """
+            def command(resume):
+                waiter = [aois, resume, None]
+                self.waiters.append(waiter)
+                waiter[2] = self.scheduler.call_later(deadline - libtime.get_time(), self.expire, (waiter,), interrupt)
+                self.notify()  # the AOIs might be fixated already
+            return command
+
+        def notify(self):
+            """
+            Resume the agents waiting for the AOIs fixated so far
+            """
+            for waiter in list(self.waiters):
+                fixed = self.fixed(waiter[0])
+                if fixed:
+                    self.waiters.remove(waiter)
+                    self.scheduler.cancel(waiter[2])
+                    waiter[1](fixed)
+
+        def expire(self, waiter):
+            """
+            Resume an agent whose deadline passed or whose interrupt event was set
+            """
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                waiter[1](self.fixed(waiter[0]))
+
         def set_aoi(self, aoi):
             """
             Set the AOI to be detected.
@@ -1058,12 +1586,12 @@ class IJA_Agent(Agent):
 
         # Loop for behavior
         while self.is_running:
-            self.paused.wait()  # waits if agent is currently paused
+            yield self.wait_until(self.paused)  # waits if agent is currently paused
 
             # Show agent gazing straight
-            self.blinking.acquire()
+            yield self.acquire(self.blinking)
             self.blinking.release()
-            self.draw_lock.acquire()
+            yield self.acquire(self.draw_lock)
             self.draw.set_micro_state(self.agt_straight, self.agt_straight, time=libtime.get_time())
             self.draw.clear()
 
@@ -1071,38 +1599,37 @@ class IJA_Agent(Agent):
             t_ja_waiting = self.get_new_waiting_time(self.ja_init_waiting_time)
             mg, t_ja_waiting_start = False, libtime.get_time()
             self.log_event.set([libtime.get_time(), 'starts waiting for eye contact', str(self.ja_init_aois)])
-            self.aoi_checker.aoi_fixed = []  # clear found AOIs
+            self.aoi_checker.reset()  # clear found AOIs
             # print(colored_text('waiting for eye contact on '+str(self.ja_init_aois), color='yellow'))
             print('===============================================')
             print('Max time waiting for eye contact ' + str(t_ja_waiting))
             print('Parameters:' + str(self.ja_init_waiting_time))
             print('===============================================')
-            # Loop doing the waiting
-            while libtime.get_time() < t_ja_waiting + t_ja_waiting_start and not mg:
-                # Check if any facial agent AOI has  been fixated
-                if any(aoi in self.aoi_checker.aoi_fixed for aoi in self.ja_init_aois):
-                    print(colored_text('eye contact established', color='green'))
-                    self.log_event.set([libtime.get_time(), 'eye contact established'])
-                    mg = True
-
-                    # Show objects, if not present
-                    self.cur_agt = self.draw.return_msg2()
-                    if '_no_obj' in self.cur_agt:
-                        self.cur_agt = self.cur_agt.replace('_no_obj', '')
-                        self.blinking.acquire()
-                        self.blinking.release()
-                        self.draw_lock.acquire()
-                        self.draw.set_micro_state(self.cur_agt, self.cur_agt, time=libtime.get_time())
-                        self.log_event.set([libtime.get_time(), 'eye_contact_established',
-                                            self.trans_dict[self.cur_agt]])
-                        self.draw.clear()
-                        self.agt_straight = 'straight'  # Make sure objects are shown if the agent looks again
+            # Wait until any facial agent AOI has been fixated
+            eye_contact = yield self.aoi_checker.wait_for(self.ja_init_aois, t_ja_waiting_start + t_ja_waiting)
+            if eye_contact:
+                print(colored_text('eye contact established', color='green'))
+                self.log_event.set([libtime.get_time(), 'eye contact established'])
+                mg = True
+
+                # Show objects, if not present
+                self.cur_agt = self.draw.return_msg2()
+                if '_no_obj' in self.cur_agt:
+                    self.cur_agt = self.cur_agt.replace('_no_obj', '')
+                    yield self.acquire(self.blinking)
+                    self.blinking.release()
+                    yield self.acquire(self.draw_lock)
+                    self.draw.set_micro_state(self.cur_agt, self.cur_agt, time=libtime.get_time())
+                    self.log_event.set([libtime.get_time(), 'eye_contact_established',
+                                        self.trans_dict[self.cur_agt]])
+                    self.draw.clear()
+                    self.agt_straight = 'straight'  # Make sure objects are shown if the agent looks again
 
             # If eye contact was established
             if mg:
                 # Keep gazing straight
                 gaze_straight_time = self.get_new_waiting_time(self.t_gaze_straight)/1000.
-                self.break_event.wait(gaze_straight_time)
+                yield self.sleep(gaze_straight_time * 1000., self.break_event)
                 print('===============================================')
                 print('Gazing straight at HI for before IJA ' + str(gaze_straight_time))
                 print('Parameters:' + str(self.t_gaze_straight))
@@ -1117,13 +1644,14 @@ class IJA_Agent(Agent):
                     agt2draw = self.cur_agt
                 self.aoi_checker.set_aoi(self.trans_dict[self.cur_agt])  # Set correct AOI for aoi checker
                 # Draw agent performing gaze shift
-                self.blinking.acquire()
+                yield self.acquire(self.blinking)
                 self.blinking.release()
-                self.draw_lock.acquire()
+                yield self.acquire(self.draw_lock)
                 self.draw.set_micro_state(agt2draw, agt2draw, time=libtime.get_time())
                 time_start_gaze = libtime.get_time()
                 self.log_event.set([time_start_gaze, 'JA_initiated', self.trans_dict[self.cur_agt]])
                 self.draw.clear()
+                self.prepare_transitions()
                 # Get maximal gaze duration at object by agent
                 t_max_look = self.get_new_waiting_time(self.t_gaze_at_obj_ija) + libtime.get_time()
                 print('===============================================')
@@ -1132,33 +1660,20 @@ class IJA_Agent(Agent):
                 print('===============================================')
 
                 # Check whether the correct AOI was triggered or time has elapsed
-                self.aoi_checker.aoi_fixed = []  # Reset list of fixated AOIs
-                break_loop = False  # Boolean to break following loop
-                ja, t_looked = False, 0.0  # Boolean indicating whether JA occured, time looked at object by agent
-
-                # Joint attention detection loop
-                while t_looked < t_max_look and not break_loop and not self.break_event.is_set():
-
-                    # Check if JA occured
-                    if self.trans_dict[self.cur_agt] in self.aoi_checker.aoi_fixed:
-                        self.gaze_lag.append([libtime.get_time() - time_start_gaze])
-                        if self.log_event:
-                            self.log_event.set([libtime.get_time(), 'JA_succsesfull', self.trans_dict[self.cur_agt]])
-                        ja, break_loop = True, True
-                    else:
-                        correct_aoi_fixed = None
-
-                    # Check if any possible AOI was fixated
-                    if self.correct_aoi:
-                        if len(set(self.aoi_checker.aoi_fixed).intersection(self.possible_aois_set)) > 0:
-                            possible_aoi_fixated = True
-                            break_loop = True  # Will finish loop
-                        else:
-                            possible_aoi_fixated = False
-                    else:
-                        possible_aoi_fixated = False
-
-                    t_looked = libtime.get_time()  # Get time for loop condition
+                self.aoi_checker.reset()  # Reset list of fixated AOIs
+                target_aoi = self.trans_dict[self.cur_agt]
+                # Joint attention detection: wait for the target or, if the correct object is known, any possible AOI
+                relevant_aois = set([target_aoi])
+                if self.correct_aoi:
+                    relevant_aois |= self.possible_aois_set
+                fixed_aois = yield self.aoi_checker.wait_for(relevant_aois, t_max_look, self.break_event)
+                ja = target_aoi in fixed_aois  # Boolean indicating whether JA occured
+                if ja:
+                    self.gaze_lag.append([libtime.get_time() - time_start_gaze])
+                    if self.log_event:
+                        self.log_event.set([libtime.get_time(), 'JA_succsesfull', target_aoi])
+                # Check if any possible AOI was fixated
+                possible_aoi_fixated = bool(self.correct_aoi) and not self.possible_aois_set.isdisjoint(fixed_aois)
 
                 # If set, check if correct AOI was fixated
                 if self.correct_aoi:
@@ -1182,14 +1697,14 @@ class IJA_Agent(Agent):
                                          self.fixation_detector.aois[self.aoi_checker.aoi_fixed[-1]].size[0],
                                          self.fixation_detector.aois[self.aoi_checker.aoi_fixed[-1]].size[1]]
                         # wait for agent's blink to finish
-                        self.blinking.acquire()
+                        yield self.acquire(self.blinking)
                         self.blinking.release()
-                        self.draw_lock.acquire()
+                        yield self.acquire(self.draw_lock)
 
-                        time.sleep(self.HL_time)
+                        yield self.sleep(self.HL_time * 1000.)
                         self.draw.set_micro_state(msg=agt2draw, msg2=agt2draw, msg3=self.draw.aoi,
                                                   msg4=self.draw.correct_aoi_fixed, time=libtime.get_time())
-                        time.sleep(self.HL_time)
+                        yield self.sleep(self.HL_time * 1000.)
                         self.draw.clear()
                 # If set and no JA occured, agent will try to get attention with rapid gaze shifts
                 if not ja and self.get_attention_parameters and not self.gaze_down:
@@ -1197,19 +1712,18 @@ class IJA_Agent(Agent):
                         t_max_get_attention = self.get_new_waiting_time(
                                 self.get_attention_parameters['t_max_per_attempt']) + libtime.get_time()
                         for agent_image in self.get_attention_parameters['agent_image_list']:
-                            self.draw_lock.acquire()
+                            yield self.acquire(self.draw_lock)
                             self.draw.set_micro_state(agent_image[0], agent_image[0], time=libtime.get_time())
                             self.log_event.set([libtime.get_time(), 'try_getting_attention', agent_image[0]])
                             self.draw.clear()
-                            time.sleep(agent_image[1]/1000.)
-                        time.sleep(self.get_new_waiting_time(self.get_attention_parameters['t_show_agent_image'])/1000.)
-                        self.draw_lock.acquire()
+                            yield self.sleep(agent_image[1])
+                        yield self.sleep(self.get_new_waiting_time(self.get_attention_parameters['t_show_agent_image']))
+                        yield self.acquire(self.draw_lock)
                         self.draw.set_micro_state(self.cur_agt, self.cur_agt, time=libtime.get_time())
                         self.draw.clear()
-                        while not ja and t_looked < t_max_get_attention and not self.break_event.is_set():
-                            if self.trans_dict[self.cur_agt] in self.aoi_checker.aoi_fixed:
-                                ja = True
-                            t_looked = libtime.get_time()
+                        fixed_aois = yield self.aoi_checker.wait_for([target_aoi], t_max_get_attention,
+                                                                     self.break_event)
+                        ja = bool(fixed_aois)
                         if ja:
                             break
                 if ja:
@@ -1224,7 +1738,7 @@ class IJA_Agent(Agent):
                         print('parameters:' + str(self.t_2_look_straight_again))
                         print('===============================================')
                         print(gaze_at_obj)
-                        self.break_event.wait(gaze_at_obj)
+                        yield self.sleep(gaze_at_obj * 1000., self.break_event)
                 else:
                     print(encapsulate_text('failure', color='red'))
                     self.game_event.set('failure', time=libtime.get_time())
@@ -1246,10 +1760,10 @@ class IJA_Agent(Agent):
 # Done with loop ----------------------------------
         self.draw.do_blink = False
         if self.HL_time:
-            time.sleep(self.HL_time * 4)
+            yield self.sleep(self.HL_time * 4000.)
         # reset agent to straight gaze
         if not self.show_vid and not self.show_points:
-            self.draw_lock.acquire()
+            yield self.acquire(self.draw_lock)
             self.draw.set(self.agt_straight)
             self.draw.clear()
         self.log_event.set([libtime.get_time(), 'stop'])
@@ -1312,9 +1826,10 @@ class IJA_Agent_Dict(IJA_Agent):
         self.paused.set()
 
 
-class BlinkingAgent(Agent):
+class BlinkingAgent(ScheduledAgent):
 
-    """A class to manage agent's behavior: In this mode, the agent will blink with her eyes.
+    """A class to manage agent's behavior: In this mode, the agent will blink with her eyes. It is run by the
+    :data:`agent_scheduler`.
     :param blink_int: Duration in [ms] of average inter-blink interval
     :type blink_int: double
     :param blink_int_var: Variance of above
@@ -1330,7 +1845,7 @@ class BlinkingAgent(Agent):
         print('Initializing BlinkingAgent...')
         self.blink_int = blink_int  # Mean and variance for blink interval
         self.blink_dur = blink_dur  # Mean and variance for blink duration
-        self.force_finish_event = Event()  # Event to force agent to finish
+        self.force_finish_event = CallbackEvent()  # Event to force agent to finish
         print('... BlinkingAgent initialized.')
 
     def run(self):
@@ -1339,20 +1854,20 @@ class BlinkingAgent(Agent):
         while self.is_running:
             print('BlinkingAgent running...')
             # Waits, if the agent is paused
-            self.paused.wait()
+            yield self.wait_until(self.paused)
             # Pauses for an apropriate time between blinks
-            self.force_finish_event.wait(self.get_new_waiting_time(self.blink_int)/1000.)
+            yield self.sleep(self.get_new_waiting_time(self.blink_int), self.force_finish_event)
 
             # Get correct screen name for showing agent with closed eyes
             if 'no_obj' in self.draw.return_msg2():
                 self.agent_blink = 'closed_no_obj'
             else:
                 self.agent_blink = 'closed'
-            # clears the blinking event, signaling that the agent is blinking
-            self.blinking.acquire()
+            # acquires the blinking lock, signaling that the agent is blinking
+            yield self.acquire(self.blinking)
             # Draw blinking agent
             if self.draw.do_blink:
-                self.draw_lock.acquire()
+                yield self.acquire(self.draw_lock)
                 print('BLINKS')
                 self.draw.set_micro_state(msg=self.agent_blink, msg3=self.draw.aoi, msg4=self.draw.correct_aoi_fixed,
                                           time=libtime.get_time())
@@ -1361,13 +1876,13 @@ class BlinkingAgent(Agent):
                 # pauses for the time a blink takes
             else:
                 print('DOESNT BLINK (Should only occur at the end of a trial)!')
-            self.force_finish_event.wait(self.get_new_waiting_time(self.blink_dur)/1000.)
+            yield self.sleep(self.get_new_waiting_time(self.blink_dur), self.force_finish_event)
             # Redraw agent before blink
-            self.draw_lock.acquire()
+            yield self.acquire(self.draw_lock)
             self.draw.set_micro_state(msg=self.draw.return_msg2(), msg3=self.draw.aoi,
                                       msg4=self.draw.correct_aoi_fixed, time=libtime.get_time())
             self.draw.clear()  # clears draw event
-            self.blinking.release()  # sets blinking event so no agents are blocked
+            self.blinking.release()  # releases the blinking lock so no agents are blocked
         print('Blinking agent finished.')
 
     def stop_blinking(self):
@@ -1389,9 +1904,10 @@ class BlinkingAgent_Dict(BlinkingAgent):
         self.paused.set()
 
 
-class PassiveAgent(Agent):
+class PassiveAgent(ScheduledAgent):
     """
-    Explores items regardless of eyetracking data (no interaction), used for pilot study
+    Explores items regardless of eyetracking data (no interaction), used for pilot study. It is run by the
+    :data:`agent_scheduler`.
 
     :param cur_agt: Current gaze direction of agent (use start gaze direction)
     :type cur_agt: str
@@ -1434,17 +1950,19 @@ class PassiveAgent(Agent):
         self.is_running = True
         print('Passive agent running:' + self.name)
         while self.is_running:
-            self.paused.wait()
-            self.blinking.acquire()
+            yield self.wait_until(self.paused)
+            # wait for a blink to finish
+            yield self.acquire(self.blinking)
             self.blinking.release()
             # get a new micro state
             self.cur_agt = self.change_micro_state()
             # draw it
-            self.draw_lock.acquire()
+            yield self.acquire(self.draw_lock)
             self.draw.set_micro_state(self.cur_agt, self.cur_agt, time=libtime.get_time())
             self.draw.clear()
+            self.prepare_transitions()
             # wait for an appropriate amount of time
-            self.break_event.wait(self.get_new_waiting_time(self.fix_time[self.cur_agt])/1000.)
+            yield self.sleep(self.get_new_waiting_time(self.fix_time[self.cur_agt]), self.break_event)
             self.check_if_finished()
         # check whether it ended because of time or key press
         if not self.break_event.is_set():
@@ -1471,12 +1989,12 @@ class Passive_Agent_Dict(PassiveAgent):
         self.paused.set()
 
 
-class Mixed_Agent(Agent):
+class Mixed_Agent(ScheduledAgent):
     """
     An agent class to combine a set of given agents within one agent run.
 
     In its basis, it works similar to AgentMacroBehavior, but with its own set
-    of agents to cycle through.
+    of agents to cycle through. It is run by the :data:`agent_scheduler` like the agents it runs.
     """
 
     def __init__(self, agent_dict, cur_agt, draw, draw_lock, questionnaire, new_objects, new_objects_event,
@@ -1493,12 +2011,12 @@ class Mixed_Agent(Agent):
         self.is_running = True
 
     def run(self):
-        agent_finished_event = Event()
+        agent_finished_event = CallbackEvent()
         first_new_objects = True
         # loop through all agents given in agent_list and finish afterwards
         for macro_state in self.agent_list:
             print(encapsulate_text('New macro state: ' + macro_state[0], color='magenta'))
-            self.draw_lock.acquire()
+            yield self.acquire(self.draw_lock)
             self.draw.set_micro_state(self.cur_agt, self.cur_agt, time=libtime.get_time())
             agent = self.agent_dict[macro_state[0]]['class'](self.agent_dict[macro_state[0]])
             agent.finished_event = agent_finished_event
@@ -1506,9 +2024,9 @@ class Mixed_Agent(Agent):
             # if required, get new objects and recreate all screens
             if self.new_objects and not first_new_objects:
                 print(encapsulate_text('new objects', color='green'))
-                self.draw_lock.acquire()
+                yield self.acquire(self.draw_lock)
                 self.draw.set_micro_state('__new_screens__', self.cur_agt, time=libtime.get_time())
-                self.new_objects_event.wait()
+                yield self.wait_until(self.new_objects_event)
             else:
                 print(encapsulate_text('no new_objects', color='red'))
                 first_new_objects = False
@@ -1516,7 +2034,7 @@ class Mixed_Agent(Agent):
             # start the given agent
             agent.start()
             # wait for it to finish
-            agent_finished_event.wait(timeout=macro_state[1]+10)
+            yield self.wait_until(agent_finished_event, (macro_state[1] + 10) * 1000)
             agent_finished_event.clear()
 
         self.finished_event.set()
@@ -36,6 +36,7 @@ DISPTYPE = 'psychopy'  # either 'psychopy' or 'pygame'
 DISPSIZE = (1920, 1080)  # canvas size
 # DISPSIZE = (2560,1440)
 SCREENSIZE = (52.7, 28.5)  # physical display size in cm
+REFRESH_RATE = 60  # refresh rate of the display in Hz, flips taking longer are reported as missed
 MOUSEVISIBLE = False  # mouse visibility
 BGC = (198, 197, 197)  # backgroundcolour
 FGC = (0, 0, 0)  # foregroundcolour
@@ -490,6 +490,9 @@ JAP_AGENT_RATING_AGENTS = {'male': ['figs/virtual_characters/2017_07_10_rerender
 # ==============================================================================
 JAP_AOI_TOL = [10, 10]  # Additional size of AOI in pixels added to image size
 JAP_AOI_TYPE = 'rect'  # Shape of AOIs, either 'rect', 'circle' or 'ellipse', only tested for 'rect'
+# Detect fixations directly in the tobii gaze callback (I-VT/I-DT with SACCVELTHRESH and SACCACCTHRESH from
+# constants.py) instead of PyGaze's polling wait_for_fixation_start
+JAP_STREAMING_FIXATIONS = False
 
 # ==============================================================================
 # DATA COLLECTION
@@ -555,6 +558,15 @@ JAP_MUCAP_DICT = {
 # ==============================================================================
 JAP_OBJ_DIR = path.join('figs', 'objects')  # Object dir
 JAP_NEW_OBJECTS = True  # Pick new objects for each trial (needs some 1-2 seconds to recreate correspoding screens)
+# Pick and load the new objects of the next trial in the background while the current trial is running
+JAP_PREPARE_OBJECTS = True
+# Keep resized agent and object images as raw pixels on disk and memory-map them on startup instead of loading and
+# resizing the original images, build in advance with: python -m framework.asset_cache --exp_type basic
+JAP_ASSET_CACHE = False
+# Build the screens of predefined trial types (JAP_TRIAL_TYPES) only for the current and this number of following trial
+# types of the behavioral sequence and drop them afterwards, None builds the screens of all trial types at start
+JAP_TRIAL_LOOKAHEAD = 2
+JAP_ASSET_CACHE_DIR = path.join('figs', '.asset_cache')
 
 # Default agent parameters
 JAP_P_IJA_AGT_CORRECT_CHOICE = None  # Probalility that IJA agent will select correct object, set to *None* to turn off
@@ -577,6 +589,15 @@ JAP_NIRS['baseline_duration'] = [2, 3]
 # ===================
 JAP_SCR_REC_COLS = ['time_experiment', 'time_tracker', 'time_draw_event', 'time_draw', 'agent', 'srceen_count',
                     'target_up_left', 'target_up_right', 'target_down_left', 'target_down_right']
+# Format of the raw eyetracking dump: 'text' (tab separated), 'binary' (fixed-width records, see
+# framework.tools.read_gaze_dump) or 'both'
+JAP_TOBII_DUMP_FORMAT = 'text'
+# Classify every raw gaze sample against the fixation detector's AOIs while dumping (AOI runs and dwell times)
+JAP_SAMPLE_AOIS = False
+# Write the latency of each stage from fixation onset to screen flip for every reaction of the agent, with histograms
+JAP_LATENCY_LOG = True
+# Write the timing of every flip and flag flips which missed the display's refresh (see REFRESH_RATE)
+JAP_FRAME_TIMING = True
 
 JAP_ALWAYS_SHOW_VID = [False, None]
 JAP_SHOW_VID = [False, 3]
@@ -607,6 +628,10 @@ JAP_VIDS = {}
 # ==============================================================================
 JAP_TRACKING = True  # If set to True eyetracker will be used
 JAP_SHOW_GAZE_CURSER = False  # If set to True, gaze cursor will be shown
-JAP_DUMMY = False  # If set to True, dummy mode will be activated (simulate gaze via mouse cursor)(not implemented)
+JAP_DUMMY = False  # If set to True, a simulated tobii tracker is used instead of the real one
+JAP_DUMMY_RATE = 600  # Sampling rate of the simulated gaze in [Hz] (up to 1200)
+JAP_DUMMY_REPLAY = None  # Path to a tobii dump to replay, random fixations are simulated if None
+JAP_DUMMY_SPEED = 1.  # Factor to speed up the simulated tracker, 0 to deliver samples as fast as possible
+JAP_SEED = None  # Seed of all random numbers of a session (agents, objects, sequences), random if None
 JAP_PYGAZE_REC = False  # If set to True, Pygaze's default data logging will also be used
 JAP_SHOW_AGENT_STATES = True  # Adds agent state to text on screens before every block
@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import argparse
+import numpy
+import PIL.Image
+from threading import Lock
+
+ASSET_CACHE_DIR = os.path.join('figs', '.asset_cache')
+ASSET_EXTENSION = '.npy'
+INDEX_FILE = 'index.json'
+
+
+class AssetCache(object):
+    """ An on-disk cache of resized, display-ready images (agents and objects).
+
+    Every resized image is stored as raw RGBA pixels (a .npy file) named by the content hash of its source file and
+    the size it was resized to. Loading it memory-maps the file instead of decoding and resampling the source image.
+    The content hashes are kept in an index by file name, modification time and file size, so source files are only
+    read again after they changed.
+
+    :param cache_dir: Directory of the cached images
+    :type cache_dir: str
+    """
+
+    def __init__(self, cache_dir=ASSET_CACHE_DIR):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.index_file = os.path.join(self.cache_dir, INDEX_FILE)
+        self.lock = Lock()
+        try:
+            with open(self.index_file, 'r') as index_file:
+                self.index = json.load(index_file)
+        except (IOError, ValueError):
+            self.index = {}
+
+    def content_hash(self, file_name):
+        """ Get the SHA-1 hash of the contents of a file, only read if it changed since the last call
+
+        :param file_name: file name of the source image
+        :type file_name: str
+        :return: hex digest of the file's contents
+        """
+        file_name = os.path.abspath(file_name)
+        stat = os.stat(file_name)
+        with self.lock:
+            entry = self.index.get(file_name)
+            if entry and entry['mtime'] == stat.st_mtime and entry['bytes'] == stat.st_size:
+                return entry['sha1']
+        with open(file_name, 'rb') as source:
+            sha1 = hashlib.sha1(source.read()).hexdigest()
+        with self.lock:
+            self.index[file_name] = {'mtime': stat.st_mtime, 'bytes': stat.st_size, 'sha1': sha1}
+            self.save_index()
+        return sha1
+
+    def save_index(self):
+        temp_file = self.index_file + '.tmp'
+        with open(temp_file, 'w') as index_file:
+            json.dump(self.index, index_file, indent=1, sort_keys=True)
+        if os.path.exists(self.index_file):
+            os.remove(self.index_file)  # os.rename does not replace files on Windows
+        os.rename(temp_file, self.index_file)
+
+    def asset_name(self, file_name, new_size, proportional=True):
+        """ File name of a cached image
+
+        :param file_name: file name of the source image
+        :type file_name: str
+        :param new_size: size (or scale factor) the image is resized to, see :func:`ScreenHandler.Image.resize`
+        :type new_size: list, tuple, int, float
+        :param proportional: whether the aspect ratio is kept while resizing
+        :type proportional: bool
+        """
+        if type(new_size) in [list, tuple]:
+            geometry = '%dx%d' % tuple(new_size)
+        else:
+            geometry = 'scale%s' % new_size
+        return os.path.join(self.cache_dir, '_'.join([self.content_hash(file_name), geometry,
+                                                      'p' if proportional else 's']) + ASSET_EXTENSION)
+
+    def load(self, file_name, new_size, proportional=True):
+        """ Load a cached resized image by memory-mapping its pixels
+
+        :return: the resized image or None if it is not cached yet
+        :rtype: :class:`PIL.Image.Image`
+        """
+        asset_name = self.asset_name(file_name, new_size, proportional)
+        if not os.path.exists(asset_name):
+            return None
+        try:
+            pixels = numpy.load(asset_name, mmap_mode='r')
+        except (IOError, ValueError):
+            return None
+        return PIL.Image.frombuffer('RGBA', (pixels.shape[1], pixels.shape[0]), pixels, 'raw', 'RGBA', 0, 1)
+
+    def store(self, file_name, new_size, proportional, image):
+        """ Store a resized image as raw RGBA pixels
+
+        :param image: the resized image
+        :type image: :class:`PIL.Image.Image`
+        """
+        asset_name = self.asset_name(file_name, new_size, proportional)
+        temp_file = asset_name + '.tmp'
+        with open(temp_file, 'wb') as asset_file:
+            numpy.save(asset_file, numpy.asarray(image.convert('RGBA'), dtype=numpy.uint8))
+        if os.path.exists(asset_name):
+            os.remove(asset_name)
+        os.rename(temp_file, asset_name)
+
+
+def build(cache_dir, images):
+    """ Build the asset cache for the given images
+
+    :param cache_dir: Directory of the cached images
+    :type cache_dir: str
+    :param images: file names and the size they are drawn with
+    :type images: list of tuples (str, tuple)
+    """
+    from framework import pygaze_framework
+    pygaze_framework.image_cache.asset_cache = AssetCache(cache_dir)
+    for file_name, size in images:
+        # loading an image with the asset cache enabled stores its resized version
+        pygaze_framework.ScreenHandler.Image(file_name, size=size)
+        pygaze_framework.image_cache.clear()
+    print('Cached %d images in %s' % (len(images), cache_dir))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the asset cache of resized agent and object images')
+    parser.add_argument('--exp_type', default='basic', type=str, help='select an experiment type: basic or ja_nirs,' +
+                        ' their corresponding config file will be imported')
+    parser.add_argument('--cache_dir', default=ASSET_CACHE_DIR, help='directory of the cached images')
+    args = parser.parse_args()
+
+    from framework.tools import load_study_parameters
+    parameters = load_study_parameters(args.exp_type)
+
+    images = []
+    for agent_dir in parameters['JAP_AGT_DIR'].values():
+        images += [(os.path.join(agent_dir, image), parameters['JAP_AGT_SIZE'])
+                   for image in sorted(set(parameters['JAP_AGT_DICT'].values()))]
+    for object_dir in parameters['JAP_TAR_DIR_LIST']:
+        images += [(os.path.join(object_dir, image), parameters['JAP_TAR_SIZE'])
+                   for image in sorted(os.listdir(object_dir))]
+    build(args.cache_dir, images)
@@ -2,14 +2,16 @@
 
 import pygaze
 import os
-import random
 import time
 import glob
+import Queue
+import traceback
 import pygaze_framework
 from stuff import encapsulate_text, colored_text
+from random_streams import session_rng
 from pygaze import libscreen, liblog, libtime
 from psychopy.visual import RatingScale, TextStim
-from threading import Thread
+from threading import Thread, Event
 
 
 class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
@@ -61,17 +63,92 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
     :type screennr: int
     :param resize_proportional:
     :type resize_proportional: boolean
+    :param trial_lookahead: Number of following trial types to build the screens for in advance, None to build the
+                            screens of all trial types at once
+    :type trial_lookahead: int
+    :param offscreen: Draw into a NumPy framebuffer instead of a display, see :class:`ScreenHandler`
+    :type offscreen: boolean
+    :param refresh_rate: Refresh rate of the display in [Hz] to detect missed flips, see :class:`ScreenHandler`
+    :type refresh_rate: float
 
 
     """
 
+    class ObjectSetBuilder(Thread):
+        """ A class to prepare the next set of random objects in the background while the current trial is running.
+
+        Picking the objects and loading and resizing their images is done in this thread, so only drawing the
+        prepared images (i.e. creating their textures) and composing the screens is left for the next
+        '__new_screens__'.
+
+        :param object_picker: Picker choosing the objects
+        :type object_picker: :obj:`jap_pygaze_framework.ObjectPicker`
+        :param tar_pos: Position of every target on screen
+        :type tar_pos: dictionary
+        :param tar_size: Target size in pixels
+        :type tar_size: tuple int
+        :param name: Name of thread
+        :type name: str
+        """
+
+        def __init__(self, object_picker, tar_pos, tar_size, name='ObjectSetBuilder'):
+            super(JAP_ScreenHandler.ObjectSetBuilder, self).__init__(name=name)
+            self.daemon = True
+            self.object_picker = object_picker
+            self.tar_pos = tar_pos
+            self.tar_size = tar_size
+            self.prepared = Queue.Queue(maxsize=1)  # only the next object set is prepared
+            self.finished = Event()
+
+        def run(self):
+            while not self.finished.is_set():
+                try:
+                    target_dict = self.object_picker.get_new_targets()
+                    images = {}
+                    for target, file_name in target_dict.items():
+                        images[target] = pygaze_framework.ScreenHandler.Image(file_name, self.tar_pos[target],
+                                                                              self.tar_size)
+                except Exception:
+                    # objects are picked and loaded by the render thread from now on, see get_new_object_set
+                    print(colored_text('ObjectSetBuilder failed, stopped preparing object sets:', 'red'))
+                    traceback.print_exc()
+                    self.finished.set()
+                    break
+                while not self.finished.is_set():
+                    try:
+                        self.prepared.put((target_dict, images), timeout=.5)
+                        break
+                    except Queue.Full:
+                        pass
+
+        def get(self):
+            """ Get the next prepared object set, blocks if it is not ready yet
+
+            :returns: the objects and their loaded images, None if the builder stopped
+            :rtype: tuple (dict, dict)
+            """
+            while True:
+                try:
+                    return self.prepared.get(timeout=.5)
+                except Queue.Empty:
+                    if not self.is_alive():
+                        try:
+                            return self.prepared.get_nowait()  # put right before the builder stopped
+                        except Queue.Empty:
+                            return None
+
+        def stop(self):
+            self.finished.set()
+
     def __init__(self, agent_dir, agent_size, agent_pos, agent_dict, tar_size, tar_pos, stimtracker_parameters,
                  mucap_parameters, instruction_texts, object_picker, dispsize, start_gaze, trial_types, age_group,
                  min_instr_read_time, txt_b1, txt_welcome, target_direct_list, behavioral_sequence, nirs_param,
-                 correct_colour=None, point_width=4, aoi_width=5, screennr=0, resize_proportional=True):
+                 correct_colour=None, point_width=4, aoi_width=5, screennr=0, resize_proportional=True,
+                 trial_lookahead=None, offscreen=False, refresh_rate=60):
         super(JAP_ScreenHandler, self).__init__(stimtracker_parameters, mucap_parameters, instruction_texts,
                                                 object_picker, dispsize, nirs_param, screennr=screennr,
-                                                resize_proportional=True)
+                                                resize_proportional=True, offscreen=offscreen,
+                                                refresh_rate=refresh_rate)
         # dict for screens containing instructions
         self.instruction_scrs = {}
         self.last_agent = None
@@ -110,6 +187,21 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
         else:
             self.rand_obj = True
 
+        # Cache of all agent screens for each trial type (or set of random objects) and their AOIs, each set of screens
+        # is only built once per session
+        self.screens_dict = {}
+        self.aois_dict = {}
+        self.object_sets = []  # random object sets in the order they were cached
+        self.max_object_sets = 16  # number of random object sets kept in the cache
+        self.object_set_builder = None  # prepares the next random object set, see start_object_set_builder
+
+        # Screens of predefined trial types are either all built at once (None) or only for the current and the next
+        # trial_lookahead trial types of the behavioral sequence
+        self.trial_lookahead = trial_lookahead
+        self.trial_cursor = 0  # index of the current trial in the behavioral sequence
+        self.trial_screen_args = (None, False, 1)  # aoi_tol, draw_aois and aoi_border_size to build trial types with
+        self.fixation_detector = None
+
     def draw_agent_on_target_screen(self, agent, tracker=None, force_stim_signal=False, score=None, aoi=None,
                                     correct=None):
         """ Function to draw current agent on screen
@@ -128,36 +220,35 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
         :type correct: Boolean
 
         """
-        temp_screen = libscreen.Screen()
-
         try:
             if self.stimtracker_black:
-                temp_screen.copy(self.screens[agent]['black'])
+                screen = self.screens[agent]['black']
             else:
-                temp_screen.copy(self.screens[agent]['white'])
+                screen = self.screens[agent]['white']
         except KeyError as error:
             print(colored_text(agent, 'red'))
             print(agent)
             print(self.screens.keys())
             print(error.args)
-        self.last_screen = libscreen.Screen()
-        self.last_screen.copy(temp_screen)
+            screen = self.new_screen()
+        # The cached screen is only referenced, fixation cross, score and aoi highlight go to the overlay layer
+        self.last_screen = screen
+        overlay = self.compositor.set_background(screen)
 
         # If set, add fixation cross, score, or aoi highlight to screen
         if tracker or score or aoi:
             if tracker:
-                temp_screen.draw_fixation('cross', 'green', tracker.sample())
+                overlay.draw_fixation('cross', 'green', tracker.sample())
             if score or score == 0:
-                temp_screen.draw_text(score, pos=(1800, 1000), fontsize=32)
+                overlay.draw_text(score, pos=(1800, 1000), fontsize=32)
             if aoi is not None:
-                temp_screen.draw_rect('yellow', aoi[0], aoi[1], aoi[2], aoi[3], self.aoi_width)
+                overlay.draw_rect('yellow', aoi[0], aoi[1], aoi[2], aoi[3], self.aoi_width)
             if correct is not None:
-                temp_screen.draw_rect(self.color[correct], aoi[0], aoi[1], aoi[2], aoi[3], self.aoi_width)
+                overlay.draw_rect(self.color[correct], aoi[0], aoi[1], aoi[2], aoi[3], self.aoi_width)
 
         # Update display and get update time
-        self.display.fill(temp_screen)
-        self.display.show()
-        draw_time = libtime.get_time()
+        self.display.fill(self.compositor.compose())
+        draw_time = self.flip(agent)
 
         # Set correct values for stimtracker signal
         if self.last_agent != agent or force_stim_signal:
@@ -192,7 +283,7 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
         self.make_instruction_screens()
 
     def make_agent_screens_with_objects(self, target_dict, trials2draw, fixation_detector=None, aoi_tol=None,
-                                        draw_aois=False, aoi_border_size=1):
+                                        draw_aois=False, aoi_border_size=1, images=None):
         """ Method to create all screens with objects an all possbile gaze directions of virtual character
         :param target_dict:
         :type target_dict: list
@@ -204,50 +295,139 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
         :type draw_aois: Boolean
         :param aoi_border_size: defines the line width of the aoi borders
         :type aoi_border_size: int
+        :param images: Already loaded images of the random objects (see get_new_object_set), loaded here if None
+        :type images: dict
 
         """
-        # create new screen
-        target_screen = libscreen.Screen()
-        aois = {}
-
         # Use random objects ...
         if self.rand_obj:
-            for target, file_name in target_dict.items():
-                # draw targets on screen
-                self.store_image(target, file_name, self.tar_pos[target],
-                                 self.tar_size)
-                self.draw_image(target_screen, target)
-                aois[target] = {'pos': tuple(self.images_stored[target].position),
-                                'size': self.images_stored[target].size,
-                                'tol': aoi_tol}
-                self.draw_agent_on_object_screens(aois, target_screen, fixation_detector, draw_aois, aoi_border_size)
+            object_set = tuple(sorted(target_dict.items()))
+            if object_set not in self.screens_dict:
+                self.screens_dict[object_set], self.aois_dict[object_set] = self.make_object_set_screens(
+                    [(target, file_name, target) for target, file_name in target_dict.items()], aoi_tol,
+                    fixation_detector, draw_aois, aoi_border_size, images)
+                self.object_sets.append(object_set)
+                # forget the oldest object set
+                if len(self.object_sets) > self.max_object_sets:
+                    oldest = self.object_sets.pop(0)
+                    del self.screens_dict[oldest]
+                    del self.aois_dict[oldest]
+            elif fixation_detector:
+                fixation_detector.add_multiple_aois(self.aois_dict[object_set])
+            self.screens = self.screens_dict[object_set]
 
         # ... or use predefined trial types
         else:
-            # Loop over JAP_TRIAL_TYPES:
+            # Remember how to build the screens of later trial types, see change_screen_for_trial
+            self.trial_screen_args = (aoi_tol, draw_aois, aoi_border_size)
+            if fixation_detector:
+                self.fixation_detector = fixation_detector
+            # Loop over JAP_TRIAL_TYPES (all at once or only the next ones in the behavioral sequence):
             # draw objects and correct postions
-            self.screens_dict = {}
-
-            for trial_type, value in self.trial_types.iteritems():
-                if trial_type in trials2draw:
-                    for key, value in value.iteritems():
-                        if key.startswith('object'):
-                            o_file = os.path.join(self.target_direct_list[0], value)
-                            pos = key.replace('object_', '')
-                            pos = ''.join(i for i in pos if not i.isdigit())
-                            self.store_image(key, o_file, self.tar_pos[pos], self.tar_size)
-                            self.draw_image(target_screen, key)
-                            aois[pos] = {'pos': tuple(self.images_stored[key].position),
-                                         'size': self.images_stored[key].size,
-                                         'tol': aoi_tol}
-                            self.draw_agent_on_object_screens(aois, target_screen, fixation_detector, draw_aois,
-                                                              aoi_border_size)
-                            self.screens_dict[trial_type] = dict(self.screens)
+            if self.trial_lookahead is None:
+                trial_types = [trial_type for trial_type in self.trial_types if trial_type in trials2draw]
+            else:
+                trial_types = self.trial_types_ahead()
+            for trial_type in trial_types:
+                if trial_type not in self.screens_dict:
+                    self.make_trial_type_screens(trial_type, fixation_detector)
+                elif fixation_detector:
+                    fixation_detector.add_multiple_aois(self.aois_dict[trial_type])
             init_screen = self.behavioral_sequence[0]['trial_type']
             self.screens = self.screens_dict[init_screen]
 
+    def make_trial_type_screens(self, trial_type, fixation_detector=None):
+        """ Method to create the screens with all gaze directions of the agent for one of the predefined trial types
+
+        :param trial_type: Name of trial type as defined in JAP_TRIAL_TYPES
+        :type trial_type: str
+        :param fixation_detector:
+        :type fixation_detector: :obj:`msrresearch_helpers.pygaze_framework.MyEvent`
+        """
+        aoi_tol, draw_aois, aoi_border_size = self.trial_screen_args
+        objects = []
+        for key, value in self.trial_types[trial_type].iteritems():
+            if key.startswith('object'):
+                pos = key.replace('object_', '')
+                pos = ''.join(i for i in pos if not i.isdigit())
+                objects.append((key, os.path.join(self.target_direct_list[0], value), pos))
+        self.screens_dict[trial_type], self.aois_dict[trial_type] = self.make_object_set_screens(
+            objects, aoi_tol, fixation_detector, draw_aois, aoi_border_size)
+
+    def trial_types_ahead(self):
+        """ Get the trial type of the current trial and the next trial_lookahead (different) trial types following it
+        in the behavioral sequence, trials without a predefined trial type (e.g. None) are skipped
+
+        :returns: trial types in order of the behavioral sequence
+        :rtype: list
+        """
+        trial_types = []
+        for macro_state in self.behavioral_sequence[self.trial_cursor:]:
+            if not self.trial_types or macro_state['trial_type'] not in self.trial_types:
+                continue
+            if macro_state['trial_type'] not in trial_types:
+                if len(trial_types) > self.trial_lookahead:
+                    break
+                trial_types.append(macro_state['trial_type'])
+        return trial_types
+
+    def start_object_set_builder(self):
+        """ Start preparing the random object sets in the background, see :class:`ObjectSetBuilder`
+        """
+        if self.object_set_builder is None or not self.object_set_builder.is_alive():
+            self.object_set_builder = self.ObjectSetBuilder(self.object_picker, self.tar_pos, self.tar_size)
+            self.object_set_builder.start()
+
+    def stop_object_set_builder(self):
+        if self.object_set_builder is not None:
+            self.object_set_builder.stop()
+            self.object_set_builder = None
+
+    def get_new_object_set(self):
+        """ Get a new set of random objects, prepared in the background if the object set builder is running
+
+        :returns: the objects and their loaded images (None if not loaded yet)
+        :rtype: tuple (dict, dict)
+        """
+        if self.object_set_builder is not None:
+            object_set = self.object_set_builder.get()
+            if object_set is not None:
+                return object_set
+            self.object_set_builder = None  # the builder died, pick the objects here
+        return self.object_picker.get_new_targets(), None
+
+    def make_object_set_screens(self, objects, aoi_tol=None, fixation_detector=None, draw_aois=False,
+                                aoi_border_size=1, images=None):
+        """ Method to create the screens with all gaze directions of the agent for one set of objects
+
+        :param objects: name, file and position (key of tar_pos) of each object
+        :type objects: list
+        :param aoi_tol: Additional size of AOI in pixels added to image size
+        :type aoi_tol: list int
+        :param images: Already loaded images of (some of) the objects by name
+        :type images: dict
+        :returns: the screens (including all screens without objects) and the AOIs of the objects
+        :rtype: tuple (dict, dict)
+        """
+        target_screen = self.new_screen()
+        aois = {}
+        for name, file_name, pos in objects:
+            # draw targets on screen
+            if images and name in images:
+                self.images_stored[name] = images[name]
+            else:
+                self.store_image(name, file_name, self.tar_pos[pos], self.tar_size)
+            self.draw_image(target_screen, name)
+            aois[pos] = {'pos': tuple(self.images_stored[name].position),
+                         'size': self.images_stored[name].size,
+                         'tol': aoi_tol}
+        screens = dict(self.screens)
+        self.draw_agent_on_object_screens(aois, target_screen, fixation_detector, draw_aois, aoi_border_size,
+                                          screens=screens)
+        return screens, aois
+
     def draw_agent_on_object_screens(self, aois, target_screen, fixation_detector=None, draw_aois=False,
-                                     aoi_border_size=1):
+                                     aoi_border_size=1, screens=None):
 
         """ Method to create screens with all gaze directions of agent with objects
         :param aois:
@@ -260,32 +440,36 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
         :type draw_aois: Boolean
         :param aoi_border_size: defines the line width of the aoi borders
         :type aoi_border_size: int
+        :param screens: Dict to put the screens in, self.screens if None
+        :type screens: dict
 
         """
+        if screens is None:
+            screens = self.screens
+        # Add AOIs for fixation detector
+        if fixation_detector:
+            fixation_detector.add_multiple_aois(aois)
         # Create one screen for every possbile gaze direction and stimtracker signal
         for agent, image in self.agent_dict.items():
-            screen = libscreen.Screen()
+            screen = self.new_screen()
             screen.copy(target_screen)
             # self.store_image(agent, os.path.join(self.agent_dir, image), self.agent_pos, self.agent_size)
             agent_img = 'agt_' + agent
             self.draw_image(screen, agent_img)
-            # Add AOIs for fixation detector
-            if fixation_detector:
-                fixation_detector.add_multiple_aois(aois)
-                if draw_aois:
-                    fixation_detector.draw_aois(screen, aoi_border_size)
+            if fixation_detector and draw_aois:
+                fixation_detector.draw_aois(screen, aoi_border_size)
             self.make_mucap_trigger_pixel(screen, agent)
-            self.screens[agent] = {}
-            self.screens[agent]['white'] = screen
-            self.copy_screen_w_stimtracker_pixel(self.screens[agent])
-            self.check_start_gaze(agent, screen)
+            screens[agent] = {}
+            screens[agent]['white'] = screen
+            self.copy_screen_w_stimtracker_pixel(screens[agent])
+            self.check_start_gaze(agent, screen, screens)
 
     def make_agent_only_screens(self):
         """ Method to create screens with all gaze directions without any objects and StimTracker pixel
         """
 
         for agent, image in self.agent_dict.items():
-            screen = libscreen.Screen()
+            screen = self.new_screen()
             agent_img = 'agt_' + agent
             self.store_image(agent_img, os.path.join(self.agent_dir, image), self.agent_pos, self.agent_size)
             self.draw_image(screen, agent_img)
@@ -295,7 +479,7 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
             self.copy_screen_w_stimtracker_pixel(self.screens[agt])
             self.check_start_gaze(agt, screen)
 
-    def check_start_gaze(self, agent, screen):
+    def check_start_gaze(self, agent, screen, screens=None):
         """ Check whether current screen is also used for startgaze and if so, create startgaze screen from it, used to
         create a clear stimtrack pattern at the beginning of each trial
 
@@ -303,14 +487,18 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
         :type agent:
         :param screen:
         :type screen:
+        :param screens: Dict to put the startgaze screen in, self.screens if None
+        :type screens: dict
         """
+        if screens is None:
+            screens = self.screens
         if agent == self.start_gaze:
-            self.screens['startgaze'] = {}
-            start_screen = libscreen.Screen()
+            screens['startgaze'] = {}
+            start_screen = self.new_screen()
             start_screen.copy(screen)
             self.make_mucap_trigger_pixel(start_screen, 'block_start')
-            self.screens['startgaze']['white'] = start_screen
-            self.copy_screen_w_stimtracker_pixel(self.screens['startgaze'])
+            screens['startgaze']['white'] = start_screen
+            self.copy_screen_w_stimtracker_pixel(screens['startgaze'])
 
     def make_point_screens_cricles(self):
         """ Method to create screens for showing point progress as circles
@@ -323,7 +511,7 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
                 if j == 0:
                     screen_name = screen_name + '_correct'
                 fill = False
-                screen = libscreen.Screen()
+                screen = self.new_screen()
                 if i > 2:
                     fill = True
                 screen.draw_circle(pos=((2./3.) * self.dispsize[0], 0.5 * self.dispsize[1]),
@@ -358,8 +546,8 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
         """
         for name, text in self.instruction_texts.iteritems():
             self.instruction_scrs[name] = {}
-            self.instruction_scrs[name]['white'] = libscreen.Screen()
-            self.instruction_scrs[name]['black'] = libscreen.Screen()
+            self.instruction_scrs[name]['white'] = self.new_screen()
+            self.instruction_scrs[name]['black'] = self.new_screen()
             if name == 'finished':
                 self.make_mucap_trigger_pixel(self.instruction_scrs[name]['white'], 'stop_rec')
             elif name == 'end_block' or 'end_paradigm':
@@ -386,7 +574,7 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
         """
         # Create empty screens
         self.agt_select_screen = {}
-        self.agt_select_screen['white'] = libscreen.Screen()
+        self.agt_select_screen['white'] = self.new_screen()
         # Draw instructions on screen
         self.agt_select_screen['white'].draw_text(text=text,
                                                   pos=(900, 900), center=True, font='mono',
@@ -406,10 +594,36 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
 
     def change_screen_for_trial(self, trial_type):
         """ Method to set different screen according to the trial type
+
+        If only the next trial types are built (trial_lookahead), missing screens are built here, the screens of the
+        following trial types are built ahead and all others are dropped.
+
         :param trial_type: Initial gaze direction of agent when trial starts
         :type trial_type: string
         """
-        self.screens = self.screens_dict[trial_type]
+        if self.trial_lookahead is not None:
+            # move on to the next trial of this type in the behavioral sequence
+            trial_types = [macro_state['trial_type'] for macro_state in self.behavioral_sequence]
+            if trial_type in trial_types[self.trial_cursor:]:
+                self.trial_cursor = trial_types.index(trial_type, self.trial_cursor)
+            elif trial_type in trial_types:
+                self.trial_cursor = trial_types.index(trial_type)
+            if trial_type not in self.screens_dict:
+                self.make_trial_type_screens(trial_type, self.fixation_detector)
+            elif self.fixation_detector:
+                self.fixation_detector.add_multiple_aois(self.aois_dict[trial_type])
+            self.screens = self.screens_dict[trial_type]
+
+            trial_types_ahead = self.trial_types_ahead()
+            for cached_type in self.screens_dict.keys():
+                if cached_type not in trial_types_ahead and cached_type != trial_type:
+                    del self.screens_dict[cached_type]
+                    del self.aois_dict[cached_type]
+            for next_type in trial_types_ahead:
+                if next_type not in self.screens_dict and next_type in self.trial_types:
+                    self.make_trial_type_screens(next_type)
+        else:
+            self.screens = self.screens_dict[trial_type]
 
     def show_agent_selection_screen(self):
         """Method to show screen with agent selection to participant
@@ -463,17 +677,17 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
 
         print(encapsulate_text('PRESENTING AGENT_RATING', color='magenta', background='cyan'))
 
-        random.shuffle(agents)  # Assign agents to a random position
+        session_rng.stdlib('agent_rating').shuffle(agents)  # Assign agents to a random position
 
         # Creaate and present agents
-        empty_screen = libscreen.Screen()
+        empty_screen = self.new_screen()
         for agent in agents:
             agent_image = self.Image(agent, size=(self.display.dispsize[0], self.display.dispsize[1]/2),
                                      position=(self.display.dispsize[0]/2, self.display.dispsize[1]/3))
-            agent_screen = libscreen.Screen()
+            agent_screen = self.new_screen()
             agent_screen.draw_image(agent_image.image, agent_image.position)
             for question in questions:
-                agent_rating_screen = libscreen.Screen()
+                agent_rating_screen = self.new_screen()
                 agent_rating_screen.copy(agent_screen)
                 ratingscale = RatingScale(pygaze.expdisplay, low=low, high=high, markerStart=marker_start,
                                           scale=str(low)+scale+str(high), mouseOnly=only_mouse, noMouse=not use_mouse,
@@ -483,18 +697,18 @@ class JAP_ScreenHandler(pygaze_framework.ScreenHandler):
                                      color='black', height=40, wrapWidth=1500)
                 agent_rating_screen.screen.append(text_stim)
                 self.display.fill(agent_rating_screen)
-                self.display.show()
+                self.flip('agent_rating')
                 while ratingscale.noResponse:
                     self.display.fill(agent_rating_screen)
-                    self.display.show()
+                    self.flip('agent_rating')
                 if logger:
                     logger.set([agent, question, ratingscale.getHistory()])
                 if questions.index(question) < len(questions) - 1:
                     self.display.fill(agent_screen)
-                    self.display.show()
+                    self.flip('agent_rating')
                     time.sleep(0.5)
             self.display.fill(empty_screen)
-            self.display.show()
+            self.flip()
             time.sleep(0.5)
 
 
@@ -530,10 +744,10 @@ class JAP_LogManager(pygaze_framework.LogManager):
 
     def __init__(self, data_dir, block_name=None, tracker=None, participant_data=None, age_group=None, verbose=False,
                  mucap_dir=None, mucap_marker=None, mucap_wmv=None, fixation_data=None, log_dict={}, screenshots=False,
-                 tobii_save_event=None):
+                 tobii_save_event=None, tobii_dump_format='text'):
         super(JAP_LogManager, self).__init__(data_dir, block_name, tracker, participant_data, age_group, verbose,
                                              mucap_dir, mucap_marker, mucap_wmv, fixation_data, log_dict, screenshots,
-                                             tobii_save_event=tobii_save_event)
+                                             tobii_save_event=tobii_save_event, tobii_dump_format=tobii_dump_format)
 
     def log_variable(self, variable, name):
         setattr(self, name, self.PostExperimentLogger(variable, self.data_dir, self.data['code'],
@@ -548,11 +762,14 @@ class ObjectPicker():
     :type tar_names: list
     :param object_dir_list: a list of folders, where the objects can be found
     :type object_dit_list: list
+    :param random_state: random number stream the objects are picked with, python's global one if None
+    :type random_state: :class:`random.Random`
     """
 
-    def __init__(self, tar_names, object_dir_list):
+    def __init__(self, tar_names, object_dir_list, random_state=None):
         self.tar_names = tar_names
         self.object_dir_list = object_dir_list
+        self.random = random_state or random
 
         self.last_pick_list = None
 
@@ -563,9 +780,9 @@ class ObjectPicker():
         """
         new_pick = {}
         while True:
-            object_dir = random.choice(self.object_dir_list)
+            object_dir = self.random.choice(self.object_dir_list)
             object_list = os.listdir(object_dir)
-            new_pick_list = random.sample(object_list, len(self.tar_names))
+            new_pick_list = self.random.sample(sorted(object_list), len(self.tar_names))
             if not new_pick_list == self.last_pick_list:
                 self.last_pick_list = new_pick_list
                 for i, v in enumerate(new_pick_list):
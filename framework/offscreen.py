@@ -0,0 +1,291 @@
+import argparse
+import random
+import timeit
+import numpy
+import PIL.Image
+import PIL.ImageColor
+import PIL.ImageDraw
+import PIL.ImageFont
+
+# default colours as in constants.py
+DEFAULT_FGC = (0, 0, 0)
+DEFAULT_BGC = (198, 197, 197)
+FONT_FILE = 'DejaVuSansMono.ttf'
+
+
+def to_rgb(colour, default):
+    """ Convert a PyGaze colour (name or RGB(A) tuple in 0-255) to an RGB tuple
+
+    :param colour: colour to convert, the default colour if None
+    :param default: default colour
+    :type default: tuple
+    """
+    if colour is None:
+        colour = default
+    if isinstance(colour, basestring):
+        return PIL.ImageColor.getrgb(colour)[:3]
+    return tuple(int(value) for value in colour[:3])
+
+
+class Stimulus(object):
+    """ A stimulus of an :class:`OffscreenScreen`, i.e. RGBA pixels to be blended into the framebuffer at a position.
+
+    The pixels are rendered once when the stimulus is drawn on a screen, like a texture, so showing a screen only
+    blends them into the framebuffer.
+
+    :param pixels: RGBA pixels of the stimulus
+    :type pixels: :class:`numpy.ndarray` (height, width, 4) uint8
+    :param x: x position of the upper left corner in the framebuffer
+    :type x: int
+    :param y: y position of the upper left corner in the framebuffer
+    :type y: int
+    """
+
+    def __init__(self, pixels, x, y):
+        self.pixels = pixels
+        self.x = int(round(x))
+        self.y = int(round(y))
+        self.opaque = bool((pixels[:, :, 3] == 255).all())
+        if not self.opaque:
+            self.alpha = pixels[:, :, 3:].astype(numpy.uint16)
+
+    def draw(self, framebuffer):
+        height, width = framebuffer.shape[:2]
+        x_0, y_0 = max(self.x, 0), max(self.y, 0)
+        x_1, y_1 = min(self.x + self.pixels.shape[1], width), min(self.y + self.pixels.shape[0], height)
+        if x_1 <= x_0 or y_1 <= y_0:
+            return
+        target = framebuffer[y_0:y_1, x_0:x_1]
+        source = self.pixels[y_0 - self.y:y_1 - self.y, x_0 - self.x:x_1 - self.x, :3]
+        if self.opaque:
+            target[:] = source
+        else:
+            alpha = self.alpha[y_0 - self.y:y_1 - self.y, x_0 - self.x:x_1 - self.x]
+            target[:] = (source * alpha + target * (255 - alpha)) // 255
+
+
+class OffscreenScreen(object):
+    """ A headless replacement of :class:`pygaze.libscreen.Screen` drawing into NumPy arrays.
+
+    It provides the drawing methods of PyGaze's screens with the same arguments and, like PyGaze's PsychoPy screens,
+    keeps its stimuli in the list :attr:`screen`, so stimuli can be shared between screens (see
+    :func:`ScreenHandler.draw_shared`) and composed (see :class:`ScreenHandler.Compositor`).
+
+    :param dispsize: canvas size in pixel
+    :type dispsize: int tuple
+    :param fgc: default colour to draw with
+    :type fgc: tuple
+    :param bgc: background colour
+    :type bgc: tuple
+    :param screen: screen to copy
+    :type screen: :class:`OffscreenScreen`
+    """
+
+    def __init__(self, dispsize, fgc=DEFAULT_FGC, bgc=DEFAULT_BGC, screen=None):
+        self.dispsize = dispsize
+        self.fgc = fgc
+        self.bgc = bgc
+        self.screen = []
+        if screen:
+            self.copy(screen)
+
+    def clear(self, colour=None):
+        if colour is not None:
+            self.bgc = colour
+        self.screen = []
+
+    def copy(self, screen):
+        self.bgc = screen.bgc
+        self.screen = list(screen.screen)
+
+    def set_background_colour(self, colour=None):
+        if colour is not None:
+            self.bgc = colour
+
+    def draw_shape(self, x, y, w, h, pw, draw_function):
+        """ Render a shape with PIL into a stimulus
+
+        :param x: x position of the upper left corner of the shape's bounding box
+        :param y: y position of the upper left corner of the shape's bounding box
+        :param w: width of the bounding box
+        :param h: height of the bounding box
+        :param pw: pen width (margin around the bounding box)
+        :param draw_function: function drawing the shape on the given ImageDraw with the bounding box shifted by the
+                              given margin
+        :type draw_function: callable
+        """
+        margin = int(pw) + 1
+        image = PIL.Image.new('RGBA', (int(w) + 2 * margin, int(h) + 2 * margin), (0, 0, 0, 0))
+        draw_function(PIL.ImageDraw.Draw(image), margin)
+        self.screen.append(Stimulus(numpy.asarray(image, dtype=numpy.uint8), x - margin, y - margin))
+
+    def draw_rect(self, colour=None, x=None, y=None, w=50, h=50, pw=1, fill=False):
+        colour = to_rgb(colour, self.fgc)
+        if x is None:
+            x = self.dispsize[0] / 2
+        if y is None:
+            y = self.dispsize[1] / 2
+        if fill:
+            pixels = numpy.empty((max(int(h), 1), max(int(w), 1), 4), dtype=numpy.uint8)
+            pixels[:] = colour + (255,)
+            self.screen.append(Stimulus(pixels, x, y))
+        else:
+            self.draw_shape(x, y, w, h, pw, lambda draw, m: [
+                draw.rectangle([m + i, m + i, m + w - i, m + h - i], outline=colour) for i in range(int(pw))])
+
+    def draw_ellipse(self, colour=None, x=None, y=None, w=50, h=50, pw=1, fill=False):
+        colour = to_rgb(colour, self.fgc)
+        if x is None:
+            x = self.dispsize[0] / 2
+        if y is None:
+            y = self.dispsize[1] / 2
+        if fill:
+            self.draw_shape(x, y, w, h, pw, lambda draw, m: draw.ellipse([m, m, m + w, m + h], fill=colour))
+        else:
+            self.draw_shape(x, y, w, h, pw, lambda draw, m: [
+                draw.ellipse([m + i, m + i, m + w - i, m + h - i], outline=colour) for i in range(int(pw))])
+
+    def draw_circle(self, colour=None, pos=None, r=50, pw=1, fill=False):
+        if pos is None:
+            pos = (self.dispsize[0] / 2, self.dispsize[1] / 2)
+        self.draw_ellipse(colour, pos[0] - r, pos[1] - r, 2 * r, 2 * r, pw, fill)
+
+    def draw_line(self, colour=None, spos=None, epos=None, pw=1):
+        colour = to_rgb(colour, self.fgc)
+        if spos is None:
+            spos = (int(self.dispsize[0] * 0.25), self.dispsize[1] / 2)
+        if epos is None:
+            epos = (int(self.dispsize[0] * 0.75), self.dispsize[1] / 2)
+        x, y = min(spos[0], epos[0]), min(spos[1], epos[1])
+        self.draw_shape(x, y, abs(epos[0] - spos[0]), abs(epos[1] - spos[1]), pw, lambda draw, m: draw.line(
+            [(spos[0] - x + m, spos[1] - y + m), (epos[0] - x + m, epos[1] - y + m)], fill=colour, width=int(pw)))
+
+    def draw_polygon(self, pointlist, colour=None, pw=1, fill=True):
+        colour = to_rgb(colour, self.fgc)
+        x, y = min(p[0] for p in pointlist), min(p[1] for p in pointlist)
+        w, h = max(p[0] for p in pointlist) - x, max(p[1] for p in pointlist) - y
+        points = lambda m: [(p[0] - x + m, p[1] - y + m) for p in pointlist]
+        if fill:
+            self.draw_shape(x, y, w, h, pw, lambda draw, m: draw.polygon(points(m), fill=colour))
+        else:
+            self.draw_shape(x, y, w, h, pw, lambda draw, m: draw.line(points(m) + points(m)[:1], fill=colour,
+                                                                      width=int(pw)))
+
+    def draw_fixation(self, fixtype='cross', colour=None, pos=None, pw=1, diameter=12):
+        if pos is None:
+            pos = (self.dispsize[0] / 2, self.dispsize[1] / 2)
+        r = diameter / 2
+        if fixtype == 'cross':
+            self.draw_line(colour, (pos[0] - r, pos[1]), (pos[0] + r, pos[1]), pw)
+            self.draw_line(colour, (pos[0], pos[1] - r), (pos[0], pos[1] + r), pw)
+        elif fixtype == 'x':
+            self.draw_line(colour, (pos[0] - r, pos[1] - r), (pos[0] + r, pos[1] + r), pw)
+            self.draw_line(colour, (pos[0] - r, pos[1] + r), (pos[0] + r, pos[1] - r), pw)
+        else:
+            self.draw_circle(colour, pos, r, pw, fill=True)
+
+    def draw_text(self, text='text', colour=None, pos=None, center=True, font='mono', fontsize=12, antialias=True):
+        colour = to_rgb(colour, self.fgc)
+        if pos is None:
+            pos = (self.dispsize[0] / 2, self.dispsize[1] / 2)
+        try:
+            image_font = PIL.ImageFont.truetype(FONT_FILE, int(fontsize))
+        except IOError:
+            image_font = PIL.ImageFont.load_default()
+        text = unicode(text) if not isinstance(text, basestring) else text
+        w, h = PIL.ImageDraw.Draw(PIL.Image.new('RGBA', (1, 1))).multiline_textsize(text, font=image_font)
+        x, y = (pos[0] - w / 2, pos[1] - h / 2) if center else pos
+        self.draw_shape(x, y, w, h, 0, lambda draw, m: draw.multiline_text((m, m), text, fill=colour,
+                                                                            font=image_font))
+
+    def draw_image(self, image, pos=None, scale=None):
+        if pos is None:
+            pos = (self.dispsize[0] / 2, self.dispsize[1] / 2)
+        if not isinstance(image, PIL.Image.Image):
+            image = PIL.Image.open(image)
+        if scale:
+            image = image.resize([int(size * scale) for size in image.size])
+        pixels = numpy.asarray(image.convert('RGBA'), dtype=numpy.uint8)
+        self.screen.append(Stimulus(pixels, pos[0] - pixels.shape[1] / 2, pos[1] - pixels.shape[0] / 2))
+
+
+class OffscreenDisplay(object):
+    """ A headless replacement of :class:`pygaze.libscreen.Display` showing screens in a NumPy framebuffer.
+
+    :param dispsize: canvas size in pixel
+    :type dispsize: int tuple
+    :param bgc: background colour
+    :type bgc: tuple
+    """
+
+    def __init__(self, dispsize, bgc=DEFAULT_BGC):
+        self.dispsize = dispsize
+        self.bgc = bgc
+        self.framebuffer = numpy.empty((dispsize[1], dispsize[0], 3), dtype=numpy.uint8)
+        self.framebuffer[:] = to_rgb(bgc, DEFAULT_BGC)
+        self.flip_times = []  # time of every show in [ms]
+
+    def fill(self, screen=None):
+        if screen is None:
+            self.framebuffer[:] = to_rgb(self.bgc, DEFAULT_BGC)
+            return
+        self.framebuffer[:] = to_rgb(screen.bgc, DEFAULT_BGC)
+        for stimulus in screen.screen:
+            stimulus.draw(self.framebuffer)
+
+    def show(self):
+        self.flip_times.append(timeit.default_timer() * 1000.)
+        return self.flip_times[-1]
+
+    def show_part(self, rect, screen=None):
+        self.fill(screen)
+        return self.show()
+
+    def make_screenshot(self, filename='screenshot.png'):
+        PIL.Image.fromarray(self.framebuffer).save(filename)
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark building and showing the agent screens without display')
+    parser.add_argument('--exp_type', default='basic', type=str, help='select an experiment type: basic or ja_nirs,' +
+                        ' their corresponding config file will be imported')
+    parser.add_argument('--flips', default=1000, type=int, help='number of agent screens to show')
+    parser.add_argument('--screenshot', default=None, help='save the last shown screen to this file')
+    args = parser.parse_args()
+
+    from framework.tools import load_study_parameters
+    from framework import jap_pygaze_framework
+    p = load_study_parameters(args.exp_type)
+    age_group = sorted(p['JAP_INSTR_TEXT'])[0]
+    behavioral_sequence = [{'trial_type': None}]
+    trials2draw = []
+    if p['JAP_TRIAL_TYPES']:
+        behavioral_sequence = [{'trial_type': trial_type} for trial_type in sorted(p['JAP_TRIAL_TYPES'])]
+        trials2draw = sorted(p['JAP_TRIAL_TYPES'])
+    object_picker = jap_pygaze_framework.ObjectPicker(p['JAP_TAR_NAMES'], p['JAP_TAR_DIR_LIST'])
+
+    t_0 = timeit.default_timer()
+    scr_hdlr = jap_pygaze_framework.JAP_ScreenHandler(
+        p['JAP_AGT_DIR'].values()[0], p['JAP_AGT_SIZE'], p['JAP_AGT_POS'], p['JAP_AGT_DICT'], p['JAP_TAR_SIZE'],
+        p['JAP_TAR_POS'], p['JAP_STIMTRACKER_PARAMETER'], p['JAP_MUCAP_DICT'], p['JAP_INSTR_TEXT'][age_group],
+        object_picker, p['DISPSIZE'], p['JAP_AGT_START_GAZE'], p['JAP_TRIAL_TYPES'], age_group,
+        p['JAP_MIN_INSTR_READ_TIME'], p['JAP_TXT_B1'], p['JAP_WELCOME_TEXT'], p['JAP_TAR_DIR_LIST'],
+        behavioral_sequence, p['JAP_NIRS'], p['CORRECT_COLOUR'], p['BORDER_WIDTH_CIRCLE'], p['BORDER_WIDTH_AOI'],
+        offscreen=True)
+    scr_hdlr.make_all_screens(object_picker.get_new_targets(), trials2draw, aoi_tol=p['JAP_AOI_TOL'])
+    t_build = timeit.default_timer() - t_0
+
+    flip_durations = []
+    for i in range(args.flips):
+        t_0 = timeit.default_timer()
+        scr_hdlr.draw_agent_on_target_screen(random.choice(p['JAP_AGT_DICT'].keys()), score=i)
+        flip_durations.append((timeit.default_timer() - t_0) * 1000.)
+    if args.screenshot:
+        scr_hdlr.make_screenshot(args.screenshot)
+
+    print('Screens built in %.1f ms' % (t_build * 1000.))
+    print('Agent screen shown %d times: median %.2f ms, 95th percentile %.2f ms, max %.2f ms' % (
+        args.flips, numpy.median(flip_durations), numpy.percentile(flip_durations, 95), max(flip_durations)))
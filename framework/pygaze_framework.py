@@ -11,12 +11,17 @@ import cPickle as pickle
 import sys
 import traceback
 import time
+import Queue
+import numpy
+import math
+from collections import deque, OrderedDict
 from .stuff import colored_text, encapsulate_text
+from .offscreen import OffscreenDisplay, OffscreenScreen
+from .random_streams import session_rng
+from .tools import GAZE_DUMP_EXTENSION, gaze_samples_to_records, aoi_table, gaze_points_to_pixels, classify_gaze_points
 import ctypes
 import pprint
-import random
 import time
-import copy
 
 # try:
 #     import msvcrt
@@ -24,6 +29,103 @@ import copy
 #     raise NotImplementedError('Keyboard input for non Wnidows systems is not yet implemented!')
 
 
+class CallbackEvent:
+    """A :class:`threading.Event` which can also call back once it is set instead of blocking a waiting thread, e.g.
+    to resume an agent run by the :class:`agents.AgentScheduler`.
+
+    .. seealso:: :class:`threading.Event`
+    """
+
+    def __init__(self):
+        self.event = Event()
+        self.lock = Lock()
+        self.callbacks = []
+
+    def is_set(self):
+        return self.event.is_set()
+
+    isSet = is_set
+
+    def set(self):
+        """Sets the internal flag to ``True``, wakes all waiting threads and calls (and forgets) all callbacks"""
+        with self.lock:
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def clear(self):
+        self.event.clear()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+    def when_set(self, callback):
+        """Call a function once the event is set, right away if it is set already. The callback is called by the
+        thread setting the event, so it should only hand over (e.g. schedule) the work.
+
+        :param callback: Function without arguments
+        :type callback: callable
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def discard(self, callback):
+        """Forget a callback given to :func:`when_set` which is not needed anymore"""
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+class CallbackLock:
+    """A :class:`threading.Lock` which can also be acquired with a callback instead of blocking the thread, see
+    :func:`when_acquired`. When the lock is released, it is handed over to the waiting callbacks first (in the order
+    they were given), then to blocked threads.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.mutex = Lock()  # guards handing over the lock
+        self.callbacks = []
+
+    def acquire(self, blocking=True):
+        return self.lock.acquire(blocking)
+
+    def release(self):
+        with self.mutex:
+            if not self.callbacks:
+                self.lock.release()
+                return
+            callback = self.callbacks.pop(0)  # the lock stays acquired, now on behalf of the callback
+        callback()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def when_acquired(self, callback):
+        """Call a function once the lock is acquired on its behalf, right away if it is free. The callback is called
+        by the thread releasing the lock, so it should only hand over (e.g. schedule) the work, which has to release
+        the lock in the end.
+
+        :param callback: Function without arguments
+        :type callback: callable
+        """
+        with self.mutex:
+            if not self.lock.acquire(False):
+                self.callbacks.append(callback)
+                return
+        callback()
+
+
 class MyEvent:
     """An extension of :class:`threading.Event` with the possibility to
     pass information from the thread setting the event to all threads
@@ -33,12 +135,13 @@ class MyEvent:
     """
 
     def __init__(self):
-        self.event = Event()
+        self.event = CallbackEvent()
         self.msg = None
         self.msg2 = None
         self.msg3 = None
         self.msg4 = None
         self.time = None
+        self.trace = None  # LatencyTrace of the reaction the message belongs to
 
         self.do_blink = True  # Actually blink
         self.do_HL = False  # Highlight object while blinking
@@ -50,14 +153,23 @@ class MyEvent:
         object is True."""
         return self.event.is_set()
 
+    def when_set(self, callback):
+        """Call a function once the event is set, see :func:`CallbackEvent.when_set`"""
+        self.event.when_set(callback)
+
+    def discard(self, callback):
+        """Forget a callback given to :func:`when_set`"""
+        self.event.discard(callback)
+
     def clear(self):
         """Resets the inner flag to ``False``
         """
         self.event.clear()
         self.name = None
+        self.trace = None
         # self.time = None
 
-    def set(self, msg=None, time=None):
+    def set(self, msg=None, time=None, trace=None):
         """Sets the internal flag to ``True`` and lets the threads waiting
         resume.
 
@@ -65,15 +177,19 @@ class MyEvent:
         :type msg: object
         :param time: A second message, intended for a time.
         :type time: object
+        :param trace: Latency trace of the reaction the message belongs to
+        :type trace: LatencyTrace
         """
         if msg:
             self.msg = msg
             # print('Message send:' + str(msg))
         if time:
             self.time = time
+        if trace:
+            self.trace = trace
         self.event.set()
 
-    def set_micro_state(self, msg=None, msg2=None, msg3=None, msg4=None, time=None):
+    def set_micro_state(self, msg=None, msg2=None, msg3=None, msg4=None, time=None, trace=None):
         """Sets the internal flag to ``True`` and lets the threads waiting
         resume.
 
@@ -83,6 +199,8 @@ class MyEvent:
         :type msg2: object
         :param time: A third object to be stored in MyEvent. Intended for a time
         :type time: object
+        :param trace: Latency trace of the reaction the message belongs to
+        :type trace: LatencyTrace
         """
         self.msg = msg
         if msg2:
@@ -93,6 +211,7 @@ class MyEvent:
             self.msg4 = msg4
         if time:
             self.time = time
+        self.trace = trace
         self.event.set()
         # print('Message set: '+ self.msg)
 
@@ -114,6 +233,492 @@ class MyEvent:
         return self.msg2
 
 
+class DrawRequest:
+    """A single draw command queued in a :class:`DrawPipeline`, it doubles as future for its completion.
+
+    :param msg: The command, e.g. the name of the screen to draw
+    :type msg: object
+    :param data: Data of events which are no draw commands, e.g. a key press
+    :type data: object
+    :param trace: Latency trace of the reaction the command belongs to
+    :type trace: LatencyTrace
+    """
+
+    def __init__(self, msg, msg2=None, msg3=None, msg4=None, time=None, data=None, trace=None):
+        self.msg = msg
+        self.msg2 = msg2
+        self.msg3 = msg3
+        self.msg4 = msg4
+        self.time = time
+        self.data = data
+        self.trace = trace
+        self.posted = False  # an event given to post, it is not a draw command
+        self.done = Event()
+
+    def wait(self, timeout=None):
+        """Halts the calling thread until the request was handled by the drawing thread.
+
+        :returns: ``True`` if the request was handled, ``False`` on timeout
+        """
+        return self.done.wait(timeout)
+
+
+class DrawPipeline(MyEvent):
+    """A :class:`MyEvent` for draw commands which does not lose commands and lets threads wait without spinning.
+
+    Every :func:`set` or :func:`set_micro_state` puts a :class:`DrawRequest` into a bounded queue and returns it,
+    so the caller can wait for it to be drawn. The drawing thread takes the next request with :func:`wait`. Just as
+    with :class:`MyEvent`, the messages of the request are then available as ``msg2``, ``msg3``, ``msg4`` and
+    ``time``. After handling a request the drawing thread has to call :func:`task_done`. :func:`join` blocks until all
+    queued requests are drawn.
+
+    Events which are no draw commands (e.g. key presses, see :func:`post`) have their own unbounded channel. Posting
+    never blocks, they are handed to the drawing thread before the queued draw commands and :func:`join` does not
+    wait for them.
+
+    :param maxsize: Maximum number of queued requests, further requests block until there is space again
+    :type maxsize: int
+    """
+
+    def __init__(self, maxsize=16):
+        MyEvent.__init__(self)
+        self.requests = Queue.Queue(maxsize=maxsize)
+        self.posted = deque()  # posted events, append and popleft of a deque are thread safe
+        self.request = None  # request the drawing thread is handling right now
+
+    def is_set(self):
+        """Returns ``True`` if there are requests which are not drawn yet"""
+        return self.requests.unfinished_tasks > 0
+
+    def clear(self):
+        """Only there to be compatible with :class:`MyEvent`, requests stay queued until they are drawn
+        """
+        self.event.clear()
+
+    def set(self, msg=None, time=None):
+        """Queue a draw command
+
+        :param msg: The command
+        :type msg: object
+        :param time: Time the command was given
+        :type time: object
+        :returns: the queued request or None if no command was given
+        :rtype: DrawRequest
+        """
+        return self.set_micro_state(msg, time=time)
+
+    def set_micro_state(self, msg=None, msg2=None, msg3=None, msg4=None, time=None, trace=None):
+        """Queue a draw command with additional messages
+
+        :param msg: The command
+        :type msg: object
+        :param msg2: A second object passed to the drawing thread
+        :type msg2: object
+        :param time: Time the command was given
+        :type time: object
+        :param trace: Latency trace of the reaction the command belongs to, it is available as ``trace`` while the
+                      drawing thread handles the command
+        :type trace: LatencyTrace
+        :returns: the queued request or None if no command was given
+        :rtype: DrawRequest
+        """
+        if msg is None:
+            return None
+        if trace is not None:
+            trace.agent = msg
+            trace.mark('draw_request')
+        request = DrawRequest(msg, msg2, msg3, msg4, time, trace=trace)
+        self.requests.put(request)
+        self.event.set()
+        return request
+
+    def post(self, msg, data=None):
+        """Queue an event for the drawing thread which is no draw command, e.g. a key press, without blocking. The
+        messages of the drawing thread are not changed by it, the data is available as ``request.data``.
+
+        :param msg: Type of the event
+        :type msg: str
+        :param data: Anything belonging to the event
+        :type data: object
+        :rtype: DrawRequest
+        """
+        request = DrawRequest(msg, data=data)
+        request.posted = True
+        self.posted.append(request)
+        try:
+            self.requests.put_nowait(None)  # wake the drawing thread
+            self.requests.task_done()  # join does not wait for the wake up
+        except Queue.Full:
+            pass  # the drawing thread is busy, it takes the posted events before the next draw command
+        self.event.set()
+        return request
+
+    def next_posted(self):
+        """The oldest posted event or None"""
+        try:
+            return self.posted.popleft()
+        except IndexError:
+            return None
+
+    def wait(self, timeout=None):
+        """Halts the drawing thread until the next request is queued and returns its command. If no request is
+        queued within ``timeout``, ``None`` is returned. Posted events are returned first.
+        """
+        while True:
+            request = self.next_posted()
+            if request is not None:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except Queue.Empty:
+                return None
+            if request is not None:
+                break
+            # only woken for a posted event, which might be taken already
+        # keep the behavior of MyEvent: messages which were not given stay as they are
+        self.request = request
+        self.trace = request.trace
+        if request.trace is not None:
+            request.trace.mark('draw_start')
+        if request.msg2:
+            self.msg2 = request.msg2
+        if request.msg3:
+            self.msg3 = request.msg3
+        if request.msg4 is not None:
+            self.msg4 = request.msg4
+        if request.time:
+            self.time = request.time
+        return request.msg
+
+    def task_done(self):
+        """Mark the request returned by the last :func:`wait` as drawn"""
+        if self.request:
+            request = self.request
+            self.request = None
+            request.done.set()
+            if not request.posted:
+                self.requests.task_done()
+
+    def join(self):
+        """Halts the calling thread until all queued draw commands are drawn"""
+        self.requests.join()
+
+
+class LatencyTrace:
+    """The time stamps of one gaze contingent reaction on its way through the framework, from the fixation of the
+    participant to the flip showing the agent's reaction.
+
+    A trace is started when a fixation is detected and handed on with the events of every stage: the AOI event of the
+    :class:`EventHandler.Fixation_Detector`, the draw request of the agent (see :func:`DrawPipeline.set_micro_state`)
+    and the screen drawn by the main loop. Each stage marks its time in experiment time [ms]. The onset of the
+    fixation is derived from the device time stamps of the tracker, so the time the fixation detection needs to
+    accept a fixation is part of the trace as well. The agent's deliberate lag lies between ``decision`` and
+    ``lag_elapsed``, it is subtracted from this interval, so the interval only shows how late the agent woke up.
+
+    :param device_time_stamp: Device time stamp of the gaze sample which completed the fixation in [us]
+    :type device_time_stamp: int
+    :param onset_time_stamp: Device time stamp of the first sample of the fixation in [us]
+    :type onset_time_stamp: int
+    :param detected: Time the fixation was detected in [ms], now if None
+    :type detected: float
+    """
+
+    STAGES = ['fixation_onset', 'fixation_detected', 'aoi_event', 'agent_woke', 'decision', 'lag_elapsed',
+              'draw_request', 'draw_start', 'flip']
+
+    def __init__(self, device_time_stamp=None, onset_time_stamp=None, detected=None):
+        self.device_time_stamp = device_time_stamp
+        self.times = {}
+        self.aoi = None  # AOI the fixation was in
+        self.agent = None  # screen drawn as reaction
+        self.agent_lag = 0.  # time the agent deliberately waits before reacting [ms]
+        detected = self.mark('fixation_detected', detected)
+        if device_time_stamp is not None and onset_time_stamp is not None:
+            self.mark('fixation_onset', detected - (device_time_stamp - onset_time_stamp) / 1000.)
+
+    def mark(self, stage, time=None):
+        """Set the time of a stage
+
+        :param stage: One of :attr:`STAGES`
+        :type stage: str
+        :param time: Time in [ms], now if None
+        :type time: float
+        :returns: the time of the stage
+        """
+        if time is None:
+            time = libtime.get_time()
+        self.times[stage] = time
+        return time
+
+    def intervals(self):
+        """Durations between the consecutive stages which were marked, without the deliberate lag of the agent
+
+        :returns: name (``first->second``) and duration in [ms] of each interval
+        :rtype: list
+        """
+        stages = [stage for stage in self.STAGES if stage in self.times]
+        return [(first + '->' + second, self.times[second] - self.times[first] -
+                 (self.agent_lag if second == 'lag_elapsed' else 0.))
+                for first, second in zip(stages[:-1], stages[1:])]
+
+    def system_delay(self):
+        """Time from the first marked stage (ideally the fixation onset) to the flip, without the deliberate lag of the
+        agent. This is what has to be added to the agent's nominal lag to get the lag the participant saw.
+
+        :returns: delay in [ms] or None if the flip was not marked
+        """
+        stages = [stage for stage in self.STAGES if stage in self.times]
+        if 'flip' not in self.times or len(stages) < 2:
+            return None
+        return self.times['flip'] - self.times[stages[0]] - self.agent_lag
+
+
+class LatencyLog:
+    """Collects the :class:`LatencyTrace` of every reaction of a block and writes them together with histograms of the
+    latency of each stage, so a regression of any stage becomes visible.
+
+    :param bin_width: Width of the histogram bins in [ms]
+    :type bin_width: float
+    :param max_latency: Latencies above are counted in the last bin in [ms]
+    :type max_latency: float
+
+    Negative latencies mean that the clocks of two stages disagree. They are counted in the first bin of the
+    histograms and reported by :func:`save`.
+    """
+
+    def __init__(self, bin_width=1., max_latency=200.):
+        self.traces = deque()  # appending is thread safe
+        self.bin_width = bin_width
+        self.max_latency = max_latency
+
+    def add(self, trace):
+        """Add a finished trace
+
+        :type trace: LatencyTrace
+        """
+        self.traces.append(trace)
+
+    def latencies(self):
+        """Latencies of all stages and the system delay
+
+        :returns: name and latencies in [ms] of each interval
+        :rtype: OrderedDict
+        """
+        stages = OrderedDict()
+        for first, second in zip(LatencyTrace.STAGES[:-1], LatencyTrace.STAGES[1:]):
+            stages[first + '->' + second] = []
+        stages['system_delay'] = []
+        for trace in list(self.traces):
+            for name, duration in trace.intervals():
+                stages.setdefault(name, []).append(duration)
+            delay = trace.system_delay()
+            if delay is not None:
+                stages['system_delay'].append(delay)
+        return OrderedDict([(name, numpy.array(values, dtype=float)) for name, values in stages.items() if values])
+
+    def summary(self):
+        """Print median, 95th percentile and maximum of each stage
+        """
+        lines = ['Latencies of %d reactions [ms]: median / 95%% / max' % len(self.traces)]
+        for name, values in self.latencies().items():
+            lines.append('%s: %.1f / %.1f / %.1f' % (name, numpy.median(values), numpy.percentile(values, 95),
+                                                     values.max()))
+        print(encapsulate_text('\n'.join(lines), color='blue'))
+
+    def save(self, file_name):
+        """Write all traces and the histograms of each stage
+
+        :param file_name: File name of the traces, the histograms are written to ``<file_name>_histograms``
+        :type file_name: str
+        """
+        with open(file_name + '.txt', 'w') as log_file:
+            log_file.write('\t'.join(['device_time_stamp', 'aoi', 'agent', 'agent_lag'] + LatencyTrace.STAGES +
+                                      ['system_delay']) + '\n')
+            for trace in list(self.traces):
+                values = [trace.device_time_stamp, trace.aoi, trace.agent, trace.agent_lag] + \
+                         [trace.times.get(stage) for stage in LatencyTrace.STAGES] + [trace.system_delay()]
+                log_file.write('\t'.join(['' if value is None else '%.3f' % value if isinstance(value, float)
+                                          else str(value) for value in values]) + '\n')
+
+        latencies = self.latencies()
+        for name, values in latencies.items():
+            if (values < 0).any():
+                print(colored_text('%d negative latencies of %s (min %.3f ms), check the clocks' %
+                                   ((values < 0).sum(), name, values.min()), 'red'))
+        bins = numpy.concatenate([[-numpy.inf], numpy.arange(0., self.max_latency + self.bin_width, self.bin_width),
+                                  [numpy.inf]])
+        with open(file_name + '_histograms.txt', 'w') as histogram_file:
+            histogram_file.write('\t'.join(['bin_start', 'bin_end'] + latencies.keys()) + '\n')
+            counts = [numpy.histogram(values, bins)[0] for values in latencies.values()]
+            for i in range(len(bins) - 1):
+                histogram_file.write('\t'.join([str(bins[i]), str(bins[i + 1])] +
+                                                [str(count[i]) for count in counts]) + '\n')
+
+
+class LogQueue:
+    """A lossless channel for log messages, to be used instead of a :class:`MyEvent` for a
+    :class:`LogManager.DataRecorder`.
+
+    :func:`set` has the same signature as :func:`MyEvent.set`, but instead of overwriting the last message every
+    message is appended to a queue, together with the experiment time it was logged at. Appending never blocks, so
+    any number of threads can log at the same time without losing messages. The recorder takes all queued messages
+    at once with :func:`drain`.
+    """
+
+    def __init__(self):
+        self.messages = deque()  # append and popleft of a deque are thread safe
+        self.event = Event()
+
+    def set(self, msg=None, time=None):
+        """Queue a message
+
+        :param msg: Anything, which should be logged
+        :type msg: object
+        :param time: NOT USED, only there to be compatible with :func:`MyEvent.set`
+        :type time: object
+        """
+        self.messages.append((libtime.get_time(), msg))
+        self.event.set()
+
+    def drain(self, timeout=None):
+        """Wait for messages and return all queued ones
+
+        :param timeout: Time to wait for a message in [s]
+        :type timeout: float
+        :returns: experiment time and message for all queued messages, oldest first
+        :rtype: list
+        """
+        self.event.wait(timeout)
+        # clear before taking messages, a message queued meanwhile sets the event again
+        self.event.clear()
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.popleft())
+            except IndexError:
+                return messages
+
+
+class AOIIndex:
+    """A uniform grid over the bounding boxes of a set of AOIs to quickly find all AOIs containing a point.
+
+    Every AOI is registered in all grid cells its bounding box overlaps, so a query only has to check the few AOIs
+    of one cell with :func:`libgazecon.AOI.contains` instead of all of them. Ellipses are handled correctly since
+    the exact test is still done by the AOI itself.
+
+    :param aois: AOIs to index, name: AOI
+    :type aois: dict
+    :param cell_size: Edge length of a grid cell in [px]
+    :type cell_size: int
+    """
+
+    def __init__(self, aois=None, cell_size=128):
+        self.cell_size = cell_size
+        self.cells = {}
+        if aois:
+            self.build(aois)
+
+    def build(self, aois):
+        """Rebuild the grid for the given AOIs
+
+        :param aois: AOIs to index, name: AOI
+        :type aois: dict
+        """
+        cells = {}
+        for name, aoi in aois.iteritems():
+            x_0, y_0 = [int(value // self.cell_size) for value in aoi.pos]
+            x_1 = int((aoi.pos[0] + aoi.size[0]) // self.cell_size)
+            y_1 = int((aoi.pos[1] + aoi.size[1]) // self.cell_size)
+            for x in range(x_0, x_1 + 1):
+                for y in range(y_0, y_1 + 1):
+                    cells.setdefault((x, y), []).append((name, aoi))
+        # swap in one go, so a concurrent query never sees a half built grid
+        self.cells = cells
+
+    def query(self, pos):
+        """Return the names of all AOIs containing the given point
+
+        :param pos: Point in [px]
+        :type pos: tuple
+        :rtype: list
+        """
+        candidates = self.cells.get((int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)), [])
+        return [name for name, aoi in candidates if aoi.contains(pos)]
+
+
+class ImageCache:
+    """A process wide cache of loaded and resized images with a least recently used memory bound.
+
+    Images are stored by the absolute file name and modification time of their file, resized images additionally by
+    the size (or scale factor) and proportional flag they were resized with. Rebuilding screens with images already
+    in the cache thus neither reads nor resamples any image. If an :attr:`asset_cache` is set, images resized from
+    their file are also looked up there before resampling them. Cached images are shared and must not be altered in
+    place (PIL's resize returns a new image anyway).
+
+    :param max_bytes: Memory bound of all cached pixel data in bytes
+    :type max_bytes: int
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()  # key: (image, bytes) in order of last use
+        self.cached_bytes = 0
+        self.lock = Lock()  # images are also loaded by e.g. JAP_ScreenHandler.ObjectSetBuilder
+        self.hits = 0
+        self.misses = 0
+        # on-disk cache of resized images asked on misses, see :class:`framework.asset_cache.AssetCache`
+        self.asset_cache = None
+
+    @staticmethod
+    def file_key(file_name):
+        """Key of a not resized image, changes when the file is modified
+
+        :param file_name: file name of the image
+        :type file_name: str
+        """
+        return os.path.abspath(file_name), os.path.getmtime(file_name)
+
+    def get(self, key):
+        """Get a cached image
+
+        :param key: key of the image, see :func:`file_key`
+        :return: the image or None if it is not cached
+        """
+        with self.lock:
+            entry = self.images.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.images[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, image):
+        """Add an image to the cache and forget the least recently used ones exceeding the memory bound
+
+        :param key: key of the image, see :func:`file_key`
+        :param image: the loaded image
+        :type image: :class:`PIL.Image.Image`
+        """
+        n_bytes = image.size[0] * image.size[1] * len(image.getbands())
+        with self.lock:
+            old = self.images.pop(key, None)
+            if old is not None:
+                self.cached_bytes -= old[1]
+            self.images[key] = (image, n_bytes)
+            self.cached_bytes += n_bytes
+            while self.cached_bytes > self.max_bytes and len(self.images) > 1:
+                self.cached_bytes -= self.images.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.cached_bytes = 0
+
+
+image_cache = ImageCache()
+
+
 class EventHandler(Thread):
     """This class shall be used to detect button press and gaze events etc.
 
@@ -132,16 +737,23 @@ class EventHandler(Thread):
         :type tracker: pygaze_framework.OurTracker object
         :param aoi_tol: NOT FUNCTIONAL
         :type aoi_tol: int
+        :param fixation_source: Object to wait for fixations with, e.g. a
+                                :class:`EventHandler.StreamingFixationDetector`. If None, the tracker's own
+                                ``wait_for_fixation_start`` is used.
+        :type fixation_source: object
         :param name: Name for thread
         :type name: str
         """
 
-        def __init__(self, tracker, log_event=None, aoi_tol=0, name='Fixation_Detector'):
+        def __init__(self, tracker, log_event=None, aoi_tol=0, fixation_source=None, name='Fixation_Detector'):
             super(EventHandler.Fixation_Detector, self).__init__(name=name)
             self.tracker = tracker  # tracker object
+            self.fixation_source = fixation_source if fixation_source else tracker  # object delivering fixations
             self.log_event = log_event  # log event
             self.num_aoi = 0  # counter for keeping track for number of AOIs
             self.aois = {}  # dict for AOIs
+            self.aoi_index = AOIIndex()  # grid to look up the AOIs a fixation is in
+            self.aoi_index_dirty = False  # AOIs changed since the grid was built
             self.aoi_event = MyEvent()  # event that is fired if fixation occured in relevant AOI
             self.daemon = True
             self.is_running = False
@@ -151,37 +763,53 @@ class EventHandler(Thread):
 
         def stop(self):
             self.is_running = False
+            if self.fixation_source is not self.tracker:
+                self.fixation_source.stop()
 
         def run(self):
             """ Method to run the fixation detector
 
             """
             self.is_running = True
+            if self.fixation_source is not self.tracker:
+                self.fixation_source.start()
             num_aoi = len(self.aois)
             while self.is_running:
                 found_aoi = False
 
-                # Wait for a fixation to occur
+                # Wait for a fixation to occur, sources which do not trace latencies start the trace at detection
                 try:
-                    fix_time, fix_pos = self.tracker.wait_for_fixation_start()
+                    if hasattr(self.fixation_source, 'wait_for_fixation'):
+                        fixation = self.fixation_source.wait_for_fixation()
+                        if fixation is None:
+                            break  # the fixation source was stopped
+                        fix_time, fix_pos, trace = fixation
+                    else:
+                        fix_time, fix_pos = self.fixation_source.wait_for_fixation_start()
+                        trace = LatencyTrace(detected=fix_time)
                 except IndexError:
                     print('Cannot wait for a fixation to start')
                     print(encapsulate_text(str(libtime.get_time()), color='red', background='yellow'))
                     print(colored_text(traceback.format_exc(), color='red'))
                 self.counter = 0
 
-                # Go through all AOIs and check whether given fixation is within them
-                # TOCHECK
-                for name, aoi in self.aois.iteritems():
+                # Rebuild the AOI grid only if AOIs were changed, reset the flag first to not miss a change
+                # happening while building
+                if self.aoi_index_dirty:
+                    self.aoi_index_dirty = False
+                    self.aoi_index.build(dict(self.aois))
+
+                # Go through all AOIs the fixation is within, log it and append fixation to fixation_list
+                for name in self.aoi_index.query(fix_pos):
                     self.counter += 1
-                    # if fixation is within the AOI, log it and append fixation to fixation_list
-                    if aoi.contains(fix_pos):
-                        self.aoi_event.set(name)
-                        found_aoi = True
-                        self.fixation_list.append([fix_time, fix_pos, name])
-                        if self.log_event:
-                            self.log_event.set([fix_time, fix_pos, name])
-                        # print(colored_text('Fixation detected at ' + name, 'blue'))
+                    trace.aoi = name
+                    trace.mark('aoi_event')
+                    self.aoi_event.set(name, trace=trace)
+                    found_aoi = True
+                    self.fixation_list.append([fix_time, fix_pos, name])
+                    if self.log_event:
+                        self.log_event.set([fix_time, fix_pos, name])
+                    # print(colored_text('Fixation detected at ' + name, 'blue'))
                 # if fixation was in no AOI, log it accordingly
                 if not found_aoi and self.log_event:
                     self.log_event.set([fix_time, fix_pos, None])
@@ -192,12 +820,18 @@ class EventHandler(Thread):
             """
             self.num_aoi += 1
             if aoi_tol:
-                self.aois[name] = libgazecon.AOI(aoi_type,
-                                                 (pos[0]-(int(size[0]/2)+aoi_tol[0]),
-                                                  pos[1]-(int(size[1]/2)+aoi_tol[1])),
-                                                 (size[0]+2*aoi_tol[0], size[1]+2*aoi_tol[1]))
+                aoi_pos = (pos[0]-(int(size[0]/2)+aoi_tol[0]), pos[1]-(int(size[1]/2)+aoi_tol[1]))
+                aoi_size = (size[0]+2*aoi_tol[0], size[1]+2*aoi_tol[1])
             else:
-                self.aois[name] = libgazecon.AOI(aoi_type, (pos[0]-int(size[0]/2), pos[1]-int(size[1]/2)), size)
+                aoi_pos = (pos[0]-int(size[0]/2), pos[1]-int(size[1]/2))
+                aoi_size = size
+            # AOIs are added again for every agent screen, only rebuild the grid if something actually changed
+            old_aoi = self.aois.get(name)
+            if old_aoi and getattr(old_aoi, 'aoitype', None) == aoi_type and tuple(old_aoi.pos) == tuple(aoi_pos) and \
+                    tuple(old_aoi.size) == tuple(aoi_size):
+                return
+            self.aois[name] = libgazecon.AOI(aoi_type, aoi_pos, aoi_size)
+            self.aoi_index_dirty = True
 
         def add_multiple_aois(self, *aoi_dicts):
             """
@@ -216,6 +850,192 @@ class EventHandler(Thread):
             for name, aoi in self.aois.items():
                 screen.draw_rect('yellow', aoi.pos[0], aoi.pos[1], aoi.size[0], aoi.size[1], border_size)
 
+    class StreamingFixationDetector:
+        """Online fixation detection on the samples delivered by the tobii_research gaze callback.
+
+        Unlike PyGaze's ``wait_for_fixation_start`` nothing is polled: every sample is processed once when the
+        tracker delivers it. Velocity and acceleration are computed incrementally over a short sliding window kept in
+        a ring buffer (I-VT), so sample noise of fast trackers does not look like a saccade. The dispersion of the
+        current fixation candidate is tracked via its bounding box (I-DT). As soon as the candidate has lasted
+        ``min_duration`` without a saccade and without exceeding ``dispersion``, a fixation start is emitted.
+
+        The thresholds are (re)read from the tracker by :func:`start`, i.e. after the calibration replaced them.
+        :func:`stop` wakes the threads waiting for fixations, :func:`wait_for_fixation` returns None then.
+
+        :param tracker: Tobii eyetracker to subscribe to
+        :type tracker: pygaze eyetracker object
+        :param dispsize: Display size in [px]
+        :type dispsize: tuple
+        :param vel_thresh: Saccade velocity threshold in [deg/s], e.g. ``SACCVELTHRESH`` from constants.py. The
+                           tracker's threshold if None
+        :type vel_thresh: float
+        :param acc_thresh: Saccade acceleration threshold in [deg/s**2], e.g. ``SACCACCTHRESH`` from constants.py. The
+                           tracker's threshold if None
+        :type acc_thresh: float
+        :param dispersion: Maximum dispersion (width + height) of a fixation in [px], the tracker's fixation threshold
+                           if None
+        :type dispersion: float
+        :param min_duration: Minimum duration of a fixation in [ms], the tracker's fixation time threshold if None
+        :type min_duration: float
+        :param velocity_window: Time span over which velocity and acceleration are computed in [ms]
+        :type velocity_window: float
+        :param buffer_size: Number of samples kept in the ring buffer
+        :type buffer_size: int
+        """
+
+        def __init__(self, tracker, dispsize, vel_thresh=None, acc_thresh=None, dispersion=None, min_duration=None,
+                     velocity_window=20, buffer_size=1024):
+            self.tracker = tracker
+            self.dispsize = dispsize
+            self.thresholds = (vel_thresh, acc_thresh, dispersion, min_duration)  # as given, None: the tracker's
+            self.resolve_thresholds()
+            self.velocity_window = velocity_window * 1000  # [us]
+            # ring buffer with the samples within the velocity window: device time stamp [us], x, y [px],
+            # velocity [px/s]
+            self.window = deque(maxlen=buffer_size)
+            self.fixations = Queue.Queue(maxsize=64)
+            self.last_fixation = None
+            self.is_running = False
+            self.reset()
+
+        def resolve_thresholds(self):
+            """ Convert the thresholds from degrees to pixels with the tracker's current screen distance and take the
+            thresholds not given from the tracker, PyGaze's defaults if the tracker does not know them
+            """
+            vel_thresh, acc_thresh, dispersion, min_duration = self.thresholds
+            pixpercm = getattr(self.tracker, 'pixpercm', 36.)
+            screendist = getattr(self.tracker, 'screendist', 57.)
+            pixperdeg = pixpercm * screendist * math.tan(math.radians(1))
+            if vel_thresh is None:
+                vel_thresh = getattr(self.tracker, 'spdtresh', 35)
+            if acc_thresh is None:
+                acc_thresh = getattr(self.tracker, 'accthresh', 9500)
+            self.vel_thresh = vel_thresh * pixperdeg  # [px/s]
+            self.acc_thresh = acc_thresh * pixperdeg  # [px/s**2]
+            self.dispersion = dispersion if dispersion is not None else \
+                getattr(self.tracker, 'pxfixtresh', 1.5*pixperdeg)
+            self.min_duration = min_duration if min_duration is not None else \
+                getattr(self.tracker, 'fixtimetresh', 100)
+
+        def reset(self):
+            """ Discard the current fixation candidate
+            """
+            self.window.clear()
+            self.candidate_start = None
+            self.bounds = None
+            self.in_fixation = False
+
+        def start(self):
+            self.resolve_thresholds()
+            self.is_running = True
+            self.tracker.eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self.on_gaze_data, as_dictionary=True)
+
+        def stop(self):
+            self.is_running = False
+            self.tracker.eyetracker.unsubscribe_from(tr.EYETRACKER_GAZE_DATA, self.on_gaze_data)
+            self.put(None)  # wake the threads waiting for fixations
+
+        def put(self, fixation):
+            """ Queue a fixation (None when stopped), drops the oldest one if nobody is waiting for fixations
+            """
+            try:
+                self.fixations.put_nowait(fixation)
+            except Queue.Full:
+                self.fixations.get_nowait()
+                self.fixations.put_nowait(fixation)
+
+        def on_gaze_data(self, gaze_data):
+            """ Callback for tobii_research, process a single sample
+            """
+            points = [gaze_data[eye + '_gaze_point_on_display_area'] for eye in ['left', 'right']
+                      if gaze_data[eye + '_gaze_point_validity']]
+            if not points:
+                # blink or lost eyes: no fixation can go on
+                self.reset()
+                return
+            x = sum([point[0] for point in points]) / len(points) * self.dispsize[0]
+            y = sum([point[1] for point in points]) / len(points) * self.dispsize[1]
+            self.process_sample(gaze_data['device_time_stamp'], x, y)
+
+        def process_sample(self, time_stamp, x, y):
+            """ Update velocity, acceleration and the fixation candidate with a new sample
+
+            :param time_stamp: device time stamp in [us]
+            :type time_stamp: int
+            :param x: horizontal gaze position in [px]
+            :type x: float
+            :param y: vertical gaze position in [px]
+            :type y: float
+            """
+            previous = self.window[-1] if self.window else None
+            if previous is not None and time_stamp <= previous[0]:
+                return
+            # move the velocity window: only the samples leaving it are touched
+            while self.window and time_stamp - self.window[0][0] > self.velocity_window:
+                self.window.popleft()
+            reference = self.window[0] if self.window else previous
+            if reference is None:
+                velocity = None
+            else:
+                dt = (time_stamp - reference[0]) / 1000000.
+                velocity = math.hypot(x - reference[1], y - reference[2]) / dt
+            sample = (time_stamp, x, y, velocity)
+            self.window.append(sample)
+            if velocity is None or reference[3] is None:
+                return
+            acceleration = abs(velocity - reference[3]) / dt
+            if velocity > self.vel_thresh or acceleration > self.acc_thresh:
+                # saccade
+                self.candidate_start = None
+                self.in_fixation = False
+                return
+            if self.candidate_start is None:
+                self.candidate_start = previous[0]
+                self.bounds = [min(x, previous[1]), max(x, previous[1]), min(y, previous[2]), max(y, previous[2])]
+            else:
+                self.bounds = [min(x, self.bounds[0]), max(x, self.bounds[1]), min(y, self.bounds[2]),
+                               max(y, self.bounds[3])]
+            if (self.bounds[1] - self.bounds[0]) + (self.bounds[3] - self.bounds[2]) > self.dispersion:
+                # gaze drifted too far, start a new candidate with the current sample
+                self.candidate_start = time_stamp
+                self.bounds = [x, x, y, y]
+                self.in_fixation = False
+                return
+            if not self.in_fixation and (time_stamp - self.candidate_start) / 1000. >= self.min_duration:
+                self.in_fixation = True
+                self.emit_fixation(time_stamp)
+
+        def emit_fixation(self, time_stamp):
+            """ Hand a fixation start over to the threads waiting for it
+            """
+            fix_pos = ((self.bounds[0] + self.bounds[1]) / 2., (self.bounds[2] + self.bounds[3]) / 2.)
+            self.last_fixation = {'device_time_stamp_start': self.candidate_start,
+                                  'device_time_stamp_detected': time_stamp, 'pos': fix_pos}
+            trace = LatencyTrace(time_stamp, self.candidate_start)
+            self.put((trace.times['fixation_detected'], fix_pos, trace))
+
+        def wait_for_fixation_start(self):
+            """ Block until the next fixation starts, same interface as PyGaze's eyetracker
+
+            :returns: time of detection in [ms] (experiment time) and position of the fixation in [px], None if the
+                      detection was stopped
+            :rtype: tuple
+            """
+            fixation = self.wait_for_fixation()
+            return fixation[:2] if fixation is not None else None
+
+        def wait_for_fixation(self):
+            """ Block until the next fixation starts
+
+            :returns: time of detection in [ms] (experiment time), position of the fixation in [px] and the
+                      :class:`LatencyTrace` started by the fixation, None if the detection was stopped
+            :rtype: tuple
+            """
+            fixation = self.fixations.get()
+            if fixation is None:
+                self.put(None)  # wake the next waiting thread as well
+            return fixation
+
     class BlinkDetector(Thread):
         """A class to detect blinks NOT FUNCTIONAL
 
@@ -303,6 +1123,7 @@ class EventHandler(Thread):
         self.create_events(keylist)
         self.event_pressed = Event()
         self.event_released = Event()
+        self.key_pipeline = None  # DrawPipeline key presses are forwarded to
 
         self.time = time
 
@@ -318,18 +1139,34 @@ class EventHandler(Thread):
             fixation_detector.stop()
         self.is_running = False
 
+    def forward_keys(self, draw_pipeline):
+        """Forward all key presses to a draw pipeline as soon as they happen.
+
+        Each key press is posted as ``'__key_press__'`` with the key and the experiment time of the press as data,
+        i.e. the time ioHub registered the press converted to :func:`libtime.get_time`.
+
+        :param draw_pipeline: Pipeline of the thread handling the key presses
+        :type draw_pipeline: DrawPipeline
+        """
+        self.key_pipeline = draw_pipeline
+
     def run(self):
         self.is_running = True
         while self.is_running:
-            keyboard_events = self.keyboard.getKeys()
+            # returns as soon as there are key events, or after self.time [ms] to check whether to keep running
+            keyboard_events = self.keyboard.waitForKeys(maxWait=self.time/1000., clear=True)
+            if keyboard_events:
+                # offset between the clocks of ioHub [s] and libtime [ms]
+                clock_offset = libtime.get_time() - self.io.getTime() * 1000.
             for event in keyboard_events:
                 if event.type == 'KEYBOARD_PRESS':
                     self.event_pressed.set()
                     self.score_event(event, self.event_press_dic)
+                    if self.key_pipeline:
+                        self.key_pipeline.post('__key_press__', (event.key, event.time * 1000. + clock_offset))
                 else:
                     self.event_released.set()
                     self.score_event(event, self.event_release_dic)
-            libtime.pause(self.time)
 
     def create_events(self, keylist):
         """Create events for buttons presses
@@ -439,6 +1276,11 @@ class ScreenHandler(object):
     :param object_picker: Class delivering names of objects to be shown on the screen
     :param resize_proportional: KP
     :type resize_proportional: boolean
+    :param offscreen: Draw into a NumPy framebuffer instead of a display (see :mod:`framework.offscreen`), e.g. to
+                      benchmark building and showing screens without a monitor
+    :type offscreen: boolean
+    :param refresh_rate: Refresh rate of the display in [Hz], flips are checked against it (see :class:`FrameTimer`)
+    :type refresh_rate: float
 
     """
 
@@ -543,11 +1385,24 @@ class ScreenHandler(object):
         """
 
         def __init__(self, file_name, position=(0, 0), size=None, scale_factor=1):
-            self.image = PIL.Image.open(file_name)
-            self.image.load()
+            # the loaded (and resized) image is shared with all other Images of the same file, see ImageCache
+            self.file_name = file_name
+            self.file_key = image_cache.file_key(file_name)
+            self.cache_key = self.file_key
             self.position = position
-            self.size = self.image.size
             self.has_aoi = False
+            self.stim = None  # stimulus (i.e. texture) of the image once it was drawn
+
+            # an already resized image does not need the original image at all
+            if size and scale_factor == 1 and self.resize_from_cache(size):
+                return
+
+            self.image = image_cache.get(self.cache_key)
+            if self.image is None:
+                self.image = PIL.Image.open(file_name)
+                self.image.load()
+                image_cache.put(self.cache_key, self.image)
+            self.size = self.image.size
 
             if not (scale_factor == 1):
                 self.resize(scale_factor)
@@ -572,6 +1427,9 @@ class ScreenHandler(object):
                             for rescaling.
             :type proportional: bool
             """
+            if self.resize_from_cache(new_size, proportional):
+                return
+            key = self.resize_key(new_size, proportional)
             if type(new_size) in [list, tuple]:
                 if proportional:
                     if type(self.size) is tuple:
@@ -590,6 +1448,37 @@ class ScreenHandler(object):
             else:
                 self.size = (int(i * new_size) for i in self.size)
             self.image = self.image.resize(self.size)
+            image_cache.put(key, self.image)
+            if self.cache_key == self.file_key and image_cache.asset_cache is not None:
+                image_cache.asset_cache.store(self.file_name, new_size, proportional, self.image)
+            self.cache_key = key
+            self.stim = None
+
+        def resize_key(self, new_size, proportional=True):
+            return self.cache_key, tuple(new_size) if type(new_size) in [list, tuple] else new_size, proportional
+
+        def resize_from_cache(self, new_size, proportional=True):
+            """Take the resized image from the image cache or, if resized from the original file, the asset cache.
+
+            :param new_size: The target size or scaling factor, see :func:`resize`
+            :type new_size: list, tuple, int, float
+            :param proportional: Whether the aspect ratio of the image should be kept while resizing
+            :type proportional: bool
+            :return: whether the resized image was cached
+            """
+            key = self.resize_key(new_size, proportional)
+            cached = image_cache.get(key)
+            if cached is None and self.cache_key == self.file_key and image_cache.asset_cache is not None:
+                cached = image_cache.asset_cache.load(self.file_name, new_size, proportional)
+                if cached is not None:
+                    image_cache.put(key, cached)
+            if cached is None:
+                return False
+            self.image = cached
+            self.size = cached.size
+            self.cache_key = key
+            self.stim = None
+            return True
 
         def move(self, new_position):
             """Move the image to a new location on the screen.
@@ -602,6 +1491,7 @@ class ScreenHandler(object):
             self.position = new_position
             self.has_aoi = False
             self.aoi = []
+            self.stim = None
 
         def get_ulc_pos(self):
             """Returns the position of the upper left corner.
@@ -610,20 +1500,188 @@ class ScreenHandler(object):
             """
             return self.position[0] - int(self.size[0] / 2), self.position[1] - int(self.size[1] / 2)
 
+    class Compositor:
+
+        """A class to compose the screen to be shown from layers.
+
+        The background layer is a prepared screen (e.g. a cached agent screen with its objects and pixels), which is
+        only referenced and never copied. The overlay layer holds the few stimuli changing from flip to flip (score,
+        AOI highlights, gaze cursor), so changing it costs the same no matter how many objects are on screen.
+        Screens not keeping their stimuli in a list (i.e. non PsychoPy backends) are copied as before.
+
+        :param new_screen: Function creating an empty screen
+        :type new_screen: callable
+        """
+
+        def __init__(self, new_screen=libscreen.Screen):
+            self.composite = new_screen()
+            self.overlay = new_screen()
+            self.layered = isinstance(getattr(self.composite, 'screen', None), list)
+            # stimuli of the empty overlay screen (i.e. its background) are no part of the overlay layer
+            self.overlay_start = len(self.overlay.screen) if self.layered else 0
+            self.background = None
+            self.background_length = 0
+
+        def set_background(self, screen):
+            """Use screen as background layer and clear the overlay layer.
+
+            :param screen: the prepared screen to be shown behind the overlay
+            :type screen: :class:`pygaze.libscreen.Screen`
+            :return: the screen to draw the overlay on
+            """
+            # only rebuild the composite if another (or altered) screen is used as background
+            if self.layered and (screen is not self.background or len(screen.screen) != self.background_length):
+                self.composite.screen = list(screen.screen)
+                self.background_length = len(screen.screen)
+            self.background = screen
+            return self.clear_overlay()
+
+        def clear_overlay(self):
+            """Remove all stimuli from the overlay layer.
+
+            :return: the screen to draw the overlay on
+            """
+            if self.layered:
+                del self.overlay.screen[self.overlay_start:]
+                del self.composite.screen[self.background_length:]
+                return self.overlay
+            self.composite.copy(self.background)
+            return self.composite
+
+        def compose(self):
+            """Put the overlay layer on top of the background layer.
+
+            :return: the screen to be shown
+            """
+            if self.layered:
+                self.composite.screen[self.background_length:] = self.overlay.screen[self.overlay_start:]
+            return self.composite
+
+    class FrameTimer:
+
+        """A class to record the timing of every flip and to detect flips which missed their refresh.
+
+        A flip blocks until the next refresh of the display. Flips shown back to back (i.e. drawing started within
+        one refresh after the previous flip) are expected one refresh after the previous flip. Flips after a pause are
+        expected within one refresh after they were started. Every further refresh they took is a missed frame.
+
+        :param refresh_rate: Refresh rate of the display in [Hz]
+        :type refresh_rate: float
+        :param tolerance: Fraction of a refresh period a flip may be late without counting as missed
+        :type tolerance: float
+        """
+
+        def __init__(self, refresh_rate=60., tolerance=.25):
+            self.refresh_rate = float(refresh_rate)
+            self.period = 1000. / self.refresh_rate  # [ms]
+            self.tolerance = tolerance
+            self.reset()
+
+        def reset(self):
+            """Forget all recorded flips
+            """
+            self.flips = []  # flip start, flip time, missed frames, label
+            self.missed_frames = 0
+            self.missed_flips = 0
+
+        def record(self, flip_start, flip_time, label=None):
+            """Record a flip
+
+            :param flip_start: Time the flip was started (i.e. :func:`show` was called) in [ms]
+            :type flip_start: float
+            :param flip_time: Time the flip returned in [ms]
+            :type flip_time: float
+            :param label: What was shown, e.g. the agent's gaze direction
+            :type label: str
+            :returns: number of missed frames
+            :rtype: int
+            """
+            last_flip = self.flips[-1][1] if self.flips else None
+            if last_flip is not None and flip_start - last_flip < self.period:
+                frames = (flip_time - last_flip) / self.period
+            else:
+                frames = (flip_time - flip_start) / self.period
+            missed = max(0, int(math.ceil(frames - 1 - self.tolerance)))
+            if missed:
+                self.missed_frames += missed
+                self.missed_flips += 1
+            self.flips.append((flip_start, flip_time, missed, label))
+            return missed
+
+        def statistics(self):
+            """Summary of all flips
+
+            :returns: intervals between flips and durations of flips in [ms] (median, 95th percentile, maximum each),
+                      number of flips, flips which missed their refresh and missed frames
+            :rtype: OrderedDict
+            """
+            flips = numpy.array([flip[:2] for flip in self.flips], dtype=float).reshape(-1, 2)
+            stats = OrderedDict([('flips', len(self.flips)), ('missed_flips', self.missed_flips),
+                                 ('missed_frames', self.missed_frames)])
+            for name, values in [('interval', numpy.diff(flips[:, 1])), ('duration', flips[:, 1] - flips[:, 0])]:
+                if len(values):
+                    stats[name] = (numpy.median(values), numpy.percentile(values, 95), values.max())
+            return stats
+
+        def summary(self):
+            """Print the statistics of all flips
+            """
+            stats = self.statistics()
+            lines = ['%d flips at %g Hz, %d missed their refresh (%d frames)' % (stats['flips'], self.refresh_rate,
+                                                                              stats['missed_flips'],
+                                                                              stats['missed_frames'])]
+            for name in ['interval', 'duration']:
+                if name in stats:
+                    lines.append('%s [ms]: median %.1f, 95%% %.1f, max %.1f' % ((name,) + stats[name]))
+            print(encapsulate_text('\n'.join(lines), color='red' if stats['missed_flips'] else 'green'))
+
+        def save(self, file_name):
+            """Write all flips with their interval to the previous flip and the summary statistics as header
+
+            :param file_name: File name without extension
+            :type file_name: str
+            """
+            with open(file_name + '.txt', 'w') as timing_file:
+                for name, value in self.statistics().items():
+                    if type(value) is tuple:
+                        value = 'median %.3f, 95%% %.3f, max %.3f' % value
+                    timing_file.write('# %s: %s\n' % (name, value))
+                timing_file.write('# refresh_rate: %g\n' % self.refresh_rate)
+                timing_file.write('\t'.join(['flip_start', 'flip_time', 'interval', 'duration', 'missed_frames',
+                                             'label']) + '\n')
+                last_flip = None
+                for flip_start, flip_time, missed, label in self.flips:
+                    interval = '' if last_flip is None else '%.3f' % (flip_time - last_flip)
+                    timing_file.write('%.3f\t%.3f\t%s\t%.3f\t%d\t%s\n' % (flip_start, flip_time, interval,
+                                                                        flip_time - flip_start, missed,
+                                                                        '' if label is None else label))
+                    last_flip = flip_time
+
     def __init__(self, stimtracker_parameters, mucap_parameters, instruction_texts, object_picker, dispsize,
-                 nirs_param, screennr=0, resize_proportional=True):
+                 nirs_param, screennr=0, resize_proportional=True, offscreen=False, refresh_rate=60):
 
         self.resize_proportional = resize_proportional
         self.stim_tracker_square = False
+        self.offscreen = offscreen
+        self.dispsize = dispsize
 
         # Create Pygaze/Psychopy Objects
-        self.display = libscreen.Display(screennr=screennr)
+        if self.offscreen:
+            self.display = OffscreenDisplay(dispsize)
+        else:
+            self.display = libscreen.Display(screennr=screennr)
         # General screens
         self.screens = {}
         # Dict for text screens
         self.screens_txt = {}
         # Dict for Image Objects
         self.images_stored = {}
+        # Stimuli shared by many screens (e.g. stimtracker pixel), see draw_shared
+        self.shared_stims = {}
+        # Composes cached screens with score, highlights and gaze cursor, see Compositor
+        self.compositor = self.Compositor(self.new_screen)
+        # Timing of all flips, see flip
+        self.frame_timer = self.FrameTimer(refresh_rate)
         # Boolean for stimtracker signal
         self.stimtracker_black = True
         # Some parameters and text
@@ -633,7 +1691,6 @@ class ScreenHandler(object):
         self.instruction_texts = instruction_texts
         # Object picker for selecting objects to be presented on the screen
         self.object_picker = object_picker
-        self.dispsize = dispsize
 
         # For later use
         self.images_stored = {}
@@ -648,11 +1705,34 @@ class ScreenHandler(object):
         self.progressb['y'] = 1000.
         self.progressb['y_len'] = 100.
 
+    def new_screen(self):
+        """ Create an empty screen for the display in use
+
+        :return: the new screen
+        :rtype: :class:`pygaze.libscreen.Screen` or :class:`framework.offscreen.OffscreenScreen`
+        """
+        if self.offscreen:
+            return OffscreenScreen(self.dispsize)
+        return libscreen.Screen()
+
+    def flip(self, label=None):
+        """ Show the filled display and record the timing of the flip, see :class:`FrameTimer`
+
+        :param label: What is shown, e.g. the agent's gaze direction
+        :type label: str
+        :return: time of the flip in [ms]
+        """
+        flip_start = libtime.get_time()
+        self.display.show()
+        flip_time = libtime.get_time()
+        self.frame_timer.record(flip_start, flip_time, label)
+        return flip_time
+
     def make_text_screen(self, text, name):
         """ Make a screen containing text
         """
         self.screens_txt[name] = {}
-        self.screens_txt[name]['white'] = libscreen.Screen()
+        self.screens_txt[name]['white'] = self.new_screen()
         self.draw_text(text, self.screens_txt[name]['white'], fontsize=32)
         self.copy_screen_w_stimtracker_pixel(self.screens_txt[name])
 
@@ -664,7 +1744,7 @@ class ScreenHandler(object):
         stimtracker signal
         """
         self.fix_cross_scr = {}
-        self.fix_cross_scr['white'] = libscreen.Screen()
+        self.fix_cross_scr['white'] = self.new_screen()
         self.fix_cross_scr['white'].draw_fixation(pw=3, diameter=75)
         self.copy_screen_w_stimtracker_pixel(self.fix_cross_scr)
 
@@ -681,7 +1761,7 @@ class ScreenHandler(object):
 
     def show_base_line_screen_w_progress(self, min_dur, max_dur):
         self.make_fix_cross_screen()
-        baseline_duration = random.randrange(min_dur, max_dur)
+        baseline_duration = session_rng.stdlib('baseline').randrange(min_dur, max_dur)
         t0 = libtime.get_time()
         self.fix_cross_scr['white'].draw_rect('green', self.progressb['x'], self.progressb['y'],
                                               self.progressb['x_len'], self.progressb['y_len'], 5)
@@ -719,7 +1799,7 @@ class ScreenHandler(object):
         """
         self.last_screen = None
         instruction_screen = {}
-        instruction_screen['white'] = libscreen.Screen()
+        instruction_screen['white'] = self.new_screen()
         self.draw_text(text, instruction_screen['white'], fontsize=fontsize, color=color)
         # check for the correct stimtracker signal
         if self.stimtracker_black:
@@ -733,8 +1813,7 @@ class ScreenHandler(object):
         self.make_mucap_trigger_pixel(instruction_screen, mucap_stim)
         # actually show the created screen
         self.display.fill(instruction_screen)
-        self.display.show()
-        return libtime.get_time()
+        return self.flip('instruction')
 
     def copy_screen_w_stimtracker_pixel(self, screen):
         """ Copy screen and add a stimtracker pixel to it
@@ -742,13 +1821,34 @@ class ScreenHandler(object):
              output will be in item ['black']
          """
 
-        screen['black'] = libscreen.Screen()
+        screen['black'] = self.new_screen()
         screen['black'].copy(screen['white'])
-        screen['black'].draw_rect(colour=self.stimtracker_parameters['color'],
-                                  x=self.stimtracker_parameters['position'][0],
-                                  y=self.stimtracker_parameters['position'][1],
-                                  w=self.stimtracker_parameters['size'][0],
-                                  h=self.stimtracker_parameters['size'][1], fill=True)
+        self.draw_shared(screen['black'], 'stimtracker',
+                         lambda black: black.draw_rect(colour=self.stimtracker_parameters['color'],
+                                                       x=self.stimtracker_parameters['position'][0],
+                                                       y=self.stimtracker_parameters['position'][1],
+                                                       w=self.stimtracker_parameters['size'][0],
+                                                       h=self.stimtracker_parameters['size'][1], fill=True))
+
+    def draw_shared(self, screen, key, draw_function):
+        """ Draw a stimulus only once and add this very stimulus to every further screen it is drawn on, so e.g. its
+        texture is created only once per session instead of once per screen.
+
+        :param screen: Screen to draw on
+        :type screen: pygaze Screen
+        :param key: Name of the stimulus
+        :type key: str, tuple
+        :param draw_function: Function drawing the stimulus on the screen given to it
+        :type draw_function: callable
+        """
+        # only PsychoPy screens keep their stimuli in a list
+        if not isinstance(getattr(screen, 'screen', None), list):
+            draw_function(screen)
+        elif key in self.shared_stims:
+            screen.screen.append(self.shared_stims[key])
+        else:
+            draw_function(screen)
+            self.shared_stims[key] = screen.screen[-1]
 
     def make_mucap_trigger_pixel(self, screen, mucap_stim=None):
         """ Method to put a mucap pixel for a defined event on screen
@@ -762,10 +1862,11 @@ class ScreenHandler(object):
         else:
             color = None
         if color:
-            screen.draw_rect(colour=color,
-                             x=self.mucap_parameters['pixel_pos'][0],
-                             y=self.mucap_parameters['pixel_pos'][1],
-                             w=1, h=1, fill=True)
+            self.draw_shared(screen, ('mucap', str(color)),
+                             lambda mucap_screen: mucap_screen.draw_rect(colour=color,
+                                                                         x=self.mucap_parameters['pixel_pos'][0],
+                                                                         y=self.mucap_parameters['pixel_pos'][1],
+                                                                         w=1, h=1, fill=True))
 
     def draw_aoi(self, screen, image):
         """ Method to draw aoi as rectangle on screen
@@ -779,11 +1880,10 @@ class ScreenHandler(object):
 
     def draw_gaze_cursor(self, tracker):
         if self.last_screen:
-            temp_screen = libscreen.Screen()
-            temp_screen.copy(self.last_screen)
-            temp_screen.draw_fixation('cross', 'green', tracker.sample())
-            self.display.fill(temp_screen)
-            self.display.show()
+            overlay = self.compositor.set_background(self.last_screen)
+            overlay.draw_fixation('cross', 'green', tracker.sample())
+            self.display.fill(self.compositor.compose())
+            self.flip('gaze_cursor')
 
     def store_image(self, name, file_name, position=(0, 0), size=None, scale_factor=1):
         """Store images, which should be drawn later on.
@@ -840,8 +1940,18 @@ class ScreenHandler(object):
                 resize_proportional = self.resize_proportional
             image.resize(new_size, resize_proportional)
 
+        if position or new_size:
+            # the cached stimulus shows the image at its old position and size
+            image.stim = None
+
         if not draw_all:
-            screen.draw_image(image.image, image.position, None)
+            # the stimulus of an image is reused for every screen, so its texture is only uploaded once
+            if image.stim is not None and isinstance(getattr(screen, 'screen', None), list):
+                screen.screen.append(image.stim)
+            else:
+                screen.draw_image(image.image, image.position, None)
+                if isinstance(getattr(screen, 'screen', None), list):
+                    image.stim = screen.screen[-1]
             # self.screen_insturctions.draw_rect(colour='red', x = image.get_ulc_pos()[0], y = image.get_ulc_pos()[1],
             #                                    w= image.size[0], h = image.size[1])
         else:
@@ -880,7 +1990,7 @@ class ScreenHandler(object):
         rating_scale = RatingScale(pygaze.expdisplay, low=low, high=high, labels=labels, precision=precision,
                                    markerStart=markerStart, mouseOnly=only_mouse, noMouse=not use_mouse,
                                    scale=str(low)+scale+str(high), textColor='black')
-        temp_screen = libscreen.Screen()
+        temp_screen = self.new_screen()
         temp_screen.screen.append(rating_scale)
         # add the question to the screen
         text_stim = TextStim(pygaze.expdisplay, text, color='black', height=50, wrapWidth=1000)
@@ -899,7 +2009,7 @@ class ScreenHandler(object):
         # wait for input on the rating scale
         while rating_scale.noResponse:
             self.display.fill(temp_screen)
-            self.display.show()
+            self.flip('rating')
         return rating_scale.getHistory(), draw_time
 
     def show(self, screen, color='green', tracker=None):
@@ -915,14 +2025,14 @@ class ScreenHandler(object):
 
         # if there is a EyeTracker object given to the EventHandler, add a fixation cursor to the screen
         if tracker:
-            active_screen = libscreen.Screen()
+            active_screen = self.new_screen()
             active_screen.copy(screen)
             screen.draw_fixation(colour=color, pos=tracker.sample())
             self.display.fill(active_screen)
         else:
             self.display.fill(screen)
 
-        self.display.show()
+        self.flip()
 
     def give_stim_tracker_signal(self, screen):
         """Method that will create a little black square for stim tracking using a Tobii stim_tracker_square,
@@ -981,6 +2091,153 @@ class TriggerTimer(Thread):
             time.sleep(self.trigger_time/1000.)
 
 
+class TrackerClock:
+    """A linear model of the eyetracker's clocks to convert experiment time into device and system time stamps.
+
+    The Tobii SDK delivers every sample with its device time stamp and the corresponding system time stamp. The
+    relation between both is fitted over a sliding window of samples. Experiment time (:func:`libtime.get_time`) is
+    related to system time by sync points: reading the system clock between two readings of the experiment clock. The
+    sync point with the shortest bracket of a few tries is kept and the relation is fitted over a sliding window of
+    sync points as well. Both fits are updated with every chunk of samples the :class:`LogManager.TobiiDumper` drains,
+    so they follow the drift of the clocks. Converting a time stamp only needs the current coefficients, the gaze
+    buffer of the tracker is not touched.
+
+    :param tracker: Eyetracker delivering the samples, its ``get_system_time_stamp`` is used if it has one (e.g. a
+                    :class:`simulated_tracker.SimulatedTracker`), tobii_research's otherwise
+    :type tracker: pygaze eyetracker object
+    :param window: Number of pairs of time stamps kept for each fit
+    :type window: int
+    :param pairs_per_chunk: Number of pairs of time stamps taken from each chunk of samples
+    :type pairs_per_chunk: int
+    :param sync_tries: Number of tries for each sync point, the one with the shortest bracket is kept
+    :type sync_tries: int
+    """
+
+    def __init__(self, tracker=None, window=512, pairs_per_chunk=16, sync_tries=3):
+        self.system_clock = getattr(tracker, 'get_system_time_stamp', None) or tr.get_system_time_stamp
+        self.pairs_per_chunk = pairs_per_chunk
+        self.sync_tries = sync_tries
+        self.sample_pairs = deque(maxlen=window)  # system time stamp, device time stamp [us]
+        self.sync_points = deque(maxlen=window)  # experiment time [ms], system time stamp [us], bracket [us]
+        # fits as (x_0, y_0, slope, max. residual): y = y_0 + slope * (x - x_0), None until there is data
+        self.system_fit = None  # experiment time -> system time stamp
+        self.device_fit = None  # system time stamp -> device time stamp
+
+    @staticmethod
+    def fit(x, y, slope):
+        """Fit a line to the given points, only the offset is fitted if the points do not span an interval
+
+        :param slope: Slope to use if it cannot be fitted
+        :type slope: float
+        :returns: x_0, y_0, slope and the maximum absolute residual
+        :rtype: tuple
+        """
+        x = numpy.asarray(x, dtype=float)
+        y = numpy.asarray(y, dtype=float)
+        # center the time stamps, their absolute values are too large for a precise fit
+        x_0 = x.mean()
+        if len(x) > 1 and x.ptp() > 0:
+            slope, y_0 = numpy.polyfit(x - x_0, y, 1)
+        else:
+            y_0 = y.mean()
+        residuals = y - (y_0 + slope * (x - x_0))
+        return x_0, y_0, slope, float(numpy.abs(residuals).max())
+
+    def sync(self):
+        """Take a sync point between the experiment clock and the system clock
+        """
+        best = None
+        for i in range(self.sync_tries):
+            before = libtime.get_time()
+            system_time_stamp = self.system_clock()
+            after = libtime.get_time()
+            bracket = (after - before) * 1000.
+            if best is None or bracket < best[2]:
+                best = ((before + after) / 2., system_time_stamp, bracket)
+        self.sync_points.append(best)
+        self.system_fit = self.fit([point[0] for point in self.sync_points],
+                                   [point[1] for point in self.sync_points], 1000.)
+
+    def update(self, samples):
+        """Update the model with a chunk of samples and a new sync point
+
+        :param samples: Samples as delivered by tobii_research
+        :type samples: list of dicts
+        """
+        if samples:
+            step = max(1, len(samples) // self.pairs_per_chunk)
+            for sample in samples[::step] + [samples[-1]]:
+                self.sample_pairs.append((sample['system_time_stamp'], sample['device_time_stamp']))
+            self.device_fit = self.fit([pair[0] for pair in self.sample_pairs],
+                                       [pair[1] for pair in self.sample_pairs], 1.)
+        self.sync()
+
+    def system_time(self, experiment_time=None):
+        """System time stamp at the given experiment time
+
+        :param experiment_time: Experiment time in [ms], now if None
+        :type experiment_time: float
+        :returns: system time stamp in [us], None without sync point
+        """
+        fit = self.system_fit
+        if fit is None:
+            return None
+        if experiment_time is None:
+            experiment_time = libtime.get_time()
+        return int(round(fit[1] + fit[2] * (experiment_time - fit[0])))
+
+    def device_time(self, experiment_time=None):
+        """Device time stamp at the given experiment time
+
+        :param experiment_time: Experiment time in [ms], now if None
+        :type experiment_time: float
+        :returns: device time stamp in [us], None before the first samples were drained
+        """
+        fit = self.device_fit
+        system_time_stamp = self.system_time(experiment_time)
+        if fit is None or system_time_stamp is None:
+            return None
+        return int(round(fit[1] + fit[2] * (system_time_stamp - fit[0])))
+
+    def experiment_time(self, device_time_stamp):
+        """Experiment time at the given device time stamp
+
+        :param device_time_stamp: Device time stamp in [us]
+        :type device_time_stamp: int
+        :returns: experiment time in [ms], None before the first samples were drained
+        """
+        device_fit, system_fit = self.device_fit, self.system_fit
+        if device_fit is None or system_fit is None:
+            return None
+        system_time_stamp = device_fit[0] + (device_time_stamp - device_fit[1]) / device_fit[2]
+        return system_fit[0] + (system_time_stamp - system_fit[1]) / system_fit[2]
+
+    def error_bound(self):
+        """Bound of the error of a converted device time stamp: the maximum residuals of both fits within their
+        windows plus half the longest bracket of the sync points
+
+        :returns: error bound in [us], None before the first samples were drained
+        """
+        if self.device_fit is None or self.system_fit is None:
+            return None
+        return self.device_fit[3] + self.system_fit[3] + max([point[2] for point in self.sync_points]) / 2.
+
+    def state(self):
+        """Current coefficients of the model, e.g. to be logged
+
+        :returns: experiment time [ms] and system time stamp [us] the fits are centered at, device time stamp at
+                  that system time stamp [us], slope of system over experiment time, slope of device over system time
+                  and the error bound [us]
+        :rtype: list
+        """
+        if self.device_fit is None or self.system_fit is None:
+            return None
+        system_time_stamp = self.system_fit[1]
+        device_time_stamp = self.device_fit[1] + self.device_fit[2] * (system_time_stamp - self.device_fit[0])
+        return [self.system_fit[0], system_time_stamp, device_time_stamp, self.system_fit[2], self.device_fit[2],
+                self.error_bound()]
+
+
 class LogManager(object):
     """	A class to manage participant personal and behaviorial data and what is happening on the screen screen
         :param data_dir: Directory where data shall be written to
@@ -996,6 +2253,11 @@ class LogManager(object):
         received by the tracker.
         1st column: timestamp
 
+        Samples are streamed to disk continuously: every ``time`` ms the new samples are drained from the tracker and
+        appended to the (open) dump files, which are flushed afterwards. Other threads only talk to the dumper through
+        a small bounded command queue, e.g. :func:`mark` to record the end of a trial without waiting for any disk
+        access.
+
         Data produced by this class can easily be read and filtered in by :py:func jap_analyzer.py
 
         :param tracker: Eyetracker to collect data from
@@ -1006,11 +2268,18 @@ class LogManager(object):
         :type time: int
         :param verbose:
         :type verbose: boolean
+        :param dump_format: 'text' for the tab separated dump, 'binary' for fixed-width records as defined by
+                            :data:`tools.GAZE_DUMP_DTYPE` (read them with :func:`tools.read_gaze_dump`) or 'both'
+        :type dump_format: str
+        :param clock: Model of the tracker's clocks to update with every chunk of samples, its state is written to
+                      ``<prob_code>_tracker_clock``
+        :type clock: TrackerClock
         :param name: Name for thread
         :type name: str
         """
 
-        def __init__(self, tracker, path, prob_code, time=1000, verbose=False, save_event=Event(), name='TobiiDumper'):
+        def __init__(self, tracker, path, prob_code, time=1000, verbose=False, save_event=Event(), dump_format='text',
+                     clock=None, name='TobiiDumper'):
             super(LogManager.TobiiDumper, self).__init__(name=name)
 
             self.tracker = tracker
@@ -1021,20 +2290,45 @@ class LogManager(object):
             self.save_event = save_event
             # set file names
             self.last_len = 0
-            self.dump_file = os.path.join(path, prob_code + '_tobii_dump')
+            self.samples_drained = 0
+            self.gaze_buffer = None
+            if dump_format not in ['text', 'binary', 'both']:
+                raise ValueError('Unknown tobii dump format ' + str(dump_format))
+            self.text_dump_file = None
+            self.binary_dump_file = None
+            if dump_format in ['text', 'both']:
+                self.text_dump_file = os.path.join(path, prob_code + '_tobii_dump')
+            if dump_format in ['binary', 'both']:
+                self.binary_dump_file = os.path.join(path, prob_code + '_tobii_dump' + GAZE_DUMP_EXTENSION)
+            # the text dump stays the main file, if it is written at all
+            self.dump_file = self.text_dump_file or self.binary_dump_file
             self.time_dump = os.path.join(path, 'dump_time')
             self.dump_time = []
+            self.clock = clock
+            self.clock_dump = os.path.join(path, prob_code + '_tracker_clock')
+            self.clock_states = []
 
-            if os.path.isfile(self.dump_file):
-                with open(self.dump_file, 'w') as dump_file:
-                    dump_file.write('')
+            for file_name in [self.text_dump_file, self.binary_dump_file]:
+                if file_name and os.path.isfile(file_name):
+                    with open(file_name, 'w') as dump_file:
+                        dump_file.write('')
 
             self.running = False
-            self.save_trigger = Event()
-            self.save_lock = Lock()
+            self.commands = Queue.Queue(maxsize=64)
+            self.text_out = None
+            self.binary_out = None
+            self.closed = False  # the files were closed, see close
+            self.last_device_time_stamp = None
             self.daemon = True
-            self.event = Event()
-            self.trigger_timer = TriggerTimer(self.event, trigger_time=time, name='TobiiDumperTrigger')
+            self.marker_log = liblog.Logfile(filename=os.path.join(self.path, prob_code+'_tobii_markers'))
+            self.marker_log.write(['experiment_time', 'device_time_stamp', 'samples_written', 'marker'])
+            # sample-level AOI classification, see set_sample_aois
+            self.prob_code = prob_code
+            self.sample_aois = None
+            self.dispsize = None
+            self.aoi_log = None
+            self.aoi_dwell = {}
+            self.aoi_last = None
             # Stimtracker stuff
             self.stimtracker_log = liblog.Logfile(filename=os.path.join(self.path, prob_code+'_Stimtrackerlog'))
             self.stimtracker_log.write(['device_time_stamp', 'experiment_time', 'system_time_stamp', 'change_type',
@@ -1061,15 +2355,63 @@ class LogManager(object):
                                         stimtracker_data['system_time_stamp'], stimtracker_data['change_type'],
                                         stimtracker_data['value']])
 
+        def drain(self, cursor, drop_drained=True):
+            """
+            Take all samples the eyetracker delivered since the given cursor.
+
+            Only the new part of ``tracker.gaze`` is sliced, older samples are never touched again. If
+            ``drop_drained`` is set, the drained samples are removed from the tracker-side buffer, except for the most
+            recent one, which PyGaze still needs for :func:`sample`. Thus the cost of a drain only depends on the
+            number of new samples and not on the duration of the session.
+
+            :param cursor: Index in ``tracker.gaze`` of the first sample not drained yet
+            :type cursor: int
+            :param drop_drained: Remove drained samples from the tracker-side buffer
+            :type drop_drained: bool
+            :returns: the new samples and the cursor to be used for the next drain
+            :rtype: tuple (list, int)
+            """
+            gaze = self.tracker.gaze
+            if gaze is not self.gaze_buffer:
+                # the tracker (re)started recording and created a new buffer
+                self.gaze_buffer = gaze
+                cursor = 0
+            end = len(gaze)
+            samples = gaze[cursor:end]
+            if drop_drained and end > 1:
+                # appends by the gaze callback only happen behind end, so they are not affected
+                del gaze[:end - 1]
+                end = 1
+            return samples, end
+
         def get_data(self, last_len):
             """
             Get the last chunk of data from the eyetracker
             """
-            raw_data = copy.copy(self.tracker.gaze)
-            self.dump += raw_data[last_len:]
-            return len(raw_data)
+            samples, last_len = self.drain(last_len)
+            self.dump += samples
+            self.samples_drained += len(samples)
+            if self.clock:
+                self.clock.update(samples)
+                state = self.clock.state()
+                if state:
+                    self.clock_states.append('\t'.join(['%.3f' % state[0]] + ['%d' % value for value in state[1:3]] +
+                                                        ['%.9f' % value for value in state[3:5]] +
+                                                        ['%.1f' % state[5]]))
+            return last_len
 
         def save(self):
+            """
+            Append the data to the dump files of the chosen format
+            """
+            if self.text_out:
+                self.save_text()
+            if self.binary_out and self.dump:
+                gaze_samples_to_records(self.dump).tofile(self.binary_out)
+            if self.dump:
+                self.last_device_time_stamp = self.dump[-1]['device_time_stamp']
+
+        def save_text(self):
             """
             Convert the data to a string and append it to the given save file
             """
@@ -1092,78 +2434,223 @@ class LogManager(object):
                 out_list.append(str(item['right_gaze_origin_validity']))
                 out_list.append(str(0))  # item['TrigSignal']))
                 out += '\t'.join(out_list) + '\n'
-            with open(self.dump_file, 'a') as dump_file:
-                dump_file.write(out)
+            self.text_out.write(out)
+
+        def set_sample_aois(self, aois, dispsize):
+            """
+            Classify every sample against the given AOIs while dumping.
+
+            The AOIs are taken from the given dict for every chunk, so AOIs added later (e.g. by the fixation
+            detector) are considered as well. Runs of samples in the same AOI are written to the file
+            ``<prob_code>_tobii_aoi``, the total dwell time per AOI is written when the dumper stops.
+
+            :param aois: AOIs, name: libgazecon.AOI, e.g. :attr:`EventHandler.Fixation_Detector.aois`
+            :type aois: dict
+            :param dispsize: Display size in [px]
+            :type dispsize: tuple
+            """
+            self.dispsize = dispsize
+            self.sample_aois = aois
+            self.aoi_log = liblog.Logfile(filename=os.path.join(self.path, self.prob_code+'_tobii_aoi'))
+            self.aoi_log.write(['device_time_stamp_start', 'device_time_stamp_end', 'aoi'])
+
+        def classify_chunk(self):
+            """
+            Classify the current chunk of samples against the AOIs and update the AOI runs and dwell times
+            """
+            names, boxes, ellipses = aoi_table(dict(self.sample_aois))
+            time_stamps = numpy.array([sample['device_time_stamp'] for sample in self.dump], dtype=numpy.int64)
+            points = gaze_points_to_pixels([sample['left_gaze_point_on_display_area'] for sample in self.dump],
+                                           [sample['right_gaze_point_on_display_area'] for sample in self.dump],
+                                           self.dispsize)
+            labels = classify_gaze_points(points, names, boxes, ellipses)
+            # each sample lasts until the next one, so the last sample of a chunk is accounted for with the next
+            if self.aoi_last:
+                last_label = names.index(self.aoi_last[1]) if self.aoi_last[1] in names else -1
+                time_stamps = numpy.append([self.aoi_last[0]], time_stamps)
+                labels = numpy.append([last_label], labels)
+                run_start = self.aoi_last[2]
+            else:
+                run_start = time_stamps[0]
+            durations = numpy.diff(time_stamps)
+            # only loop over the runs of samples in the same AOI, not over the samples
+            changes = (numpy.flatnonzero(labels[1:] != labels[:-1]) + 1).tolist()
+            start = 0
+            for end in changes + [len(labels) - 1]:
+                name = names[labels[start]] if labels[start] >= 0 else None
+                if name is not None:
+                    self.aoi_dwell[name] = self.aoi_dwell.get(name, 0) + int(durations[start:end].sum())
+                if labels[end] != labels[start]:
+                    # the run ended, the still open run is continued with the next chunk
+                    self.aoi_log.write([run_start, time_stamps[end], name])
+                    run_start = time_stamps[end]
+                start = end
+            self.aoi_last = (time_stamps[-1], names[labels[-1]] if labels[-1] >= 0 else None, run_start)
+
+        def mark(self, marker):
+            """
+            Record a marker (e.g. the end of a trial) in the marker log.
+
+            This only puts the marker into the command queue and returns immediately. The dumper writes all samples
+            received up to this point before logging the marker together with the last device time stamp written,
+            so the marker can be aligned with the gaze dump. Markers queued while the dumper thread is not running are
+            written by :func:`stop`. The marker is dropped if the queue is full or the dumper is closed already.
+
+            :param marker: Name of the marker
+            :type marker: str
+            """
+            if self.closed:
+                print(encapsulate_text('Marker ' + str(marker) + ' dropped, the tobii dumper is closed', color='red'))
+                return
+            try:
+                self.commands.put_nowait(('marker', libtime.get_time(), marker))
+            except Queue.Full:
+                print(encapsulate_text('Marker ' + str(marker) + ' dropped, the tobii dumper is not running',
+                                       color='red'))
+
+        def write_chunk(self):
+            """
+            Drain the new samples from the eyetracker, append them to the dump files and flush them
+            """
+            time_a = libtime.get_time()
+            self.dump = []
+            try:
+                # get the data from the eyetracker
+                self.last_len = self.get_data(self.last_len)
+                # actually save the data
+                self.save()
+                if self.sample_aois is not None and self.dump:
+                    self.classify_chunk()
+                for out_file in [self.text_out, self.binary_out]:
+                    if out_file:
+                        out_file.flush()
+            except:
+                print(encapsulate_text('ERROR ERROR ERROR', color='red', background='yellow'))
+                print(sys.exc_info())
+                print(encapsulate_text('ERROR ERROR ERROR', color='red', background='yellow'))
+            time_b = libtime.get_time()
+            if self.dump:
+                self.dump_time.append(str(time_a) + '\t' + str(len(self.dump)) + '\t' + str(self.samples_drained) +
+                                      '\t' + str(time_b - time_a))
+
+        def open_files(self):
+            """
+            Open the dump files for appending
+            """
+            if self.text_dump_file and not self.text_out:
+                self.text_out = open(self.text_dump_file, 'a')
+            if self.binary_dump_file and not self.binary_out:
+                self.binary_out = open(self.binary_dump_file, 'ab')
 
         def run(self):
             self.running = True
-            # self.trigger_timer.start()
+            self.open_files()
+            stop_event = None
             while self.running:
-                # time.sleep(60)
-                # wait for the signal to save eyetracking data
-                self.save_trigger.wait()
-                # only save data when the dumper is actually still running
-                if not self.running:
-                    break
-                # self.running = False
-                # self.evnet.wait()
-                self.event.clear()
-                time_a = libtime.get_time()
-                self.dump = []
-                if self.verbose:
-                    print(encapsulate_text('STARTED SAVING ', color='red'))
+                # wake up for the next chunk of data or as soon as a command comes in
                 try:
-                    self.save_lock.acquire()
-                    # get the data from the eyetracker
-                    self.last_len = self.get_data(self.last_len)
-                    # actually save the data
-                    self.save()
-                    self.save_lock.release()
-                except:
-                    print(encapsulate_text('ERROR ERROR ERROR', color='red', background='yellow'))
-                    print(sys.exc_info())
-                    print(encapsulate_text('ERROR ERROR ERROR', color='red', background='yellow'))
-                self.save_event.set()
-                self.save_trigger.set()
-                self.save_trigger.clear()
-                time_b = libtime.get_time()
-                self.dump_time.append(str(time_a) + '\t' + str(self.last_len) + '\t' + str(time_b - time_a))
-                # with open(self.time_dump, 'w') as time_file:
-                #     time_file.write('\n'.join(self.dump_time))
-                if self.verbose:
-                    print(encapsulate_text('FINISHED SAVING', color='green'))
-
-        def stop(self, stop_event=Event()):
-            self.running = False
-            self.dump = []
-            self.tracker.eyetracker.unsubscribe_from(tr.EYETRACKER_EXTERNAL_SIGNAL, self.stimtracker_callback)
-            # save the data one last time before actually stopping
+                    command = self.commands.get(timeout=self.time / 1000.)
+                except Queue.Empty:
+                    command = None
+                self.write_chunk()
+                if command is None:
+                    continue
+                if command[0] == 'marker':
+                    self.write_marker(command)
+                elif command[0] == 'stop':
+                    self.running = False
+                    stop_event = command[1]
+            self.close()
+            if stop_event:
+                stop_event.set()
+
+        def write_marker(self, command):
+            """
+            Write a marker command to the marker log, with the last device time stamp written so far
+            """
+            self.marker_log.write([command[1], self.last_device_time_stamp, self.samples_drained, command[2]])
+            self.save_event.set()
             if self.verbose:
-                print(encapsulate_text('STARTED SAVING ', color='blue'))
+                print(encapsulate_text('MARKER ' + str(command[2]), color='green'))
+
+        def close(self):
+            """
+            Close all files written by the dumper
+            """
+            if self.closed:
+                return
+            self.closed = True
+            for out_file in [self.text_out, self.binary_out]:
+                if out_file:
+                    out_file.close()
+            self.text_out = None
+            self.binary_out = None
+            self.marker_log.close()
+            if self.aoi_log:
+                if self.aoi_last:
+                    self.aoi_log.write([self.aoi_last[2], self.aoi_last[0], self.aoi_last[1]])
+                self.aoi_log.close()
+                with open(os.path.join(self.path, self.prob_code + '_tobii_aoi_dwell'), 'w') as dwell_file:
+                    dwell_file.write('\n'.join([name + '\t' + str(dwell) for name, dwell in
+                                                sorted(self.aoi_dwell.items())]))
             self.stimtracker_log.close()
-            self.save_lock.acquire()
-            self.last_len = self.get_data(self.last_len)
-            self.save()
-            self.save_lock.release()
+            # write how long each save took: start time, samples saved, samples saved in total, duration
+            with open(self.time_dump, 'w') as time_file:
+                time_file.write('\n'.join(self.dump_time))
+            if self.clock:
+                # state of the clock model after each chunk, see TrackerClock.state
+                with open(self.clock_dump, 'w') as clock_file:
+                    clock_file.write('\t'.join(['experiment_time', 'system_time_stamp', 'device_time_stamp',
+                                                'system_per_experiment', 'device_per_system', 'error_bound']) + '\n')
+                    clock_file.write('\n'.join(self.clock_states))
             if self.verbose:
                 print(encapsulate_text('FINISHED SAVING', color='yellow'))
-            stop_event.set()
+
+        def stop(self, stop_event=Event()):
+            self.tracker.eyetracker.unsubscribe_from(tr.EYETRACKER_EXTERNAL_SIGNAL, self.stimtracker_callback)
+            if self.is_alive():
+                # the last samples are written by the dumper thread itself before it sets the stop event
+                self.commands.put(('stop', stop_event))
+            else:
+                if not self.closed:
+                    # the dumper thread is not running (anymore), do the final save and write the queued markers here
+                    self.open_files()
+                    self.write_chunk()
+                    while True:
+                        try:
+                            command = self.commands.get_nowait()
+                        except Queue.Empty:
+                            break
+                        if command[0] == 'marker':
+                            self.write_marker(command)
+                        elif command[0] == 'stop':
+                            command[1].set()
+                    self.close()
+                stop_event.set()
 
     class DataRecorder(Thread):
         """ A class to record the course of the paradigm (what is shown on the screen)
 
+        Messages are written in batches: the recorder takes all messages queued since its last write, writes them at
+        once and flushes the log file.
+
         :param log_dir: Directory where data shall be stored
         :param code: Some sort of subject ID
         :type code: str
+        :param log_event: Queue the messages to log are put into
+        :type log_event: LogQueue
+        :param clock: Model of the tracker's clocks to get the device time stamp of each message from
+        :type clock: TrackerClock
         :param name: Name for Thread
         :type name: str
 
         """
 
-        def __init__(self, log_dir, code, log_event, tracker=None, header=None, name='DataRecorder'):
+        def __init__(self, log_dir, code, log_event, tracker=None, header=None, clock=None, name='DataRecorder'):
             super(LogManager.DataRecorder, self).__init__(name=name)
             self.do_write = log_event
             self.tracker = tracker
+            self.clock = clock
             self.log_name = os.path.join(log_dir, code + '_' + name)
             # create Pygaze logfile
             self.log = liblog.Logfile(filename=self.log_name)
@@ -1177,32 +2664,41 @@ class LogManager(object):
             self.is_running = True
             while self.is_running:
                 # wait till some other thread wants to log anything
-                message = self.do_write.wait()
-                self.do_write.clear()
-                exp_time = libtime.get_time()
-                # if there is an eyetracker, get the current time from the last data package
-                if self.tracker:
-                    try:
-                        tracker_time = self.tracker.gaze[-1]['device_time_stamp']
-                    except IndexError:
-                        tracker_time = 0
-                else:
-                    tracker_time = 0.
-                # write data to log file
+                self.write(self.do_write.drain())
+            # write whatever was logged until stop was called
+            self.write(self.do_write.drain(0))
+
+        def write(self, messages):
+            """
+            Write a batch of messages to the log file and flush it
+            """
+            if not messages:
+                return
+            lines = []
+            for exp_time, message in messages:
+                # if there is an eyetracker, convert the time the message was logged at to its clock; leave the field
+                # empty while there is no clock or before its first chunk, 0 would look like a real device time
+                tracker_time = self.clock.device_time(exp_time) if self.clock else None
+                if tracker_time is None:
+                    tracker_time = ''
                 if type(message) is list:
-                    self.log.write([exp_time, tracker_time] + message)
+                    values = [exp_time, tracker_time] + message
                 else:
-                    self.log.write([exp_time, tracker_time, message])
+                    values = [exp_time, tracker_time, message]
+                lines.append('\t'.join([str(value) for value in values]) + '\n')
+            self.log.logfile.write(''.join(lines))
+            self.log.logfile.flush()
 
         def stop(self):
             self.is_running = False
             self.do_write.set('finished')
-            libtime.pause(500)
+            if self.is_alive():
+                self.join(1)
             self.log.close()
 
     def __init__(self, data_dir, block_name=None, tracker=None, participant_data=None, age_group=None, verbose=False,
                  mucap_dir=None, mucap_marker=None, mucap_wmv=None, fixation_data=None, log_dict={}, screenshots=False,
-                 tobii_save_event=None):
+                 tobii_save_event=None, tobii_dump_format='text'):
         # ?
         self.check_data = 'n'
         # log dir
@@ -1285,10 +2781,13 @@ class LogManager(object):
 
         # create all needed logger given in the log_dict
         self.logger_dict = {}
+        # Model of the tracker's clocks, kept up to date by the tobii dumper and used by the data recorders
+        self.clock = TrackerClock(tracker) if tracker else None
         for name, parameters in log_dict.items():
             if tracker:
                 self.logger_dict[name] = self.DataRecorder(self.data_dir, self.data['code'], parameters[0],
-                                                           tracker, header=parameters[1], name=name)
+                                                           tracker, header=parameters[1], clock=self.clock,
+                                                           name=name)
             else:
                 self.logger_dict[name] = self.DataRecorder(self.data_dir, self.data['code'], parameters[0],
                                                            tracker=None, header=parameters[1], name=name)
@@ -1300,9 +2799,11 @@ class LogManager(object):
         if tracker:
             if tobii_save_event:
                 self.tobii_dumper = self.TobiiDumper(tracker, self.data_dir, self.data['code'],
-                                                     verbose=verbose, save_event=tobii_save_event)
+                                                     verbose=verbose, save_event=tobii_save_event,
+                                                     dump_format=tobii_dump_format, clock=self.clock)
             else:
-                self.tobii_dumper = self.TobiiDumper(tracker, self.data_dir, self.data['code'], verbose=verbose)
+                self.tobii_dumper = self.TobiiDumper(tracker, self.data_dir, self.data['code'], verbose=verbose,
+                                                     dump_format=tobii_dump_format, clock=self.clock)
         else:
             self.tobii_dumper = None
 
@@ -0,0 +1,88 @@
+import os
+import json
+import random
+import struct
+import hashlib
+import numpy
+from threading import Lock
+
+
+class SessionRNG(object):
+    """ Random number streams of an experimental session, one independent stream for each component.
+
+    The seed of every stream is derived from the session seed and the component's name, so the draws of a component
+    do not depend on how often other components drew numbers before. Replaying a session with the same seed (e.g. in
+    the simulated tracker mode) reproduces all agent decisions, timings, objects and sequences. Each component draws
+    from its own generator instead of the global one shared by all threads.
+
+    :param seed: seed of the session, a random seed is chosen if None
+    :type seed: int
+    """
+
+    def __init__(self, seed=None):
+        self.lock = Lock()
+        self.seed_session(seed)
+
+    def seed_session(self, seed=None):
+        """ (Re)seed the session, streams already handed out keep drawing from their old seed
+
+        :param seed: seed of the session, a random seed is chosen if None
+        :type seed: int
+        """
+        if seed is None:
+            seed = struct.unpack('<I', os.urandom(4))[0]
+        with self.lock:
+            self.seed = int(seed)
+            self.numpy_streams = {}
+            self.stdlib_streams = {}
+
+    def component_seed(self, name):
+        """ Seed of a component's stream, derived from the session seed
+
+        :param name: name of the component
+        :type name: str
+        :return: four 32 bit words
+        :rtype: list
+        """
+        digest = hashlib.sha256(('%d:%s' % (self.seed, name)).encode('utf-8')).digest()
+        return list(struct.unpack('<4I', digest[:16]))
+
+    def numpy(self, name):
+        """ Get the numpy stream of a component
+
+        :param name: name of the component, e.g. the agent's class name
+        :type name: str
+        :rtype: :class:`numpy.random.RandomState`
+        """
+        with self.lock:
+            if name not in self.numpy_streams:
+                self.numpy_streams[name] = numpy.random.RandomState(self.component_seed(name))
+            return self.numpy_streams[name]
+
+    def stdlib(self, name):
+        """ Get the stream of a component using python's random module (shuffle, sample, choice)
+
+        :param name: name of the component, e.g. 'sequence'
+        :type name: str
+        :rtype: :class:`random.Random`
+        """
+        with self.lock:
+            if name not in self.stdlib_streams:
+                self.stdlib_streams[name] = random.Random(self.component_seed(name)[0])
+            return self.stdlib_streams[name]
+
+    def save(self, file_name):
+        """ Save the session seed and the seeds of all streams used so far
+
+        :param file_name: file name without extension
+        :type file_name: str
+        """
+        with self.lock:
+            components = sorted(set(self.numpy_streams) | set(self.stdlib_streams))
+            seeds = {'session': self.seed,
+                     'components': dict((name, self.component_seed(name)) for name in components)}
+        with open(file_name + '.json', 'w') as seed_file:
+            json.dump(seeds, seed_file, indent=4, sort_keys=True)
+
+
+session_rng = SessionRNG()  # streams of the running session, seeded by run_experiment
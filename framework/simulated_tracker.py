@@ -0,0 +1,376 @@
+import math
+import time
+import timeit
+import numpy
+import tobii_research as tr
+from threading import Thread, Event, Condition, Lock
+from pygaze import libtime
+from .pygaze_framework import EventHandler
+from .tools import is_binary_dump, read_gaze_dump, read_gaze_points
+
+NAN_2D = (float('nan'),) * 2
+NAN_3D = (float('nan'),) * 3
+
+
+def make_gaze_sample(device_time_stamp, system_time_stamp, left, right, pupil_diameter=3.):
+    """ Build a gaze data dictionary as delivered by tobii_research (as_dictionary=True)
+
+    :param device_time_stamp: device time stamp in [us]
+    :type device_time_stamp: int
+    :param system_time_stamp: system time stamp in [us]
+    :type system_time_stamp: int
+    :param left: point of the left eye on the display area (normalized), None if not valid
+    :type left: tuple
+    :param right: point of the right eye on the display area (normalized), None if not valid
+    :type right: tuple
+    :param pupil_diameter: pupil diameter in [mm]
+    :type pupil_diameter: float
+    """
+    sample = {'device_time_stamp': device_time_stamp, 'system_time_stamp': system_time_stamp}
+    for eye, point in [('left', left), ('right', right)]:
+        valid = int(point is not None)
+        sample[eye + '_gaze_point_on_display_area'] = tuple(point) if valid else NAN_2D
+        sample[eye + '_gaze_point_validity'] = valid
+        sample[eye + '_gaze_point_in_user_coordinate_system'] = (0., 0., 0.) if valid else NAN_3D
+        sample[eye + '_gaze_origin_in_user_coordinate_system'] = (0., 0., 600.) if valid else NAN_3D
+        sample[eye + '_gaze_origin_in_trackbox_coordinate_system'] = (.5, .5, .5) if valid else NAN_3D
+        sample[eye + '_gaze_origin_validity'] = valid
+        sample[eye + '_pupil_diameter'] = pupil_diameter if valid else float('nan')
+        sample[eye + '_pupil_validity'] = valid
+    return sample
+
+
+def scripted_gaze(script, rate=600, noise=.002, random_state=None):
+    """ Generate gaze following a script of fixations
+
+    Gaze jumps from fixation to fixation with a short linear saccade (30 ms). Every sample gets some Gaussian noise.
+
+    :param script: fixations as (position, duration), position normalized to the display area, None for a blink (or
+                   lost eyes)
+    :type script: iterable of tuples ((float, float), float)
+    :param rate: sampling rate in [Hz]
+    :type rate: float
+    :param noise: standard deviation of the noise (normalized)
+    :type noise: float
+    :param random_state: random number generator for the noise
+    :type random_state: :class:`numpy.random.RandomState`
+    :returns: generator of device time stamps [us] and the points of the left and right eye
+    """
+    if random_state is None:
+        random_state = numpy.random.RandomState()
+    period = 1e6 / rate
+    saccade_duration = 30e3
+    n = 0
+    last_pos = None
+    for pos, duration in script:
+        start = n * period
+        end = start + duration * 1000.
+        while n * period < end:
+            t = n * period
+            if pos is None:
+                point = None
+            elif last_pos is not None and t - start < saccade_duration:
+                progress = (t - start) / saccade_duration
+                point = (last_pos[0] + (pos[0] - last_pos[0]) * progress,
+                         last_pos[1] + (pos[1] - last_pos[1]) * progress)
+            else:
+                point = pos
+            if point is None:
+                yield int(t), None, None
+            else:
+                left, right = random_state.normal(point, noise, (2, 2))
+                yield int(t), tuple(left), tuple(right)
+            n += 1
+        if pos is not None:
+            last_pos = pos
+
+
+def stochastic_script(targets=None, fixation_duration=250., blink_probability=.05, random_state=None):
+    """ Generate an endless script of random fixations for :func:`scripted_gaze`
+
+    :param targets: normalized positions to fixate, anywhere on the display area if None
+    :type targets: list
+    :param fixation_duration: mean fixation duration in [ms] (gamma distributed)
+    :type fixation_duration: float
+    :param blink_probability: probability of a blink (150 ms) after a fixation
+    :type blink_probability: float
+    :param random_state: random number generator
+    :type random_state: :class:`numpy.random.RandomState`
+    """
+    if random_state is None:
+        random_state = numpy.random.RandomState()
+    while True:
+        if targets:
+            pos = targets[random_state.randint(len(targets))]
+        else:
+            pos = tuple(random_state.uniform(.05, .95, 2))
+        yield pos, random_state.gamma(4., fixation_duration / 4.)
+        if random_state.uniform() < blink_probability:
+            yield None, 150.
+
+
+def replayed_gaze(tobii_dump):
+    """ Read the gaze of a recorded tobii dump (text or binary)
+
+    :param tobii_dump: path to the dump
+    :type tobii_dump: str
+    :returns: generator of device time stamps [us] and the points of the left and right eye
+    """
+    time_stamps, left, right = read_gaze_points(tobii_dump)
+    valid_left = ~numpy.isnan(left).any(axis=1)
+    valid_right = ~numpy.isnan(right).any(axis=1)
+    if is_binary_dump(tobii_dump):
+        dump = read_gaze_dump(tobii_dump)
+        valid_left &= dump['left_gaze_origin_validity'] > 0
+        valid_right &= dump['right_gaze_origin_validity'] > 0
+    for i in range(len(time_stamps)):
+        yield (int(time_stamps[i]), tuple(left[i]) if valid_left[i] else None,
+               tuple(right[i]) if valid_right[i] else None)
+
+
+class SimulatedEyeTracker(object):
+    """ Stand-in for a :class:`tobii_research.EyeTracker`, hands the simulated data to its subscribers
+    """
+
+    def __init__(self):
+        self.subscriptions = {}
+
+    def subscribe_to(self, stream, callback, as_dictionary=True):
+        self.subscriptions.setdefault(stream, []).append(callback)
+
+    def unsubscribe_from(self, stream, callback=None):
+        if callback is None:
+            self.subscriptions[stream] = []
+        elif callback in self.subscriptions.get(stream, []):
+            self.subscriptions[stream].remove(callback)
+
+    def publish(self, stream, data):
+        for callback in list(self.subscriptions.get(stream, [])):
+            callback(data)
+
+
+class SimulatedTracker(object):
+    """ A simulated Tobii eyetracker with the interface of PyGaze's eyetracker the framework uses.
+
+    Gaze is either generated (see :func:`scripted_gaze`, :func:`stochastic_script`) or replayed from a tobii dump of
+    an earlier session. Samples are delivered in real time (or ``speed`` times faster) like the tobii_research gaze
+    callback does: they are appended to :attr:`gaze` while recording and handed to all subscribers of
+    :attr:`eyetracker`, so the fixation detectors, the :class:`LogManager.TobiiDumper` and the agents run as with a
+    real tracker.
+
+    :param dispsize: Display size in [px]
+    :type dispsize: tuple
+    :param rate: sampling rate of generated gaze in [Hz] (up to 1200)
+    :type rate: float
+    :param replay: tobii dump to replay instead of generating gaze
+    :type replay: str
+    :param script: fixations as (position in [px], duration in [ms]) to generate gaze from, random fixations if None
+    :type script: list
+    :param speed: factor to speed up the delivery of samples, 0 to deliver them as fast as possible
+    :type speed: float
+    :param seed: seed for generating gaze
+    :type seed: int
+    :param vel_thresh: Saccade velocity threshold in [deg/s] of the fixation detection behind
+                       :meth:`wait_for_fixation_start`, e.g. ``SACCVELTHRESH``. The tracker's threshold if None
+    :type vel_thresh: float
+    :param acc_thresh: Saccade acceleration threshold in [deg/s**2] of that fixation detection, e.g. ``SACCACCTHRESH``.
+                       The tracker's threshold if None
+    :type acc_thresh: float
+    """
+
+    class GazeFeeder(Thread):
+        """ Thread delivering the samples of a simulated tracker on time
+        """
+
+        def __init__(self, tracker, source, speed=1., name='GazeFeeder'):
+            super(SimulatedTracker.GazeFeeder, self).__init__(name=name)
+            self.daemon = True
+            self.tracker = tracker
+            self.source = source
+            self.speed = speed
+            self.finished = Event()
+
+        def run(self):
+            wall_start = timeit.default_timer()
+            system_start = self.tracker.get_system_time_stamp()
+            first_time_stamp = None
+            for device_time_stamp, left, right in self.source:
+                if self.finished.is_set():
+                    break
+                if first_time_stamp is None:
+                    first_time_stamp = device_time_stamp
+                if self.speed:
+                    # deliver samples in small bursts like the tobii callback does
+                    delay = wall_start + (device_time_stamp - first_time_stamp) / 1e6 / self.speed - \
+                        timeit.default_timer()
+                    if delay > .002:
+                        time.sleep(delay)
+                    # like the SDK, the system time stamp is the time the sample was taken and not when it arrived
+                    system_time_stamp = system_start + int((device_time_stamp - first_time_stamp) / self.speed)
+                else:
+                    system_time_stamp = self.tracker.get_system_time_stamp()
+                self.tracker.deliver(make_gaze_sample(device_time_stamp, system_time_stamp, left, right))
+
+        def stop(self):
+            self.finished.set()
+
+    def __init__(self, dispsize, rate=600, replay=None, script=None, speed=1., seed=None, vel_thresh=None,
+                 acc_thresh=None):
+        self.dispsize = dispsize
+        self.eyetracker = SimulatedEyeTracker()
+        self.gaze = []
+        self.recording = False
+        self.replay = replay
+        self.speed = speed
+        self.random_state = numpy.random.RandomState(seed)
+        if replay:
+            self.source = replayed_gaze(replay)
+        else:
+            if script:
+                script = [(None if pos is None else (pos[0] / float(dispsize[0]), pos[1] / float(dispsize[1])),
+                           duration) for pos, duration in script]
+            else:
+                script = stochastic_script(random_state=self.random_state)
+            self.source = scripted_gaze(script, rate, random_state=self.random_state)
+        self.feeder = None
+        self.last_sample = None
+        self.new_sample = Condition()
+
+        # parameters as set by PyGaze's eyetracker
+        self.samplerate = rate
+        self.sampletime = 1000. / rate
+        self.screendist = 57.
+        self.pixpercm = 36.
+        self.pxaccuracy = [(0., 0.), (0., 0.)]
+        self.fixtresh = 1.5
+        self.pxfixtresh = self.fixtresh * self.pixpercm * self.screendist * math.tan(math.radians(1))
+        self.spdtresh = 35
+        self.pxspdtresh = self.spdtresh * self.pixpercm * self.screendist * math.tan(math.radians(1)) / 1000.
+        self.accthresh = 9500
+        self.pxacctresh = self.accthresh * self.pixpercm * self.screendist * math.tan(math.radians(1)) / 1000.
+        self.fixtimetresh = 100
+        self.blinkthresh = 150
+
+        # fixation detection behind wait_for_fixation*, only started when it is used (see get_fixation_detector)
+        self.vel_thresh = vel_thresh
+        self.acc_thresh = acc_thresh
+        self.fixation_detector = None
+        self.fixation_detector_lock = Lock()
+
+    def get_fixation_detector(self):
+        """ Get the fixation detection of the tracker, it is started on first use
+        """
+        with self.fixation_detector_lock:
+            if self.fixation_detector is None:
+                self.fixation_detector = EventHandler.StreamingFixationDetector(self, self.dispsize, self.vel_thresh,
+                                                                                self.acc_thresh)
+                self.fixation_detector.start()
+            return self.fixation_detector
+
+    def deliver(self, sample):
+        """ Hand a new sample over to the tracker's buffer and all subscribers
+        """
+        if self.recording:
+            self.gaze.append(sample)
+        self.eyetracker.publish(tr.EYETRACKER_GAZE_DATA, sample)
+        with self.new_sample:
+            self.last_sample = sample
+            self.new_sample.notify_all()
+
+    def send_external_signal(self, value, change_type=0):
+        """ Simulate an external signal (e.g. of the StimTracker)
+
+        :param value: value of the signal
+        :type value: int
+        """
+        time_stamp = self.get_system_time_stamp()
+        self.eyetracker.publish(tr.EYETRACKER_EXTERNAL_SIGNAL, {'device_time_stamp': time_stamp,
+                                                                'system_time_stamp': time_stamp,
+                                                                'change_type': change_type, 'value': value})
+
+    def get_system_time_stamp(self):
+        """ System time stamp in [us], stands in for tobii_research.get_system_time_stamp
+        """
+        return int(time.time() * 1e6)
+
+    def calibrate(self):
+        return True
+
+    def drift_correction(self, pos=None, fix_triggered=False):
+        return True
+
+    def start_recording(self):
+        self.gaze = []  # PyGaze starts a new buffer for each recording
+        self.recording = True
+        if self.feeder is None:
+            self.feeder = self.GazeFeeder(self, self.source, self.speed)
+            self.feeder.start()
+
+    def stop_recording(self):
+        self.recording = False
+
+    def close(self):
+        self.recording = False
+        if self.fixation_detector is not None:
+            self.fixation_detector.stop()
+        if self.feeder is not None:
+            self.feeder.stop()
+
+    def log(self, msg):
+        pass
+
+    def status_msg(self, msg):
+        pass
+
+    def sample(self):
+        """ Current gaze position in [px], (-1, -1) if the eyes are lost
+        """
+        sample = self.last_sample
+        if sample is None:
+            return -1, -1
+        points = [sample[eye + '_gaze_point_on_display_area'] for eye in ['left', 'right']
+                  if sample[eye + '_gaze_point_validity']]
+        if not points:
+            return -1, -1
+        return (int(sum([point[0] for point in points]) / len(points) * self.dispsize[0]),
+                int(sum([point[1] for point in points]) / len(points) * self.dispsize[1]))
+
+    def pupil_size(self):
+        sample = self.last_sample
+        if sample is None or not sample['left_pupil_validity']:
+            return -1
+        return sample['left_pupil_diameter']
+
+    def wait_for_fixation_start(self):
+        return self.get_fixation_detector().wait_for_fixation_start()
+
+    def wait_for_fixation(self):
+        return self.get_fixation_detector().wait_for_fixation()
+
+    def wait_for_blink_start(self):
+        """ Block until the eyes are lost for at least :attr:`blinkthresh`
+
+        :returns: time of the blink start in [ms] (experiment time)
+        """
+        lost_since = None
+        with self.new_sample:
+            while True:
+                self.new_sample.wait(1.)
+                if self.last_sample is None:
+                    continue
+                if self.sample() != (-1, -1):
+                    lost_since = None
+                elif lost_since is None:
+                    lost_since = self.last_sample['device_time_stamp']
+                elif (self.last_sample['device_time_stamp'] - lost_since) / 1000. >= self.blinkthresh:
+                    return libtime.get_time()
+
+    def wait_for_blink_end(self):
+        """ Block until the eyes are found again
+
+        :returns: time of the blink end in [ms] (experiment time)
+        """
+        with self.new_sample:
+            while self.last_sample is None or self.sample() == (-1, -1):
+                self.new_sample.wait(1.)
+            return libtime.get_time()
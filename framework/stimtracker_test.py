@@ -1,11 +1,19 @@
 import os
 import csv
 import argparse
+import numpy
 from framework.stuff import encapsulate_text
+from framework.tools import is_binary_dump, read_gaze_dump
 
 
 def count_stimtracker_signal_switches(dump_file):
 
+    if is_binary_dump(dump_file):
+        trigger = read_gaze_dump(dump_file)['trigger']
+        if len(trigger) == 0:
+            return -1, None
+        return int(numpy.count_nonzero(trigger[1:] != trigger[:-1])), str(trigger[-1])
+
     stim_signal = None
     stim_signal_switch = -1
 
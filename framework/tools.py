@@ -1,9 +1,32 @@
 import csv
-from random import shuffle
+import os
+import random
 import datetime
 import time
 import sys
 from itertools import chain, repeat
+import numpy
+
+# Record layout of binary tobii dumps, one fixed-width record per gaze sample. Points are stored as float subarrays,
+# all fields in little endian byte order to keep the files portable.
+GAZE_DUMP_EXTENSION = '.bin'
+GAZE_DUMP_DTYPE = numpy.dtype([
+    ('device_time_stamp', '<i8'),
+    ('system_time_stamp', '<i8'),
+    ('left_gaze_point_on_display_area', '<f4', (2,)),
+    ('right_gaze_point_on_display_area', '<f4', (2,)),
+    ('left_gaze_point_in_user_coordinate_system', '<f4', (3,)),
+    ('right_gaze_point_in_user_coordinate_system', '<f4', (3,)),
+    ('left_gaze_origin_in_user_coordinate_system', '<f4', (3,)),
+    ('right_gaze_origin_in_user_coordinate_system', '<f4', (3,)),
+    ('left_gaze_origin_in_trackbox_coordinate_system', '<f4', (3,)),
+    ('right_gaze_origin_in_trackbox_coordinate_system', '<f4', (3,)),
+    ('left_pupil_diameter', '<f4'),
+    ('right_pupil_diameter', '<f4'),
+    ('left_gaze_origin_validity', '<i1'),
+    ('right_gaze_origin_validity', '<i1'),
+    ('trigger', '<i2'),
+])
 
 
 def read_csv_file(csv_path, delimiter='\t'):
@@ -15,7 +38,59 @@ def read_csv_file(csv_path, delimiter='\t'):
     return csv_list
 
 
+def gaze_samples_to_records(samples, trigger=0):
+    """Convert gaze samples as delivered by tobii_research into records of :data:`GAZE_DUMP_DTYPE`.
+
+    :param samples: gaze data dictionaries
+    :type samples: list
+    :param trigger: value of the trigger column
+    :type trigger: int
+    :returns: structured array with one record per sample
+    """
+    return numpy.array([(sample['device_time_stamp'], sample['system_time_stamp'],
+                         sample['left_gaze_point_on_display_area'], sample['right_gaze_point_on_display_area'],
+                         sample['left_gaze_point_in_user_coordinate_system'],
+                         sample['right_gaze_point_in_user_coordinate_system'],
+                         sample['left_gaze_origin_in_user_coordinate_system'],
+                         sample['right_gaze_origin_in_user_coordinate_system'],
+                         sample['left_gaze_origin_in_trackbox_coordinate_system'],
+                         sample['right_gaze_origin_in_trackbox_coordinate_system'],
+                         sample['left_pupil_diameter'], sample['right_pupil_diameter'],
+                         sample['left_gaze_origin_validity'], sample['right_gaze_origin_validity'], trigger)
+                        for sample in samples], dtype=GAZE_DUMP_DTYPE)
+
+
+def read_gaze_dump(dump_file):
+    """Memory-map a binary tobii dump.
+
+    Nothing is parsed or copied, columns are read from disk on access, e.g.
+    ``read_gaze_dump(path)['device_time_stamp']``.
+
+    :param dump_file: path to a dump written with :data:`GAZE_DUMP_DTYPE` records
+    :type dump_file: str
+    :returns: read only structured array, empty if the dump does not exist (yet) or holds no complete record
+    """
+    if not os.path.isfile(dump_file) or os.path.getsize(dump_file) < GAZE_DUMP_DTYPE.itemsize:
+        # numpy.memmap cannot map an empty file
+        return numpy.empty(0, dtype=GAZE_DUMP_DTYPE)
+    return numpy.memmap(dump_file, dtype=GAZE_DUMP_DTYPE, mode='r')
+
+
+def is_binary_dump(dump_file):
+    return dump_file.endswith(GAZE_DUMP_EXTENSION)
+
+
 def read_stim_time(tobii_dump):
+    if is_binary_dump(tobii_dump):
+        dump = read_gaze_dump(tobii_dump)
+        if len(dump) == 0:
+            raise ValueError('No stimtracker signal!')
+        trigger = dump['trigger']
+        switches = numpy.concatenate(([0], numpy.flatnonzero(trigger[1:] != trigger[:-1]) + 1))
+        if len(switches) <= 1:
+            raise ValueError('No stimtracker signal!')
+        return dump['device_time_stamp'][switches].tolist()
+
     tobii_list = read_csv_file(tobii_dump)
     signal_old = -1
     stim_time = []
@@ -30,6 +105,152 @@ def read_stim_time(tobii_dump):
     return stim_time
 
 
+def aoi_table(aois):
+    """Put AOIs into arrays for :func:`classify_gaze_points`.
+
+    :param aois: AOIs as used by the fixation detector, name: libgazecon.AOI
+    :type aois: dict
+    :returns: names of the AOIs, their bounding boxes (x, y, width, height) in [px] and whether they are ellipses
+    :rtype: tuple (list, numpy.ndarray, numpy.ndarray)
+    """
+    names = sorted(aois)
+    boxes = numpy.array([list(aois[name].pos) + list(aois[name].size) for name in names],
+                        dtype=float).reshape(-1, 4)
+    ellipses = numpy.array([getattr(aois[name], 'aoitype', 'rectangle') in ['ellipse', 'circle'] for name in names],
+                           dtype=bool)
+    return names, boxes, ellipses
+
+
+def gaze_points_to_pixels(left, right, dispsize):
+    """Average the gaze points of both eyes on the display area and convert them to pixels.
+
+    Invalid points (nan) of one eye are replaced by the other eye, samples without any valid eye stay nan.
+
+    :param left: points of the left eye in display area coordinates, shape (n, 2)
+    :param right: points of the right eye in display area coordinates, shape (n, 2)
+    :param dispsize: display size in [px]
+    :type dispsize: tuple
+    :returns: gaze points in [px], shape (n, 2)
+    """
+    left = numpy.asarray(left, dtype=float).reshape(-1, 2)
+    right = numpy.asarray(right, dtype=float).reshape(-1, 2)
+    left = numpy.where(numpy.isnan(left), right, left)
+    right = numpy.where(numpy.isnan(right), left, right)
+    return (left + right) / 2. * numpy.asarray(dispsize, dtype=float)
+
+
+def classify_gaze_points(points, names, boxes, ellipses):
+    """Classify all gaze points against all AOIs in one pass.
+
+    If AOIs overlap, a point is labeled with the first one in the table.
+
+    :param points: gaze points in [px], shape (n, 2)
+    :param names: AOI names as returned by :func:`aoi_table`
+    :type names: list
+    :param boxes: AOI bounding boxes as returned by :func:`aoi_table`
+    :param ellipses: AOI shapes as returned by :func:`aoi_table`
+    :returns: index of the AOI in ``names`` for each point, -1 if a point is in no AOI
+    :rtype: numpy.ndarray
+    """
+    points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+    labels = numpy.full(len(points), -1, dtype=int)
+    if len(names) == 0 or len(points) == 0:
+        return labels
+    x = points[:, 0:1]
+    y = points[:, 1:2]
+    half_w = boxes[:, 2] / 2.
+    half_h = boxes[:, 3] / 2.
+    dx = (x - (boxes[:, 0] + half_w)) / half_w
+    dy = (y - (boxes[:, 1] + half_h)) / half_h
+    # nan points compare False and thus end up in no AOI
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        inside = numpy.where(ellipses, dx ** 2 + dy ** 2 <= 1, (numpy.abs(dx) <= 1) & (numpy.abs(dy) <= 1))
+    hit = inside.any(axis=1)
+    labels[hit] = inside[hit].argmax(axis=1)
+    return labels
+
+
+def aoi_dwell_times(labels, time_stamps, n_aois):
+    """Sum up the time spent in each AOI.
+
+    Each sample counts until the next sample, the last one for the median sample interval.
+
+    :param labels: AOI label per sample as returned by :func:`classify_gaze_points`
+    :param time_stamps: time stamp per sample, e.g. device time stamps in [us]
+    :param n_aois: number of AOIs
+    :type n_aois: int
+    :returns: dwell time per AOI in units of ``time_stamps``
+    :rtype: numpy.ndarray
+    """
+    labels = numpy.asarray(labels)
+    time_stamps = numpy.asarray(time_stamps, dtype=float)
+    if len(labels) == 0:
+        return numpy.zeros(n_aois)
+    durations = numpy.diff(time_stamps)
+    durations = numpy.append(durations, numpy.median(durations) if len(durations) else 0)
+    in_aoi = labels >= 0
+    return numpy.bincount(labels[in_aoi], weights=durations[in_aoi], minlength=n_aois)[:n_aois]
+
+
+def read_gaze_points(tobii_dump):
+    """Read time stamps and gaze points on the display area from a text or binary tobii dump.
+
+    :param tobii_dump: path to the dump
+    :type tobii_dump: str
+    :returns: device time stamps and the points of the left and right eye
+    :rtype: tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    if is_binary_dump(tobii_dump):
+        dump = read_gaze_dump(tobii_dump)
+        return (dump['device_time_stamp'], dump['left_gaze_point_on_display_area'],
+                dump['right_gaze_point_on_display_area'])
+
+    time_stamps, left, right = [], [], []
+    for row in read_csv_file(tobii_dump):
+        time_stamps.append(int(row[0]))
+        left.append([float(value) for value in row[1].strip('()').split(',')])
+        right.append([float(value) for value in row[2].strip('()').split(',')])
+    return (numpy.array(time_stamps, dtype=numpy.int64), numpy.array(left).reshape(-1, 2),
+            numpy.array(right).reshape(-1, 2))
+
+
+def classify_gaze_dump(tobii_dump, aois, dispsize):
+    """Classify all samples of a tobii dump against the given AOIs and compute the dwell time per AOI.
+
+    :param tobii_dump: path to a text or binary dump
+    :type tobii_dump: str
+    :param aois: AOIs, name: libgazecon.AOI
+    :type aois: dict
+    :param dispsize: display size in [px]
+    :type dispsize: tuple
+    :returns: device time stamps, AOI label per sample, AOI names and dwell time per AOI in [us]
+    :rtype: tuple
+    """
+    time_stamps, left, right = read_gaze_points(tobii_dump)
+    names, boxes, ellipses = aoi_table(aois)
+    labels = classify_gaze_points(gaze_points_to_pixels(left, right, dispsize), names, boxes, ellipses)
+    return time_stamps, labels, names, aoi_dwell_times(labels, time_stamps, len(names))
+
+
+def load_study_parameters(exp_type='basic'):
+    """ Get all parameters of a study as seen by run_experiment.py: the constants and lab parameters, each overwritten
+    by their local versions, overwritten by the study specific ones. Needs to be called from the root dir of this repo.
+
+    :param exp_type: experiment type, i.e. name of the study file in studies
+    :type exp_type: str
+    :return: parameter name: value
+    :rtype: dict
+    """
+    parameters = {}
+    for module in ['constants', 'constants_local', 'experiment_parameters', 'experiment_parameters_local']:
+        try:
+            parameters.update(vars(__import__(module)))
+        except ImportError:
+            pass
+    parameters.update(vars(__import__('studies.' + exp_type, fromlist=['*'])))
+    return parameters
+
+
 def read_recorder_log(screen_dump):
     screen_list = read_csv_file(screen_dump)
     last_screen = None
@@ -44,7 +265,8 @@ def read_recorder_log(screen_dump):
     return screen_list_out
 
 
-def make_janirs_sequence(sequence):
+def make_janirs_sequence(sequence, random_state=None):
+    shuffle = (random_state or random).shuffle
     shuffled = False
     while not shuffled:
         shuffle(sequence)
@@ -54,14 +276,16 @@ def make_janirs_sequence(sequence):
                 shuffled = False
     return sequence
 
-def make_sequence_from_list(state_list, times=None):
+def make_sequence_from_list(state_list, times=None, random_state=None):
+    shuffle = (random_state or random).shuffle
     if times:
         long_state_list = list(chain.from_iterable(repeat(e, times[0]) for e in state_list))
         shuffle(long_state_list)
         return True, long_state_list
 
 
-def make_now_really_real_jap_sequence(items, times_per_item=None):
+def make_now_really_real_jap_sequence(items, times_per_item=None, random_state=None):
+    shuffle = (random_state or random).shuffle
     if times_per_item:
         if len(times_per_item) == 1:
             times_per_item = times_per_item * len(items)
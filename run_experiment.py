@@ -14,19 +14,18 @@ try:
     from constants_local import *
 except:
     print(sys.exc_info())
-from threading import Thread, Event, Lock
-from framework import pygaze_framework, eyetracker_gui, jap_pygaze_framework
+from threading import Thread, Event
+from framework import pygaze_framework, eyetracker_gui, jap_pygaze_framework, asset_cache, simulated_tracker
+from framework.random_streams import session_rng
 from framework.stuff import colored_text, encapsulate_text, StopWatch, print_threads
 from framework.tools import make_sequence_from_list
 import os
 import shutil
 import time
 import datetime
-import random
 import json
 import pprint
 import pickle
-from numpy.random import choice, uniform
 from numpy import asarray, array, repeat
 from agents import AgentMacroBehavior, BlinkingAgent_Dict, Passive_Agent_Dict, IJA_Agent_Dict
 from agents import RJA_Agent_Dict, Mixed_Agent_Dict
@@ -209,7 +208,8 @@ class JAP_Experiment:
                     self.gui.eyetracker_setup_window.agent_list.item(n_item))
             if not self.gui.is_block_button_checked():
                 self.gui.eyetracker_setup_window.block_button_dict[
-                        random.choice(self.gui.eyetracker_setup_window.block_button_dict.keys())].setChecked(True)
+                        session_rng.stdlib('block').choice(
+                            sorted(self.gui.eyetracker_setup_window.block_button_dict.keys()))].setChecked(True)
             self.gui.eyetracker_setup_window.create_agent()
         agent_data_event.wait()
         agent_data = self.gui.get_agent_data()
@@ -246,7 +246,8 @@ class JAP_Experiment:
         # key_input_handler.start()
 
         # Initialize ObjectPicker to select objects to be presented
-        self.object_picker = jap_pygaze_framework.ObjectPicker(JAP_TAR_NAMES, JAP_TAR_DIR_LIST)
+        self.object_picker = jap_pygaze_framework.ObjectPicker(JAP_TAR_NAMES, JAP_TAR_DIR_LIST,
+                                                                random_state=session_rng.stdlib('ObjectPicker'))
 
         ###############################################################
         # Create sequence from information given in study config file #
@@ -259,10 +260,12 @@ class JAP_Experiment:
                 print('making sequence')
                 if args.exp_type == 'ja_nirs':
                     ok, behavioral_sequence = make_sequence_from_list(block_chosen['states'],
-                                                                      block_chosen['times_per_state'])
+                                                                      block_chosen['times_per_state'],
+                                                                      random_state=session_rng.stdlib('sequence'))
                 elif args.exp_type == 'basic':
                     ok, behavioral_sequence = make_sequence_from_list(block_chosen['states'],
-                                                                                block_chosen['times_per_state'])
+                                                                      block_chosen['times_per_state'],
+                                                                      random_state=session_rng.stdlib('sequence'))
                 else:
                     raise Exception('Sequence generation not specified for this study type!')
                 if ok:
@@ -299,6 +302,10 @@ class JAP_Experiment:
             if seq['trial_type'] is not None:
                 seq['trial_param']['correct_aoi'] = JAP_TRIAL_TYPES[seq['trial_type']]['correct_aoi']
 
+        # Load resized agent and object images from disk instead of resampling them (see framework/asset_cache.py)
+        if JAP_ASSET_CACHE:
+            pygaze_framework.image_cache.asset_cache = asset_cache.AssetCache(JAP_ASSET_CACHE_DIR)
+
         # Initialize ScreenHandler to manage screens to be display
         self.scr_hdlr = jap_pygaze_framework.JAP_ScreenHandler(JAP_AGT_DIR['male_test'], JAP_AGT_SIZE, JAP_AGT_POS,
                                                                JAP_AGT_DICT, JAP_TAR_SIZE, JAP_TAR_POS,
@@ -308,39 +315,55 @@ class JAP_Experiment:
                                                                JAP_MIN_INSTR_READ_TIME, JAP_TXT_B1, JAP_WELCOME_TEXT,
                                                                JAP_TAR_DIR_LIST, behavioral_sequence, JAP_NIRS,
                                                                CORRECT_COLOUR, BORDER_WIDTH_CIRCLE, BORDER_WIDTH_AOI,
-                                                               SCREENNR, resize_proportional=True)
+                                                               SCREENNR, resize_proportional=True,
+                                                               trial_lookahead=JAP_TRIAL_LOOKAHEAD,
+                                                               refresh_rate=REFRESH_RATE)
 
         self.scr_hdlr.make_fix_cross_screen()  # Make a screen with a fixation cross only
-        self.draw = pygaze_framework.MyEvent() # Create an event that is fired when screen needs to be updated on the display.
-        draw_lock = Lock()  # Lock to prevent that more than one thread is trying to change the screen to prevent weird agent behavior
+        self.draw = pygaze_framework.DrawPipeline() # Create an event that is fired when screen needs to be updated on the display.
+        draw_lock = pygaze_framework.CallbackLock()  # Lock to prevent that more than one thread is trying to change the screen to prevent weird agent behavior
         self.draw.msg2 = JAP_AGT_START_GAZE  # Set start gaze for draw message
-        self.wait_4_instr = Event()  # Event to wait for key press by participant to continue in experimental flow.
+        latency_log = pygaze_framework.LatencyLog()  # Latencies of the agent's reactions to fixations
+        # Event to wait for key press by participant to continue in experimental flow.
+        self.wait_4_instr = pygaze_framework.CallbackEvent()
         self.wait_4_instr.clear()
 
         # Create logger dict
         logger_dict = {
-                'screen_recorder': [pygaze_framework.MyEvent(), JAP_SCR_REC_COLS],
-                'ija_recorder': [pygaze_framework.MyEvent(), ['time_experiment', 'time_tracker', 'time_agent', 'msg',
-                                                              'target']],
-                'rja_recorder': [pygaze_framework.MyEvent(), ['time_experiment', 'time_tracker', 'time_agent', 'msg',
-                                                              'target']],
-                'fixation_recorder': [pygaze_framework.MyEvent(), ['time_experiment', 'time_tracker', 'time_fixation',
-                                                                   'pos_fixation', 'AOI']],
-                'questionnaire_recorder': [pygaze_framework.MyEvent(), ['time_experiment', 'time_tracker',
-                                                                        'time_presented', 'time_key_press', 'agent',
-                                                                        'question', 'answer']],
-                'score_recorder': [pygaze_framework.MyEvent(), ['time_experiment', 'time_tracker', 'time_event',
-                                                                'score']],
-                'agent_rating_recorder': [pygaze_framework.MyEvent(), ['time_experiment', 'time_tracker', 'agent',
-                                                                       'question', 'rating_history']]}
+                'screen_recorder': [pygaze_framework.LogQueue(), JAP_SCR_REC_COLS],
+                'ija_recorder': [pygaze_framework.LogQueue(), ['time_experiment', 'time_tracker', 'time_agent', 'msg',
+                                                               'target']],
+                'rja_recorder': [pygaze_framework.LogQueue(), ['time_experiment', 'time_tracker', 'time_agent', 'msg',
+                                                               'target']],
+                'fixation_recorder': [pygaze_framework.LogQueue(), ['time_experiment', 'time_tracker', 'time_fixation',
+                                                                    'pos_fixation', 'AOI']],
+                'questionnaire_recorder': [pygaze_framework.LogQueue(), ['time_experiment', 'time_tracker',
+                                                                         'time_presented', 'time_key_press', 'agent',
+                                                                         'question', 'answer']],
+                'score_recorder': [pygaze_framework.LogQueue(), ['time_experiment', 'time_tracker', 'time_event',
+                                                                 'score']],
+                'agent_rating_recorder': [pygaze_framework.LogQueue(), ['time_experiment', 'time_tracker', 'agent',
+                                                                        'question', 'rating_history']]}
         # Initialize eyetracker (Only checked for Tobii SDK)
         if JAP_TRACKING:
-            self.tracker = eyetracker.EyeTracker(self.scr_hdlr.display)
+            if JAP_DUMMY:
+                # simulated tobii tracker generating (or replaying) gaze
+                self.tracker = simulated_tracker.SimulatedTracker(DISPSIZE, rate=JAP_DUMMY_RATE,
+                                                                  replay=JAP_DUMMY_REPLAY, speed=JAP_DUMMY_SPEED,
+                                                                  seed=session_rng.component_seed('SimulatedTracker'),
+                                                                  vel_thresh=SACCVELTHRESH, acc_thresh=SACCACCTHRESH)
+            else:
+                self.tracker = eyetracker.EyeTracker(self.scr_hdlr.display)
             self.gui.set_eyetracker(self.tracker)
-            if TRACKERTYPE == 'tobii':
+            if TRACKERTYPE == 'tobii' or JAP_DUMMY:
                 # initialize thread for fixation detection
+                if JAP_STREAMING_FIXATIONS:
+                    fixation_source = pygaze_framework.EventHandler.StreamingFixationDetector(
+                            self.tracker, DISPSIZE, SACCVELTHRESH, SACCACCTHRESH)
+                else:
+                    fixation_source = None
                 fixation_detector = pygaze_framework.EventHandler.Fixation_Detector(
-                        self.tracker, logger_dict['fixation_recorder'][0])
+                        self.tracker, logger_dict['fixation_recorder'][0], fixation_source=fixation_source)
                 # initialize data logging using pygaze framework routines
                 tobii_save_event = Event()
                 self.logger = jap_pygaze_framework.JAP_LogManager(JAP_LOG_DIR, agent_data['block'],
@@ -351,7 +374,10 @@ class JAP_Experiment:
                                                                   mucap_wmv=JAP_VIDEO,
                                                                   fixation_data=fixation_detector.fixation_list,
                                                                   log_dict=logger_dict, screenshots=True,
-                                                                  tobii_save_event=tobii_save_event)
+                                                                  tobii_save_event=tobii_save_event,
+                                                                  tobii_dump_format=JAP_TOBII_DUMP_FORMAT)
+                if JAP_SAMPLE_AOIS:
+                    self.logger.tobii_dumper.set_sample_aois(fixation_detector.aois, DISPSIZE)
                 stimtracker_test = Stimtracker_Test(tobii_save_event, self.logger.tobii_dumper.dump_file,
                                                     self.gui.eyetracker_setup_window.stimtracker_status_button, True)
                 stimtracker_test.start()
@@ -488,13 +514,15 @@ class JAP_Experiment:
 
         # Create all screen that might be shown in a experiment (only with one set of objects)
         self.scr_hdlr.make_all_screens(target_dict, states2draw, aoi_tol=JAP_AOI_TOL)
+        if JAP_NEW_OBJECTS and JAP_PREPARE_OBJECTS and self.scr_hdlr.rand_obj:
+            self.scr_hdlr.start_object_set_builder()  # prepare the objects of the next trial in the background
         self.event_handler.time = 500 #(??)
         self.cur_agt = JAP_AGT_START_GAZE  #(??) Das ist oben nochma
 
         agent_finished = Event()  # Event for signaling that time for current macro state is up
         macro_finished = Event()  # Event for signaling macro state sequence end
-        self.blinking = Lock()  # Event to check whether agent is currently blinking
-        agent_break_event = Event() # (??)
+        self.blinking = pygaze_framework.CallbackLock()  # Event to check whether agent is currently blinking
+        agent_break_event = pygaze_framework.CallbackEvent() # (??)
         print('LOLO2')
         # Initialize and state class for gamification (score tracking)
         game_hub = jap_pygaze_framework.GameHub(log_event=logger_dict['score_recorder'][0])
@@ -568,7 +596,7 @@ class JAP_Experiment:
                                                        behavioral_sequence, block_chosen['baseline'],
                                                        JAP_AGT_START_GAZE, JAP_AGT_START_GAZE_DUR, JAP_TRANS_DICT2,
                                                        age_group, end_on_key_input,
-                                                       self.logger.tobii_dumper.save_trigger, game_hub, JAP_NIRS,
+                                                       self.logger.tobii_dumper.mark, game_hub, JAP_NIRS,
                                                        ['Mixed_Agent'], blinking_agent, ija_agent,
                                                        passive_agent_partner_oriented, passive_agent_introspective,
                                                        passive_agent_object_oriented, rja_agent, mixed_agent)
@@ -675,237 +703,282 @@ class JAP_Experiment:
             draw_time = self.scr_hdlr.make_and_draw_screen(JAP_INBTW_TEXT[age_group]['wait'])
             logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, 'wait_screen', screen_count])
             screen_count += 1
-            libtime.pause(uniform(1000, 5000))
+            libtime.pause(session_rng.numpy('JAP_Experiment').uniform(1000, 5000))
 
         ########################
         # START AGENT BEHAVIOR #
         ########################
 
-        loop_on = True
-        draw_event_set_time = None
-        answer_key = None
-        inital_questionnaire = None
+        # State of the presentation loop, shared by the handlers below
+        loop_state = {'loop_on': True, 'draw_event_set_time': None, 'answer_key': None, 'initial_questionnaire': None,
+                      'screen_count': screen_count, 'block_progress': block_progress, 'target_dict': target_dict,
+                      'keys_read_until': 0}
         # Start threads for agent's behavior and fixation detection
         self.agent_macro_behavior.start()  # Start macro state sequence
         fixation_detector.start()  # Start fixation detector
+        # Forward key presses from ioHub into the draw queue
+        self.event_handler.forward_keys(self.draw)
+        self.event_handler.start()
 
         self.draw.clear()
         self.first_run = True
 
-        #################################
-        # LOOP FOR SCREEN PRESENTATIONS #
-        #################################
-        while loop_on:
-            draw_time = None
-            self.keyboard.get_key(None, 0, flush=True)  # Clear keyboard input
-            # Wait for new agent to draw:
-            # If timeout is reached none will be returned and loop will continue
-            draw_instruction = self.draw.wait(timeout=.1)
-
-            # ???
-            if not self.draw.time == draw_event_set_time:
-                draw_event_set_time = self.draw.time
-
-            # if draw_instruction == 'startgaze':
-            #     self.time_event.set()
-            #     self.time_event.clear()
-
-            # Check for a valid button press
-            char = self.keyboard.get_key(None, 1)
-            if (char[0] in JAP_QUESTIONNAIRE.keys() and self.agent_macro_behavior.time_agent_started and
+        ########################################
+        # HANDLERS FOR ALL DRAW INSTRUCTIONS   #
+        ########################################
+
+        def handle_key_press(draw_instruction):
+            """ Check for a valid button press """
+            key, press_time = self.draw.request.data
+            # Key presses read by a handler itself (e.g. answers to a questionnaire) are not considered again
+            if press_time < loop_state['keys_read_until']:
+                return
+            if (key in JAP_QUESTIONNAIRE.keys() and self.agent_macro_behavior.time_agent_started and
                     self.agent_macro_behavior.accept_key_input and
                     (libtime.get_time()-self.agent_macro_behavior.time_agent_started)/1000 > block_chosen['min_time']):
                 self.agent_macro_behavior.time_agent_started = None
-                answer_key = char[0]
+                loop_state['answer_key'] = key
                 agent_break_event.set()
-                print(encapsulate_text(str(char), color='blue', background='yellow'))
-                logger_dict['questionnaire_recorder'][0].set([None, char[1],
+                print(encapsulate_text(str((key, press_time)), color='blue', background='yellow'))
+                logger_dict['questionnaire_recorder'][0].set([None, press_time,
                                                               self.agent_macro_behavior.running_agent_name,
-                                                              None, char[0]])
-            # Print to console if new agent is shown on screen
-            if draw_instruction and not draw_instruction == '__gaze_cursor__':
-                print(colored_text(draw_instruction, 'yellow'))
-            # Make and show instruction screen, and wait for keypress
-            if draw_instruction == '__instruction_screen__':
-                instruction_str = self.draw.msg2
-                draw_time = self.scr_hdlr.make_and_draw_screen(instruction_str)
-                self.draw.msg2 = JAP_AGT_START_GAZE
-                logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, 'instruction', screen_count,
-                                                       instruction_str.split('\n')])
-                screen_count += 1
-                # wait for keypress
-                if not skip_instructions and not instruction_str == ' ':
-                    self.keyboard.get_key(None, None, flush=True)
-                else:
-                    libtime.pause(1000)
-                self.wait_4_instr.set()
-
-            # Show a video
-            elif draw_instruction == 'video':
-                # Play video
-                draw_time_s, draw_time_e = movs[self.draw.msg2].play_video()
-                logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time_s, draw_time_e, 'video',
-                                                      self.draw.msg2, screen_count])
-                screen_count += 1
-            # Create new screens
-            elif draw_instruction == '__new_screens__':
-                if self.draw.msg2 == 'empty':
-                    draw_time = self.scr_hdlr.make_and_draw_screen('')
-                    logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, 'empty screen',
-                                                           screen_count])
-                else:
-                    draw_time = self.scr_hdlr.draw_agent_on_target_screen(self.draw.msg2, force_stim_signal=True)
-                    logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, self.draw.msg2,
-                                                           screen_count])
-
-                screen_count += 1
-
-                if JAP_NEW_OBJECTS or self.first_run:
-                    if JAP_NEW_OBJECTS:
-                        target_dict = self.object_picker.get_new_targets()
-                    self.scr_hdlr.make_agent_screens_with_objects(target_dict, states2draw,
-                                                                  fixation_detector=fixation_detector,
-                                                                  aoi_tol=JAP_AOI_TOL, draw_aois=draw_aois,
-                                                                  aoi_border_size=aoi_border_size)
-                    self.first_run = False
-                self.wait_4_instr.set()
-                self.wait_4_instr.clear()
-
-            # Take a screenshot
-            elif draw_instruction == '__screenshot__':
-                if screenshots:
-                    self.scr_hdlr.make_screenshot(self.logger.get_screenshot_name())
-
-            # Change screens and adjust values for screen recorder
-            elif draw_instruction == '__change_screens__':
-                x = len(self.draw.msg2) - 11  # Get object number
-                self.scr_hdlr.change_screen_for_trial(self.draw.msg2)
-                # Adjust values for logging
-                target_dict['left'] = JAP_TRIAL_TYPES[self.draw.msg2]['object_left' + self.draw.msg2[-x:]]
-                target_dict['right'] = JAP_TRIAL_TYPES[self.draw.msg2]['object_right' + self.draw.msg2[-x:]]
-                target_dict['correct'] = JAP_TRIAL_TYPES[self.draw.msg2]['correct_aoi']
-
-            # Add and show a gaze cursor to current screen
-            elif draw_instruction == '__gaze_cursor__':
-                self.scr_hdlr.draw_gaze_cursor(self.tracker)
-
-            # Show a questionnaire
-            elif draw_instruction == '__questionnaire__':
-                print(encapsulate_text('test', color='cyan', background='magenta'))
-                if inital_questionnaire:
-                    initial_questionnaire.set()
-                    initial_questionnaire = None
-                if not skip_key_input:
-                    if answer_key and answer_key in JAP_QUESTIONNAIRE.keys():
-                        question = JAP_QUESTIONNAIRE[answer_key]['question']
-                        draw_time = self.scr_hdlr.make_and_draw_screen(question)
-                        logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, 'questionnaire',
-                                                               screen_count])
-                        char = self.keyboard.get_key(JAP_QUESTIONNAIRE[answer_key]['answers'], None, flush=True)
-                        logger_dict['questionnaire_recorder'][0].set([draw_time, char[1],
-                                                                      self.agent_macro_behavior.running_agent_name,
-                                                                      question.split('\n'), char[0]])
-                        screen_count += 1
-                        answer_key = None
-                    else:
-                        pass
-                        darw_event_set_time = libtime.get_time()
-                        draw_time = self.scr_hdlr.make_and_draw_screen('')
-                        logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, 'empty screen',
-                                                               screen_count])
-                        screen_count += 1
-                        libtime.pause(1000)
-                self.draw.msg2.set()
-                block_progress += 1
-                self.gui.eyetracker_setup_window.progress_bar.setValue(block_progress)
-
-            # Show initial questionaire
-            elif draw_instruction == '__initial_questionnaire__':
-                if not skip_key_input and self.agent_macro_behavior.accept_key_input:
-                    initial_questionnaire = self.draw.msg2
-                    self.draw.msg2 = JAP_AGT_START_GAZE
-                    question = JAP_QUESTIONNAIRE['initial_question']['question']
+                                                              None, key])
+
+        def show_instruction_screen(draw_instruction):
+            """ Make and show instruction screen, and wait for keypress """
+            instruction_str = self.draw.msg2
+            draw_time = self.scr_hdlr.make_and_draw_screen(instruction_str)
+            self.draw.msg2 = JAP_AGT_START_GAZE
+            logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time, 'instruction',
+                                                   loop_state['screen_count'], instruction_str.split('\n')])
+            loop_state['screen_count'] += 1
+            # wait for keypress
+            if not skip_instructions and not instruction_str == ' ':
+                self.keyboard.get_key(None, None, flush=True)
+                loop_state['keys_read_until'] = libtime.get_time()
+            else:
+                libtime.pause(1000)
+            self.wait_4_instr.set()
+
+        def play_video(draw_instruction):
+            """ Show a video """
+            draw_time_s, draw_time_e = movs[self.draw.msg2].play_video()
+            logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time_s, draw_time_e, 'video',
+                                                  self.draw.msg2, loop_state['screen_count']])
+            loop_state['screen_count'] += 1
+
+        def make_new_screens(draw_instruction):
+            """ Create new screens """
+            if self.draw.msg2 == 'empty':
+                draw_time = self.scr_hdlr.make_and_draw_screen('')
+                logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time, 'empty screen',
+                                                       loop_state['screen_count']])
+            else:
+                draw_time = self.scr_hdlr.draw_agent_on_target_screen(self.draw.msg2, force_stim_signal=True)
+                logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time, self.draw.msg2,
+                                                       loop_state['screen_count']])
+
+            loop_state['screen_count'] += 1
+
+            if JAP_NEW_OBJECTS or self.first_run:
+                images = None
+                if JAP_NEW_OBJECTS:
+                    loop_state['target_dict'], images = self.scr_hdlr.get_new_object_set()
+                self.scr_hdlr.make_agent_screens_with_objects(loop_state['target_dict'], states2draw,
+                                                              fixation_detector=fixation_detector,
+                                                              aoi_tol=JAP_AOI_TOL, draw_aois=draw_aois,
+                                                              aoi_border_size=aoi_border_size, images=images)
+                self.first_run = False
+            self.wait_4_instr.set()
+            self.wait_4_instr.clear()
+
+        def take_screenshot(draw_instruction):
+            """ Take a screenshot """
+            if screenshots:
+                self.scr_hdlr.make_screenshot(self.logger.get_screenshot_name())
+
+        def change_screens(draw_instruction):
+            """ Change screens and adjust values for screen recorder """
+            x = len(self.draw.msg2) - 11  # Get object number
+            self.scr_hdlr.change_screen_for_trial(self.draw.msg2)
+            # Adjust values for logging
+            target_dict = loop_state['target_dict']
+            target_dict['left'] = JAP_TRIAL_TYPES[self.draw.msg2]['object_left' + self.draw.msg2[-x:]]
+            target_dict['right'] = JAP_TRIAL_TYPES[self.draw.msg2]['object_right' + self.draw.msg2[-x:]]
+            target_dict['correct'] = JAP_TRIAL_TYPES[self.draw.msg2]['correct_aoi']
+
+        def draw_gaze_cursor(draw_instruction):
+            """ Add and show a gaze cursor to current screen """
+            self.scr_hdlr.draw_gaze_cursor(self.tracker)
+
+        def show_questionnaire(draw_instruction):
+            """ Show a questionnaire """
+            print(encapsulate_text('test', color='cyan', background='magenta'))
+            if loop_state['initial_questionnaire']:
+                loop_state['initial_questionnaire'].set()
+                loop_state['initial_questionnaire'] = None
+            if not skip_key_input:
+                answer_key = loop_state['answer_key']
+                if answer_key and answer_key in JAP_QUESTIONNAIRE.keys():
+                    question = JAP_QUESTIONNAIRE[answer_key]['question']
                     draw_time = self.scr_hdlr.make_and_draw_screen(question)
-                    logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, 'initial_questionnaire',
-                                                           screen_count])
-                    screen_count += 1
-                    char = self.keyboard.get_key(JAP_QUESTIONNAIRE['initial_question']['answers'], None, flush=True)
-                    print(char)
+                    logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time,
+                                                           'questionnaire', loop_state['screen_count']])
+                    char = self.keyboard.get_key(JAP_QUESTIONNAIRE[answer_key]['answers'], None, flush=True)
+                    loop_state['keys_read_until'] = libtime.get_time()
                     logger_dict['questionnaire_recorder'][0].set([draw_time, char[1],
                                                                   self.agent_macro_behavior.running_agent_name,
                                                                   question.split('\n'), char[0]])
-                    initial_questionnaire.set()
+                    loop_state['screen_count'] += 1
+                    loop_state['answer_key'] = None
                 else:
-                    self.draw.msg2.set()
-                block_progress += 1
-                self.gui.eyetracker_setup_window.progress_bar.setValue(block_progress)
-
-            # Show a wait screen
-            elif draw_instruction == '__wait_screen__':
-                draw_time = self.scr_hdlr.make_and_draw_screen(JAP_TXT_B1[age_group]['wait'])
-                logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, 'wait_screen', screen_count])
-                screen_count += 1
-
-            elif draw_instruction == '__baseline__':
-                port.write(JAP_NIRS['trigger_base_line_start'])
-                t0, t1 = self.scr_hdlr.show_base_line_screen_w_progress(self.draw.msg2, self.draw.msg3)
+                    draw_time = self.scr_hdlr.make_and_draw_screen('')
+                    logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time,
+                                                           'empty screen', loop_state['screen_count']])
+                    loop_state['screen_count'] += 1
+                    libtime.pause(1000)
+            self.draw.msg2.set()
+            loop_state['block_progress'] += 1
+            self.gui.eyetracker_setup_window.progress_bar.setValue(loop_state['block_progress'])
+
+        def show_initial_questionnaire(draw_instruction):
+            """ Show initial questionaire """
+            if not skip_key_input and self.agent_macro_behavior.accept_key_input:
+                initial_questionnaire = self.draw.msg2
+                self.draw.msg2 = JAP_AGT_START_GAZE
+                question = JAP_QUESTIONNAIRE['initial_question']['question']
+                draw_time = self.scr_hdlr.make_and_draw_screen(question)
+                logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time,
+                                                       'initial_questionnaire', loop_state['screen_count']])
+                loop_state['screen_count'] += 1
+                char = self.keyboard.get_key(JAP_QUESTIONNAIRE['initial_question']['answers'], None, flush=True)
+                loop_state['keys_read_until'] = libtime.get_time()
+                print(char)
+                logger_dict['questionnaire_recorder'][0].set([draw_time, char[1],
+                                                              self.agent_macro_behavior.running_agent_name,
+                                                              question.split('\n'), char[0]])
+                initial_questionnaire.set()
+            else:
+                self.draw.msg2.set()
+            loop_state['block_progress'] += 1
+            self.gui.eyetracker_setup_window.progress_bar.setValue(loop_state['block_progress'])
+
+        def show_wait_screen(draw_instruction):
+            """ Show a wait screen """
+            draw_time = self.scr_hdlr.make_and_draw_screen(JAP_TXT_B1[age_group]['wait'])
+            logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time, 'wait_screen',
+                                                   loop_state['screen_count']])
+            loop_state['screen_count'] += 1
+
+        def show_baseline(draw_instruction):
+            port.write(JAP_NIRS['trigger_base_line_start'])
+            t0, t1 = self.scr_hdlr.show_base_line_screen_w_progress(self.draw.msg2, self.draw.msg3)
+            self.draw.msg3 = None
+            logger_dict['screen_recorder'][0].set([t0, t1, 'baseline', loop_state['screen_count']])
+            loop_state['screen_count'] += 1
+            port.write(JAP_NIRS['trigger_base_line_end'])
+
+        def send_trigger(draw_instruction):
+            port.write(JAP_NIRS[self.draw.msg2])
+
+        def finish_loop(draw_instruction):
+            """ The macro state sequence is done """
+            loop_state['loop_on'] = False
+
+        def draw_agent_screen(draw_instruction):
+            """ Anything else (i.e. a gaze shift by the agent) """
+            draw_time = None
+            target_dict = loop_state['target_dict']
+            if gamify:
+                score = game_hub.score
+            else:
+                score = None
+            if draw_instruction in self.scr_hdlr.screens.keys() or draw_instruction[:-1] == 'startgaze':
+                if JAP_SHOW_GAZE_CURSER:
+                    # show gaze cursor
+                    if draw_instruction:
+                        # if new agent is to be drawn get it
+                        self.cur_agt = draw_instruction
+                    draw_time = self.scr_hdlr.draw_agent_on_target_screen(self.cur_agt, tracker=self.tracker,
+                                                                          aoi=self.draw.msg3)
+                else:
+                    if draw_instruction:
+                        # if there is a new agent to draw it will be shown on the screen
+                        if draw_instruction[:-1] == 'startgaze':
+                            draw_time = self.scr_hdlr.draw_agent_on_target_screen(draw_instruction[:-1],
+                                                                                  force_stim_signal=True,
+                                                                                  score=score, aoi=self.draw.msg3,
+                                                                                  correct=self.draw.msg4)
+                        else:
+                            draw_time = self.scr_hdlr.draw_agent_on_target_screen(draw_instruction,
+                                                                                  force_stim_signal=True,
+                                                                                  score=score, aoi=self.draw.msg3,
+                                                                                  correct=self.draw.msg4)
                 self.draw.msg3 = None
-                logger_dict['screen_recorder'][0].set([t0, t1, 'baseline', screen_count])
-                screen_count += 1
-                port.write(JAP_NIRS['trigger_base_line_end'])
+                if JAP_LATENCY_LOG and self.draw.trace is not None and draw_time is not None:
+                    # the agent reacted to a fixation, complete its latency trace
+                    self.draw.trace.mark('flip', draw_time)
+                    latency_log.add(self.draw.trace)
+                if draw_instruction:
+                    # if there was a new agent to draw this will be written to log
+                    if args.exp_type == 'ja_nirs':
+                        logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time,
+                                                               draw_instruction, loop_state['screen_count'],
+                                                               target_dict['left'], target_dict['right'],
+                                                               target_dict['correct'], self.draw.msg4])
+
+                    elif args.exp_type == 'basic':
+                        logger_dict['screen_recorder'][0].set([loop_state['draw_event_set_time'], draw_time,
+                                                               draw_instruction, loop_state['screen_count'],
+                                                               target_dict['tar_up_left'], target_dict['tar_up_right'],
+                                                               target_dict['tar_down_left'],
+                                                               target_dict['tar_down_right']])
+                    loop_state['screen_count'] += 1
+            else:
+                print(encapsulate_text(colored_text(draw_instruction, 'blue'), color='red'))
+
+        # Handler for each draw instruction, everything else is a screen of the agent
+        draw_handlers = {'__key_press__': handle_key_press,
+                         '__instruction_screen__': show_instruction_screen,
+                         'video': play_video,
+                         '__new_screens__': make_new_screens,
+                         '__screenshot__': take_screenshot,
+                         '__change_screens__': change_screens,
+                         '__gaze_cursor__': draw_gaze_cursor,
+                         '__questionnaire__': show_questionnaire,
+                         '__initial_questionnaire__': show_initial_questionnaire,
+                         '__wait_screen__': show_wait_screen,
+                         '__baseline__': show_baseline,
+                         '__send_trigger__': send_trigger,
+                         '__macro_finished__': finish_loop}
+        # Instructions which are queued without acquiring draw_lock
+        unlocked_instructions = ['__key_press__', '__gaze_cursor__', '__macro_finished__']
 
-            elif draw_instruction == '__send_trigger__':
-                port.write(JAP_NIRS[self.draw.msg2])
+        #################################
+        # LOOP FOR SCREEN PRESENTATIONS #
+        #################################
+        while loop_state['loop_on']:
+            # Block until there is something to draw or a key was pressed. Requests wake the loop immediately, the
+            # timeout only keeps the window's event queue serviced while nothing is drawn
+            draw_instruction = self.draw.wait(timeout=1.)
+            if draw_instruction is None:
+                self.keyboard.get_key(None, 0, flush=True)
+                continue
+
+            if not self.draw.time == loop_state['draw_event_set_time']:
+                loop_state['draw_event_set_time'] = self.draw.time
+
+            # Print to console if new agent is shown on screen
+            if draw_instruction not in ['__gaze_cursor__', '__key_press__']:
+                print(colored_text(draw_instruction, 'yellow'))
+            draw_handlers.get(draw_instruction, draw_agent_screen)(draw_instruction)
 
-            # Anything else (i.e. a gaze shift by the agent)
-            elif draw_instruction:
-                if gamify:
-                    score = game_hub.score
-                else:
-                    score = None
-                if draw_instruction in self.scr_hdlr.screens.keys() or draw_instruction[:-1] == 'startgaze':
-                    if JAP_SHOW_GAZE_CURSER:
-                        # show gaze cursor
-                        if draw_instruction:
-                            # if new agent is to be drawn get it
-                            self.cur_agt = draw_instruction
-                        draw_time = self.scr_hdlr.draw_agent_on_target_screen(self.cur_agt, tracker=self.tracker,
-                                                                              aoi=self.draw.msg3)
-                    else:
-                        if draw_instruction:
-                            # if there is a new agent to draw it will be shown on the screen
-                            if draw_instruction[:-1] == 'startgaze':
-                                draw_time = self.scr_hdlr.draw_agent_on_target_screen(draw_instruction[:-1],
-                                                                                      force_stim_signal=True,
-                                                                                      score=score, aoi=self.draw.msg3,
-                                                                                      correct=self.draw.msg4)
-                            else:
-                                draw_time = self.scr_hdlr.draw_agent_on_target_screen(draw_instruction,
-                                                                                      force_stim_signal=True,
-                                                                                      score=score, aoi=self.draw.msg3,
-                                                                                      correct=self.draw.msg4)
-                    self.draw.msg3 = None
-                    if draw_instruction:
-                        # if there was a new agent to draw this will be written to log
-                        if args.exp_type == 'ja_nirs':
-                            logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, draw_instruction,
-                                                                  screen_count, target_dict['left'],
-                                                                  target_dict['right'], target_dict['correct'],
-                                                                  self.draw.msg4])
-
-                        elif args.exp_type == 'basic':
-                            logger_dict['screen_recorder'][0].set([draw_event_set_time, draw_time, draw_instruction,
-                                                                   screen_count, target_dict['tar_up_left'],
-                                                                   target_dict['tar_up_right'],
-                                                                   target_dict['tar_down_left'],
-                                                                   target_dict['tar_down_right']])
-                        screen_count += 1
-                else:
-                    print(encapsulate_text(colored_text(draw_instruction, 'blue'), color='red'))
             if macro_finished.is_set():
-                loop_on = False
-            if draw_instruction is not None:
+                loop_state['loop_on'] = False
+            self.draw.task_done()
+            if draw_instruction not in unlocked_instructions:
                 draw_lock.release()
+        screen_count = loop_state['screen_count']
 
 # --------------------------------------------------------------------------------------------------------------
 # Loop for displaying stuff done
@@ -942,11 +1015,21 @@ class JAP_Experiment:
         if JAP_TRACKING and JAP_SHOW_GAZE_CURSER:
             self.trigger.stop()
         game_hub.stop()
+        self.scr_hdlr.stop_object_set_builder()
         self.event_handler.stop()
         fixation_detector.stop()
         save_started = libtime.get_time()
         print(encapsulate_text("Don't panic! Just saving data.", color='red'))
         self.logger.stop()
+        if JAP_LATENCY_LOG and latency_log.traces:
+            latency_log.summary()
+            latency_log.save(os.path.join(self.logger.data_dir, self.logger.data['code'] + '_latency'))
+        if JAP_FRAME_TIMING:
+            self.scr_hdlr.frame_timer.summary()
+            self.scr_hdlr.frame_timer.save(os.path.join(self.logger.data_dir,
+                                                        self.logger.data['code'] + '_frame_timing'))
+        # Save the seeds of all streams used to replay the session's random numbers
+        session_rng.save(os.path.join(self.logger.data_dir, self.logger.data['code'] + '_seeds'))
 
         # Stop/Pause fNIRS recording
         if JAP_FACE_READING:
@@ -1015,6 +1098,8 @@ if __name__ == '__main__':
                         help='run a stopwatch during the experiment, printing the current time every SEC')
     parser.add_argument('--force_quit', default=False, action='store_true', help='force experiment to quit at the end')
     parser.add_argument('--gamify', default=False, action='store_true', help='Will present some score on screen')
+    parser.add_argument('--seed', default=None, type=int,
+                        help='seed of the session\'s random numbers, overrides JAP_SEED')
     parser.add_argument('--block', default=None, type=str, metavar='BLOCK', help='set block to run')
     parser.add_argument('--exp_type', default=None, type=str, help='select an experiment type: basic or ja_nirs,' +
                         ' their corresponding config file will be imported')
@@ -1057,6 +1142,10 @@ if __name__ == '__main__':
     else:
         from studies.basic import *
 
+    # Seed the session after the study file is imported, it may set JAP_SEED
+    session_rng.seed_session(args.seed if args.seed is not None else JAP_SEED)
+    print('Session seed: %d' % session_rng.seed)
+
     # If set, import FaceReader client
     if JAP_FACE_READING:
         from msrresearch_helpers import facereader